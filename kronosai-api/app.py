@@ -1,14 +1,25 @@
 import os
-from flask import Flask, jsonify, request
+import time
+from flask import Flask, Response, g, jsonify, request, stream_with_context
 from flask_cors import CORS
 import logging
 import sys
-from scripts.api_interaction import read_api_key, generate_response_and_name_chat
-import openai
-from openai._exceptions import OpenAIError, RateLimitError
+from scripts.api_interaction import read_api_key, warm_up, generate_response_and_name_chat, stream_response_and_name_chat
+from scripts.metrics import render_metrics, start_request_timing
+from scripts.request_handling import (
+    SSE_HEADERS,
+    ReplyStream,
+    parse_message_request,
+    message_reply,
+    error_message,
+    chat_reply,
+    is_admin_request,
+    batch_summarize_reply,
+    finish_request_timing,
+)
 
 app = Flask(__name__)
-CORS(app, resources={r"/*": {"origins": "*"}})  # Allow all origins for now
+CORS(app, resources={r"/*": {"origins": "*"}}, expose_headers=["Server-Timing"])  # Allow all origins for now
 
 # Configure logging to stdout
 logging.basicConfig(stream=sys.stdout, level=logging.DEBUG)
@@ -19,6 +30,26 @@ app.logger.info('Kronosai API startup')
 # Read the API key from 'api_key.txt'
 api_key = read_api_key('api_key.txt')
 
+# Build the shared, pooled OpenAI client (and load the SDK and tokenizer) in the background at startup
+warm_up(api_key)
+
+@app.before_request
+def start_timing():
+    g.started = time.perf_counter()
+    g.timings = start_request_timing()
+
+# Records request latency and, when enabled, reports the stage breakdown in a Server-Timing header
+@app.after_request
+def finish_timing(response):
+    started = g.get('started')
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    timing = finish_request_timing(route, response.status_code, started, g.timings, request.headers)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
 @app.route('/')
 def home():
     return "Welcome to the Kronosai API"
@@ -26,27 +57,52 @@ def home():
 @app.route('/send_message', methods=['POST'])
 def send_message():
     try:
-        data = request.json
-        user_input = data.get('user_input', '').strip()
-        chat_history = data.get('chat_history', [])
-        if not user_input:
-            return jsonify({"error": "User input is required"}), 400
-
-        chat_title = data.get('chat_title', 'New Chat')
+        try:
+            message = parse_message_request(request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
 
         # Generate the chat response
-        chat_name, response = generate_response_and_name_chat(user_input, chat_history, api_key, chat_title)
-
-        return jsonify({"response": response, "chat_name": chat_name})
-    except RateLimitError as e:
-        app.logger.error(f"Rate limit error: {e}")
-        return jsonify({"error": "Rate limit error occurred"}), 500
-    except OpenAIError as e:
-        app.logger.error(f"OpenAI error: {e}")
-        return jsonify({"error": "OpenAI error occurred"}), 500
+        chat_name, response = generate_response_and_name_chat(message.user_input, message.summarized_context, api_key, message.chat_title, context_key=message.context_key)
+        return jsonify(message_reply(message, chat_name, response))
     except Exception as e:
-        app.logger.error(f"Error in send_message: {e}")
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"error": error_message(e, app.logger, "send_message")}), 500
+
+@app.route('/send_message/stream', methods=['POST'])
+def send_message_stream():
+    try:
+        message = parse_message_request(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Server-sent events: the chat name first, then response deltas as they arrive
+    def generate():
+        stream = ReplyStream(message)
+        try:
+            for event in stream_response_and_name_chat(message.user_input, message.summarized_context, api_key, message.chat_title, context_key=message.context_key):
+                yield stream.event(event)
+            stream.record()
+            yield stream.done()
+        except Exception as e:
+            yield stream.error(e, app.logger)
+
+    return Response(stream_with_context(generate()), headers=SSE_HEADERS)
+
+@app.route('/chats/<chat_id>', methods=['GET'])
+def get_chat(chat_id):
+    payload, status = chat_reply(chat_id)
+    return jsonify(payload), status
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/batch_summarize', methods=['GET', 'POST', 'DELETE'])
+def admin_batch_summarize():
+    if not is_admin_request(request.headers):
+        return jsonify({"error": "Not found"}), 404
+    payload, status = batch_summarize_reply(request.method, request.get_json(silent=True) if request.method == 'POST' else None, api_key)
+    return jsonify(payload), status
 
 if __name__ == "__main__":
     app.run(debug=True, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,112 @@
+import time
+import asyncio
+import logging
+import sys
+from quart import Quart, Response, g, jsonify, request
+from quart_cors import cors
+from scripts.api_interaction import read_api_key, warm_up
+from scripts.async_api_interaction import get_async_client, async_generate_response_and_name_chat, async_stream_response_and_name_chat
+from scripts.metrics import render_metrics, start_request_timing
+from scripts.request_handling import (
+    SSE_HEADERS,
+    ReplyStream,
+    parse_message_request,
+    message_reply,
+    error_message,
+    chat_reply,
+    is_admin_request,
+    batch_summarize_reply,
+    finish_request_timing,
+)
+
+# Async serving path: same routes as app.py, but requests wait on OpenAI as coroutines instead of threads.
+# Parsing and replies come from scripts/request_handling.py; anything there that reads or writes storage
+# runs in a thread so the event loop never waits on disk.
+app = Quart(__name__)
+app = cors(app, allow_origin="*", expose_headers=["Server-Timing"])  # Allow all origins for now
+
+# Configure logging to stdout
+logging.basicConfig(stream=sys.stdout, level=logging.INFO)
+
+app.logger.setLevel(logging.INFO)
+app.logger.info('Kronosai async API startup')
+
+# Read the API key from 'api_key.txt'
+api_key = read_api_key('api_key.txt')
+
+# Build the shared, pooled AsyncOpenAI client (and load the SDK and tokenizer) in the background at startup
+warm_up(api_key, get_async_client)
+
+@app.before_request
+async def start_timing():
+    g.started = time.perf_counter()
+    g.timings = start_request_timing()
+
+# Records request latency and, when enabled, reports the stage breakdown in a Server-Timing header
+@app.after_request
+async def finish_timing(response):
+    started = g.get('started')
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    timing = finish_request_timing(route, response.status_code, started, g.timings, request.headers)
+    if timing:
+        response.headers['Server-Timing'] = timing
+    return response
+
+@app.route('/')
+async def home():
+    return "Welcome to the Kronosai API"
+
+@app.route('/send_message', methods=['POST'])
+async def send_message():
+    try:
+        try:
+            message = await asyncio.to_thread(parse_message_request, await request.get_json(silent=True))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # Generate the chat response
+        chat_name, response = await async_generate_response_and_name_chat(message.user_input, message.summarized_context, api_key, message.chat_title, context_key=message.context_key)
+        return jsonify(await asyncio.to_thread(message_reply, message, chat_name, response))
+    except Exception as e:
+        return jsonify({"error": error_message(e, app.logger, "send_message")}), 500
+
+@app.route('/send_message/stream', methods=['POST'])
+async def send_message_stream():
+    try:
+        message = await asyncio.to_thread(parse_message_request, await request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    # Server-sent events: the chat name first, then response deltas as they arrive
+    async def generate():
+        stream = ReplyStream(message)
+        try:
+            async for event in async_stream_response_and_name_chat(message.user_input, message.summarized_context, api_key, message.chat_title, context_key=message.context_key):
+                yield stream.event(event)
+            await asyncio.to_thread(stream.record)
+            yield stream.done()
+        except Exception as e:
+            yield stream.error(e, app.logger)
+
+    response = await app.make_response((generate(), SSE_HEADERS))
+    response.timeout = None
+    return response
+
+@app.route('/chats/<chat_id>', methods=['GET'])
+async def get_chat(chat_id):
+    payload, status = await asyncio.to_thread(chat_reply, chat_id)
+    return jsonify(payload), status
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/batch_summarize', methods=['GET', 'POST', 'DELETE'])
+async def admin_batch_summarize():
+    if not is_admin_request(request.headers):
+        return jsonify({"error": "Not found"}), 404
+    data = await request.get_json(silent=True) if request.method == 'POST' else None
+    payload, status = await asyncio.to_thread(batch_summarize_reply, request.method, data, api_key)
+    return jsonify(payload), status
@@ -0,0 +1,70 @@
+import os
+import sys
+import json
+import tempfile
+import time
+
+# Batch compaction throughput at increasing concurrency, plus an interrupted run that resumes from its checkpoint
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Measure the batch job itself, not the account's request and token rate limits
+os.environ.setdefault("KRONOS_OPENAI_RPM", "1000000")
+os.environ.setdefault("KRONOS_OPENAI_TPM", "100000000")
+
+from benchmarks.fake_openai import start_fake_server
+from scripts import api_interaction
+from scripts.batch_summarize import BatchSummarizer
+
+# Function to write the summary lines of one exchange each; the run tag keeps runs from hitting each other's cache entries
+def exchange_lines(run, chat, segments):
+    return [f"Run {run} chat {chat} exchange {segment}: the user asked about topic {segment} and got an answer." for segment in range(segments)]
+
+# Function to store `chats` contexts of `segments` summaries each; the last chat is a legacy
+# <name>_context.json file from before the persistence engine, so the backfill is exercised too
+def seed_contexts(chats, segments, run):
+    for chat in range(chats - 1):
+        context = api_interaction.new_context()
+        for line in exchange_lines(run, chat, segments):
+            context.append(line)
+        api_interaction.save_summarized_context(f"chat-{chat}", context)
+    with open(os.path.join("chat_sessions", f"chat-{chats - 1}_context.json"), "w") as file:
+        json.dump({"summarized_context": "\n".join(exchange_lines(run, chats - 1, segments))}, file)
+    api_interaction.wait_for_background_tasks()
+
+# Function to run one batch in a fresh store and return its report
+def run_batch(server, chats, segments, concurrency, pack_size, **options):
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("chat_sessions")
+    api_interaction.context_persistence.context_store = None
+    seed_contexts(chats, segments, os.getcwd())
+    calls_before = server.calls
+    summarizer = BatchSummarizer("test-key", concurrency=concurrency, pack_size=pack_size, report_every=0, **options)
+    report = summarizer.run()
+    report["upstream_calls"] = server.calls - calls_before
+    return summarizer, report
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.1
+    chats = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    segments = int(sys.argv[3]) if len(sys.argv) > 3 else 12
+    pack_size = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+    server = start_fake_server(latency=latency)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+
+    print(f"Upstream latency {latency}s, {chats} chats x {segments} segments, {pack_size} segments per request")
+    print(f"One request per segment would be {chats * (segments - 1)} calls")
+    for concurrency in (1, 4, 16):
+        _, report = run_batch(server, chats, segments, concurrency, pack_size)
+        print(f"concurrency {concurrency:>2}: {report['elapsed_seconds']:.2f}s, {report['chats_per_second']:.1f} chats/s, "
+              f"{report['requests_per_second']:.1f} requests/s, {report['upstream_calls']} upstream calls, "
+              f"{report['chats_unchanged']} unchanged")
+    legacy = len(api_interaction.load_context(f"chat-{chats - 1}"))
+    print(f"Legacy chat stored with {legacy} segments after compaction (was {segments} lines)")
+
+    # Stop halfway, then resume in the same store: only the unfinished chats are summarized
+    summarizer, first = run_batch(server, chats, segments, 4, pack_size, limit=chats // 2)
+    start = time.perf_counter()
+    resumed = BatchSummarizer("test-key", concurrency=4, pack_size=pack_size, report_every=0, resume=True).run()
+    print(f"interrupted after {first['chats_done']} chats; resume skipped {resumed['chats_skipped']} and compacted "
+          f"{resumed['chats_done']} more in {time.perf_counter() - start:.2f}s")
+    server.shutdown()
@@ -0,0 +1,84 @@
+import os
+import sys
+import json
+import random
+import tempfile
+import time
+
+# Desktop chat archive: opening and saving a long chat with and without the chat index, index build
+# and refresh cost, and full-text search latency across all chats
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts.chat_index import ChatIndex
+from scripts.event_handlers import PAGE_SIZE
+
+WORDS = "python list reverse capital france quantum entanglement haiku autumn database index query latency cache token model stream".split()
+
+def make_history(messages):
+    history = []
+    for i in range(messages // 2):
+        question = " ".join(random.choices(WORDS, k=8))
+        history.append(["You", f"{question} {i}?", f"{i * 4 + 1}.0"])
+        history.append(["Assistant", " ".join(random.choices(WORDS, k=60)), None])
+    return history
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+# Function to open a chat the way load_chat used to: parse the whole file and keep every message
+def open_full(path):
+    with open(path, 'r') as file:
+        return json.load(file)["history"]
+
+def save_full(path, title, history):
+    with open(path, 'w') as file:
+        json.dump({"title": title, "history": history}, file)
+
+# Function to open a chat through the index: its prompt list and the latest page only
+def open_indexed(chat_index, title):
+    count = chat_index.get(title)["message_count"]
+    prompts = chat_index.prompts(title)
+    return prompts, chat_index.read_messages(title, max(0, count - PAGE_SIZE), count)
+
+if __name__ == "__main__":
+    messages = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    other_chats = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+    random.seed(0)
+    chat_sessions_dir = tempfile.mkdtemp()
+    history = make_history(messages)
+    path = os.path.join(chat_sessions_dir, "Long chat.json")
+    save_full(path, "Long chat", history)
+    for i in range(other_chats):
+        save_full(os.path.join(chat_sessions_dir, f"Chat {i}.json"), f"Chat {i}", make_history(50))
+    print(f"{messages}-message chat ({os.path.getsize(path) / 1e6:.1f} MB) among {other_chats} other chats, page size {PAGE_SIZE}")
+
+    full_open, loaded = timed(open_full, path)
+    exchange = [["You", "one more question", "1.0"], ["Assistant", "one more answer", None]]
+    full_save, _ = timed(save_full, path, "Long chat", loaded + exchange)
+    save_full(path, "Long chat", history)
+    print(f"Without index: open {full_open * 1000:.1f}ms ({len(loaded)} messages parsed), save after a reply {full_save * 1000:.1f}ms")
+
+    chat_index = ChatIndex(chat_sessions_dir)
+    build, titles = timed(chat_index.refresh)
+    refresh, _ = timed(chat_index.refresh)
+    print(f"Index: cold build {build:.2f}s for {len(titles)} chats, refresh with nothing changed {refresh * 1000:.1f}ms")
+
+    indexed_open, (prompts, page) = timed(open_indexed, chat_index, "Long chat")
+    jump, _ = timed(chat_index.read_messages, "Long chat", 0, PAGE_SIZE)
+    append, _ = timed(chat_index.append, "Long chat", exchange)
+    print(f"With index: open {indexed_open * 1000:.1f}ms ({len(prompts)} prompts listed, {len(page)} messages rendered), "
+          f"jump to first page {jump * 1000:.1f}ms, save after a reply {append * 1000:.1f}ms")
+    with open(path) as file:
+        assert json.load(file)["history"][-2:] == exchange
+
+    queries = [" ".join(random.sample(WORDS, 2)) for _ in range(20)] + ["quant", "haiku autumn cache"]
+    durations = []
+    hits = 0
+    for query in queries:
+        duration, results = timed(chat_index.search, query)
+        durations.append(duration)
+        hits += len(results)
+    durations.sort()
+    print(f"Search: {len(queries)} queries, median {durations[len(durations) // 2] * 1000:.1f}ms, max {durations[-1] * 1000:.1f}ms, {hits} hits")
@@ -0,0 +1,73 @@
+import os
+import sys
+import time
+
+# Micro-benchmark: token accounting and compaction of the summarized context over long histories
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from scripts import api_interaction
+from scripts.api_interaction import get_token_count, new_context, compact_context, format_exchange
+
+SUMMARY_WORDS = 60
+summarize_calls = 0
+
+# Stand-in for summarize_text that keeps the first words of the text, so no upstream call is made
+def fake_summarize_text(text, api_key, **kwargs):
+    global summarize_calls
+    summarize_calls += 1
+    return " ".join(text.split()[:SUMMARY_WORDS])
+
+# The context handling generate_response_and_name_chat used before: one string, re-encoded every pass
+def legacy_summarize_oldest_context(context, api_key):
+    exchanges = context.split('\nUser prompt:')
+    if len(exchanges) > 1:
+        oldest_exchange = exchanges.pop(1)
+        summarized_oldest = fake_summarize_text(f"User prompt:{oldest_exchange}", api_key)
+        return '\nUser prompt:'.join([exchanges[0]] + [summarized_oldest] + exchanges[1:])
+    return context
+
+def run_legacy(turns, max_tokens):
+    context = ""
+    for turn in turns:
+        context = f"{context}\n{fake_summarize_text(turn, 'key')}"
+        while get_token_count(context) > max_tokens:
+            compacted = legacy_summarize_oldest_context(context, "key")
+            if compacted == context:
+                break
+            context = compacted
+    return context
+
+def run_structured(turns, max_tokens):
+    context = new_context()
+    for turn in turns:
+        context.append(fake_summarize_text(turn, "key"))
+        if context.total_tokens > max_tokens:
+            compact_context(context, "key", max_tokens=max_tokens)
+    return context
+
+# Function to build a synthetic conversation of the given length
+def build_turns(count):
+    words = "the quick brown fox jumps over the lazy dog while the assistant explains a long answer".split()
+    turns = []
+    for i in range(count):
+        prompt = " ".join(words[(i + j) % len(words)] for j in range(40))
+        response = " ".join(words[(i * 3 + j) % len(words)] for j in range(200))
+        turns.append(format_exchange(f"{i} {prompt}", response))
+    return turns
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    max_tokens = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 5
+    api_interaction.summarize_text = fake_summarize_text
+    turns = build_turns(count)
+
+    print(f"{count}-turn history, {max_tokens}-token limit, {rounds} rounds")
+    for name, run in (("legacy", run_legacy), ("structured", run_structured)):
+        summarize_calls = 0
+        start = time.perf_counter()
+        for _ in range(rounds):
+            context = run(turns, max_tokens)
+        elapsed = (time.perf_counter() - start) / rounds
+        compaction_calls = summarize_calls // rounds - count
+        print(f"{name:>10}: {elapsed * 1000:.1f} ms per history, {compaction_calls} compaction calls, final {get_token_count(str(context))} tokens")
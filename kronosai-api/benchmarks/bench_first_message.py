@@ -0,0 +1,37 @@
+import os
+import sys
+import tempfile
+import time
+
+# Compare first-message latency of the sequential and concurrent execution modes
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import start_fake_server
+from scripts import api_interaction
+
+# Function to time generate_response_and_name_chat for a new chat; the mode is part of every message,
+# so the second mode can't be served naming and summaries from the completion cache the first one filled
+def time_first_message(mode, rounds):
+    timings = []
+    for i in range(rounds):
+        start = time.perf_counter()
+        api_interaction.generate_response_and_name_chat(f"help me write an email {i} ({mode})", "", "test-key", "New Chat", mode=mode)
+        timings.append(time.perf_counter() - start)
+    api_interaction.wait_for_background_tasks()
+    return timings
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+    server = start_fake_server(latency=latency)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("chat_sessions")
+
+    print(f"Upstream latency {latency}s, {rounds} rounds per mode")
+    for mode in ("sequential", "concurrent"):
+        timings = time_first_message(mode, rounds)
+        print(f"{mode:>10}: mean {sum(timings) / len(timings):.3f}s, max {max(timings):.3f}s")
+    print(f"Client pool: {api_interaction.get_client_metrics()}")
+    print(f"Completion cache: {api_interaction.completion_cache.get_stats()}")
+    server.shutdown()
@@ -0,0 +1,264 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import httpx
+
+# Load and regression benchmark for /send_message. The API runs under gunicorn (wsgi.py with threads,
+# or asgi.py) against the fake OpenAI server, which can add latency, inject 429s and stream. Virtual
+# users replay multi-turn conversations at increasing concurrency; each step reports throughput,
+# latency percentiles, upstream calls per user message and tokens per turn. With --baseline the
+# results are compared against a stored run and --check exits with status 1 on a regression, e.g.
+#
+#   python benchmarks/bench_load.py --check                    # compare against benchmarks/baseline.json
+#   python benchmarks/bench_load.py --save-baseline            # after an intended change
+#
+# Upstream calls per message, tokens per turn and errors don't depend on the machine, so they flag
+# changes in api_interaction (extra calls, bigger prompts) reliably and are what --check gates on.
+# Latency and throughput move with the machine and its load from run to run: changes beyond
+# --tolerance are reported, but never fail the check.
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from benchmarks.fake_openai import start_fake_server
+from benchmarks.bench_serving import start_server, percentile
+
+BASELINE_PATH = os.path.join(API_DIR, "benchmarks", "baseline.json")
+
+# Extra arguments per server: sync workers would serve one request at a time, so wsgi gets threads, and
+# the keep-alive of gunicorn.conf.py (the default 2s drops connections users reuse after a pause)
+SERVER_ARGS = {"wsgi": ["-k", "gthread", "--threads", "16", "--keep-alive", "5"], "asgi": []}
+
+TOPICS = ["a cover letter for a data analyst job", "the difference between TCP and UDP", "a weekly meal plan",
+          "how compound interest works", "a birthday message for my sister", "why my Python script is slow",
+          "the causes of the French Revolution", "a workout routine for beginners", "how to center a div in CSS"]
+OPENERS = ["Can you help me with {}?", "Explain {} to me.", "I need {}.", "What should I know about {}?"]
+FOLLOW_UPS = ["Can you make it shorter?", "Give me an example.", "Why is that?", "Can you go into more detail on the second point?",
+              "Rewrite it in a more formal tone.", "What are the common mistakes?", "Summarize that as a bullet list.", "Thanks! One more question: what next?"]
+# Some turns paste a long text (an email, code, an article), as real users do
+PASTE = "Here is what I have so far:\n" + "\n".join(f"Line {i}: the quick brown fox jumps over the lazy dog while the report compiles." for i in range(40))
+
+# Function to generate conversations: a list of user messages per conversation. Every message names
+# its conversation's project, so no two chats send the same naming or summary request: each worker has
+# its own cache, and shared messages would make the call counts depend on which worker served them.
+def generate_traces(count, turns, seed):
+    rng = random.Random(seed)
+    traces = []
+    for index in range(count):
+        project = f"project {seed}-{index}"
+        messages = [f"{rng.choice(OPENERS).format(rng.choice(TOPICS))} It's for {project}."]
+        for _ in range(turns - 1):
+            message = f"About {project}: {rng.choice(FOLLOW_UPS)}"
+            messages.append(f"{message}\n\n{PASTE}" if rng.random() < 0.1 else message)
+        traces.append(messages)
+    return traces
+
+# Function to load conversations from a JSON file: [["first message", "follow-up", ...], ...]
+def load_traces(path):
+    with open(path, 'r') as file:
+        return [list(conversation) for conversation in json.load(file)]
+
+class StepResult:
+    def __init__(self):
+        self.latencies = []
+        self.first_event = []
+        self.errors = []
+        self.messages = 0
+
+# Function to send one message; returns the chat_id and chat name the API assigned
+async def send(client, base_url, message, chat_id, chat_title, stream, result):
+    payload = {"user_input": message, "chat_id": chat_id, "chat_title": chat_title}
+    start = time.perf_counter()
+    first_delta = None
+    try:
+        if stream:
+            async with client.stream("POST", f"{base_url}/send_message/stream", json=payload) as response:
+                if response.status_code != 200:
+                    result.errors.append(f"HTTP {response.status_code}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data: "):
+                        continue
+                    event = json.loads(line[len("data: "):])
+                    if "chat_name" in event:
+                        chat_id, chat_title = event.get("chat_id", chat_id), event["chat_name"]
+                    elif "delta" in event and first_delta is None:
+                        first_delta = time.perf_counter() - start
+                    elif "error" in event:
+                        result.errors.append(event["error"])
+        else:
+            response = await client.post(f"{base_url}/send_message", json=payload)
+            data = response.json()
+            if response.status_code != 200 or "error" in data:
+                result.errors.append(data.get("error", f"HTTP {response.status_code}"))
+            chat_id, chat_title = data.get("chat_id", chat_id), data.get("chat_name", chat_title)
+    except (httpx.HTTPError, ValueError) as e:
+        result.errors.append(repr(e))
+    result.latencies.append(time.perf_counter() - start)
+    if first_delta is not None:
+        result.first_event.append(first_delta)
+    result.messages += 1
+    return chat_id, chat_title
+
+# Function to run one concurrency step: each virtual user replays whole conversations from the shared queue
+async def run_step(base_url, traces, concurrency, stream_fraction, think_time, seed):
+    result = StepResult()
+    queue = list(enumerate(traces))
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        async def user():
+            while queue:
+                index, conversation = queue.pop()
+                stream = random.Random(seed + index).random() < stream_fraction
+                chat_id, chat_title = None, "New Chat"
+                for turn, message in enumerate(conversation):
+                    if turn:
+                        await asyncio.sleep(think_time)
+                    chat_id, chat_title = await send(client, base_url, message, chat_id, chat_title, stream, result)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    return elapsed, result
+
+# Function to wait until the background summaries of a step have reached the upstream
+def wait_for_quiet(server, quiet_seconds):
+    calls = server.calls
+    while True:
+        time.sleep(quiet_seconds)
+        if server.calls == calls:
+            return
+        calls = server.calls
+
+# Function to turn a step's measurements into the numbers that are reported and compared
+def summarize_step(elapsed, result, upstream_calls, rate_limited, tokens):
+    latencies = sorted(result.latencies)
+    first_event = sorted(result.first_event)
+    messages = max(result.messages, 1)
+    return {
+        "messages": result.messages,
+        "rps": result.messages / elapsed,
+        "p50": percentile(latencies, 0.5),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "first_token_p50": percentile(first_event, 0.5) if first_event else None,
+        "errors": len(result.errors),
+        "rate_limited": rate_limited,
+        "upstream_calls_per_message": upstream_calls / messages,
+        "tokens_per_turn": tokens / messages,
+    }
+
+def format_step(concurrency, step):
+    first_token = f"{step['first_token_p50']:.2f}s" if step["first_token_p50"] is not None else "-"
+    return (f"{concurrency:>4} users: {step['rps']:6.1f} msg/s, p50 {step['p50']:.2f}s p95 {step['p95']:.2f}s p99 {step['p99']:.2f}s, "
+            f"first token p50 {first_token}, {step['upstream_calls_per_message']:.2f} upstream calls/msg, "
+            f"{step['tokens_per_turn']:.0f} tokens/turn, {step['errors']} errors, {step['rate_limited']} 429s")
+
+# Function to compare a run against the baseline; returns (regressions, slowdowns). Only cost
+# regressions fail --check; slowdowns are timing changes, reported for a human to judge. p99 isn't
+# compared at all: a step has a few hundred messages, so it rests on two or three of them.
+def compare(results, baseline, tolerance, cost_tolerance):
+    regressions = []
+    slowdowns = []
+    for concurrency, step in results.items():
+        reference = baseline["steps"].get(concurrency)
+        if reference is None:
+            continue
+        costs = [
+            ("upstream_calls_per_message", step["upstream_calls_per_message"] > reference["upstream_calls_per_message"] * (1 + cost_tolerance)),
+            ("tokens_per_turn", step["tokens_per_turn"] > reference["tokens_per_turn"] * (1 + cost_tolerance)),
+            ("errors", step["errors"] > reference["errors"]),
+        ]
+        timings = [
+            ("rps", step["rps"] < reference["rps"] * (1 - tolerance)),
+            ("p50", step["p50"] > reference["p50"] * (1 + tolerance)),
+            ("p95", step["p95"] > reference["p95"] * (1 + tolerance)),
+        ]
+        for found, checks in ((regressions, costs), (slowdowns, timings)):
+            for name, changed in checks:
+                if changed:
+                    found.append(f"{concurrency} users: {name} {step[name]:.3f} vs baseline {reference[name]:.3f}")
+    return regressions, slowdowns
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Load test /send_message against a fake OpenAI server and compare with a baseline.")
+    parser.add_argument("--target", choices=sorted(SERVER_ARGS), default="wsgi", help="API entry point to serve (default: wsgi)")
+    parser.add_argument("--workers", type=int, default=2, help="gunicorn worker processes")
+    parser.add_argument("--latency", type=float, default=0.2, help="fake upstream latency per completion, in seconds")
+    parser.add_argument("--rate-limit", type=float, default=0.02, help="fraction of upstream calls answered with a 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with injected 429s, in seconds (default: 1, as OpenAI does)")
+    parser.add_argument("--stream-fraction", type=float, default=0.5, help="fraction of conversations using /send_message/stream")
+    parser.add_argument("--concurrency", default="1,4,16,32", help="comma-separated numbers of concurrent users")
+    parser.add_argument("--think-time", type=float, default=1.0, help="pause between a reply and the user's next message, in seconds")
+    parser.add_argument("--conversations", type=int, default=2, help="conversations per user in each step")
+    parser.add_argument("--turns", type=int, default=4, help="messages per generated conversation")
+    parser.add_argument("--traces", help="JSON file of conversations to replay instead of generated ones")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--port", type=int, default=8301)
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline file to compare against or save to")
+    parser.add_argument("--save-baseline", action="store_true", help="store this run as the baseline")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 if calls, tokens or errors regressed against the baseline")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="relative change in throughput and latency that is reported")
+    parser.add_argument("--cost-tolerance", type=float, default=0.15, help="allowed relative increase in upstream calls and tokens")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    args = parse_args()
+    levels = [int(level) for level in args.concurrency.split(",")]
+    settings = {name: getattr(args, name) for name in ("target", "workers", "latency", "rate_limit", "retry_after", "stream_fraction", "think_time", "conversations", "turns", "traces", "seed")}
+
+    upstream = start_fake_server(latency=args.latency, rate_limit_rate=args.rate_limit, retry_after=args.retry_after, seed=args.seed)
+    # Measure the API, not the account limits the client-side scheduler enforces
+    os.environ.setdefault("KRONOS_OPENAI_RPM", "1000000")
+    os.environ.setdefault("KRONOS_OPENAI_TPM", "100000000")
+    process = start_server(args.target, args.port, args.workers, upstream.base_url, SERVER_ARGS[args.target])
+    base_url = f"http://127.0.0.1:{args.port}"
+    print(f"{args.target} with {args.workers} workers, upstream latency {args.latency}s, {args.rate_limit:.0%} 429s, "
+          f"{args.stream_fraction:.0%} streamed, {args.conversations} conversations per user ({args.traces or f'{args.turns} turns each'}), {args.think_time}s think time")
+    # Long enough for a call held back by a 429 to show up before a step's counters are read
+    quiet_seconds = max(2.0, args.latency * 3, (args.retry_after or 0) * 2)
+    results = {}
+    try:
+        # Unmeasured warm-up, so every worker has loaded the SDK and tokenizer before the first step
+        warm_up = generate_traces(args.workers * 4, 1, args.seed - 1)
+        asyncio.run(run_step(base_url, warm_up, args.workers * 4, 0.5, 0, args.seed))
+        wait_for_quiet(upstream, quiet_seconds)
+        for concurrency in levels:
+            count = concurrency * args.conversations
+            traces = load_traces(args.traces)[:count] if args.traces else generate_traces(count, args.turns, args.seed + concurrency)
+            calls, rate_limited = upstream.calls, upstream.rate_limited
+            tokens = upstream.prompt_tokens + upstream.completion_tokens
+            elapsed, result = asyncio.run(run_step(base_url, traces, concurrency, args.stream_fraction, args.think_time, args.seed))
+            wait_for_quiet(upstream, quiet_seconds)
+            tokens = upstream.prompt_tokens + upstream.completion_tokens - tokens
+            step = summarize_step(elapsed, result, upstream.calls - calls, upstream.rate_limited - rate_limited, tokens)
+            results[str(concurrency)] = step
+            print(format_step(concurrency, step))
+            for error in sorted(set(result.errors))[:3]:
+                print(f"      error: {error}")
+    finally:
+        process.terminate()
+        process.wait()
+        upstream.shutdown()
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as file:
+            json.dump({"settings": settings, "steps": results}, file, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+        if baseline["settings"] != settings:
+            print(f"Baseline was recorded with different settings ({baseline['settings']}); not comparing")
+            sys.exit(0)
+        regressions, slowdowns = compare(results, baseline, args.tolerance, args.cost_tolerance)
+        for slowdown in slowdowns:
+            print(f"SLOWER (not checked) {slowdown}")
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if not regressions:
+            print(f"No regressions against {args.baseline}")
+        if regressions and args.check:
+            sys.exit(1)
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+
+# Prompt budgeting: requests rejected for exceeding the model's context window, prompt tokens per
+# call and the models used, replaying long conversations with and without the prompt builder
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import start_fake_server
+
+# A long reply, so summaries (which the fake server answers with the same text) grow the context quickly
+REPLY = " ".join(["The answer covers the question in detail with examples and caveats."] * 25)
+WINDOWS = {"gpt-4": 8192, "gpt-4o-mini": 128000}
+
+# Function to make the API behave as it did before the prompt builder: messages sent as built,
+# gpt-4 for every call and contexts compacted only past 8192 tokens
+def use_unbudgeted_prompts(api_interaction, prompt_builder):
+    from scripts.tokenizer import count_message_tokens
+
+    def build_chat_prompt(prompt, summarized_context, model, reserve_tokens=None):
+        messages = prompt_builder.build_chat_messages(prompt, summarized_context)
+        return prompt_builder.BuiltPrompt(model, messages, count_message_tokens(messages), 500)
+
+    def build_summary_prompt(text, model, reserve_tokens=None):
+        messages = prompt_builder.build_summary_messages(text)
+        return prompt_builder.BuiltPrompt(model, messages, count_message_tokens(messages), 100)
+
+    api_interaction.build_chat_prompt = build_chat_prompt
+    api_interaction.build_summary_prompt = build_summary_prompt
+    api_interaction.NAMING_MODEL = api_interaction.SUMMARY_MODEL = "gpt-4"
+    api_interaction.MAX_TOKENS = 8192
+
+# Function to replay the workload: API chats keep a summarized context, desktop chats send their history
+def run_workload(api_interaction, server, label, chats, turns):
+    calls, rejected, prompt_tokens = server.calls, server.context_rejected, server.prompt_tokens
+    models_before = dict(server.calls_by_model)
+    for chat in range(chats):
+        title = "New Chat"
+        if chat % 4 == 3:
+            history = []
+            for turn in range(turns):
+                question = f"Desktop question {turn} in chat {chat}: what else should I know?"
+                reply = "".join(api_interaction.stream_chat_with_gpt(question, history, "test-key"))
+                history.extend([("You", question, f"{turn}.0"), ("Assistant", reply, None)])
+            continue
+        for turn in range(turns):
+            question = f"Question {turn} in chat {chat}: can you explain the next step?"
+            context = api_interaction.load_summarized_context(f"{label}-{chat}")
+            title, _ = api_interaction.generate_response_and_name_chat_sequential(question, context, "test-key", title, context_key=f"{label}-{chat}")
+    calls = server.calls - calls
+    models = {model: count - models_before.get(model, 0) for model, count in server.calls_by_model.items() if count - models_before.get(model, 0)}
+    return calls, server.context_rejected - rejected, (server.prompt_tokens - prompt_tokens) / max(calls, 1), models
+
+if __name__ == "__main__":
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    turns = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    server = start_fake_server(latency=0.0, reply=REPLY, context_windows=WINDOWS)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ.setdefault("KRONOS_OPENAI_RPM", "1000000")
+    os.environ.setdefault("KRONOS_OPENAI_TPM", "100000000")
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("chat_sessions")
+
+    from scripts import api_interaction, prompt_builder
+    from scripts.metrics import PROMPTS_TRIMMED, PROMPTS_REJECTED
+    print(f"{chats} chats x {turns} turns, one in four sending its whole history as context")
+    budgeted = run_workload(api_interaction, server, "budgeted", chats, turns)
+    trimmed = sum(value for _, _, value in PROMPTS_TRIMMED.samples())
+    refused = sum(value for _, _, value in PROMPTS_REJECTED.samples())
+    use_unbudgeted_prompts(api_interaction, prompt_builder)
+    unbudgeted = run_workload(api_interaction, server, "unbudgeted", chats, turns)
+    for name, (calls, rejected, mean_prompt_tokens, models) in (("unbudgeted", unbudgeted), ("budgeted", budgeted)):
+        print(f"{name:>10}: {calls} upstream calls, {rejected} rejected as too long ({rejected / max(calls, 1):.1%}), "
+              f"{mean_prompt_tokens:.0f} prompt tokens per call, models {models}")
+    print(f"Budgeted run: {trimmed} prompts trimmed to fit, {refused} refused before sending")
+    server.shutdown()
@@ -0,0 +1,72 @@
+import os
+import sys
+import random
+import tempfile
+import time
+
+# Upstream calls saved by the semantic answer cache on a workload of reworded questions,
+# and lookup latency with a full index
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_openai import start_fake_server
+
+QUESTIONS = [
+    ("What is the capital of France?", ["what is the capital of france", "What is the capital of France??", "What's the capital of France?"]),
+    ("How do I reverse a list in Python?", ["how do I reverse a list in python", "How do I reverse a list in Python ?", "How can I reverse a list in Python?"]),
+    ("Explain quantum entanglement simply", ["Explain quantum entanglement simply.", "Can you explain quantum entanglement simply?", "explain quantum entanglement, simply"]),
+    ("Write a haiku about autumn", ["write a haiku about autumn!", "Write a haiku about the autumn", "Write me a haiku about autumn"]),
+]
+# Close wording, different question: (prompt answered first, prompt that must not be served its answer)
+DISTINCT = [
+    ("What is the capital of France?", "What is the capital of Germany?"),
+    ("How do I reverse a list in Python?", "How do I reverse a string in Python?"),
+    ("Write a haiku about autumn", "Write a haiku about spring"),
+    ("Explain quantum entanglement simply", "Explain quantum computing simply"),
+    ("Write a Python function that sorts a list in ascending order", "Write a Python function that sorts a list in descending order"),
+    ("Write a 500 word essay on the causes and consequences of the French Revolution", "Write a 300 word essay on the causes and consequences of the French Revolution"),
+    ("Give me a recipe for a fruit punch with alcohol for a party of ten people", "Give me a recipe for a fruit punch without alcohol for a party of ten people"),
+]
+
+# Function to send the workload through chat_with_gpt and count upstream calls and wrong hits
+def run_workload(api_interaction, server):
+    calls_before = server.calls
+    for question, rewordings in QUESTIONS:
+        api_interaction.chat_with_gpt(question, "", "test-key")
+        for rewording in rewordings:
+            api_interaction.chat_with_gpt(rewording, "", "test-key")
+    for answered, _ in DISTINCT:
+        api_interaction.chat_with_gpt(answered, "", "test-key")
+    server.reply = "distinct answer"
+    wrong_hits = sum(api_interaction.chat_with_gpt(question, "", "test-key") != "distinct answer" for _, question in DISTINCT)
+    return server.calls - calls_before, wrong_hits
+
+# Function to time lookups against an index filled to capacity
+def time_full_index(cache, lookups=200):
+    for i in range(cache.max_entries):
+        cache.set(f"generated question {i} about topic {random.randint(0, 10 ** 6)}", "gpt-4", f"answer {i}")
+    start = time.perf_counter()
+    for i in range(lookups):
+        cache.get(f"generated question {random.randint(0, cache.max_entries)} about a topic", "gpt-4")
+    return (time.perf_counter() - start) / lookups
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.05
+    server = start_fake_server(latency=latency)
+    os.environ["OPENAI_BASE_URL"] = server.base_url
+    os.environ["KRONOS_SEMANTIC_CACHE"] = "1"
+    os.chdir(tempfile.mkdtemp())
+    os.makedirs("chat_sessions")
+
+    from scripts import api_interaction, semantic_cache
+    semantic_cache.SEMANTIC_CACHE_ENABLED = False
+    calls_without, _ = run_workload(api_interaction, server)
+    semantic_cache.SEMANTIC_CACHE_ENABLED = True
+    server.reply = "This is a fake reply from the benchmark server."
+    calls_with, wrong_hits = run_workload(api_interaction, server)
+    cache = semantic_cache.get_semantic_cache()
+    stats = cache.get_stats()
+    print(f"Upstream calls: {calls_without} without the semantic cache, {calls_with} with it (threshold {cache.threshold})")
+    print(f"Hit rate {stats['hit_rate']:.0%}, {wrong_hits} of {len(DISTINCT)} distinct questions wrongly served from cache")
+    print(f"Lookup: mean {stats['mean_lookup_seconds'] * 1000:.2f}ms")
+    print(f"Lookup with {cache.max_entries} entries: {time_full_index(cache) * 1000:.2f}ms")
+    server.shutdown()
@@ -0,0 +1,80 @@
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+import httpx
+
+# Load benchmark: the sync WSGI app (wsgi.py) against the async ASGI app (asgi.py), both behind a fake upstream
+API_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, API_DIR)
+
+from benchmarks.fake_openai import start_fake_server
+
+# Server commands, both run by gunicorn with the same number of worker processes
+SERVERS = {
+    "wsgi": lambda port, workers: ["gunicorn", "wsgi:application", "-b", f"127.0.0.1:{port}", "-w", str(workers), "--timeout", "300"],
+    "asgi": lambda port, workers: ["gunicorn", "asgi:app", "-c", os.path.join(API_DIR, "gunicorn.conf.py"), "-b", f"127.0.0.1:{port}", "-w", str(workers), "--timeout", "300"],
+}
+
+# Function to start one of the API servers in a scratch working directory
+def start_server(kind, port, workers, upstream_url, extra_args=()):
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, "chat_sessions"))
+    with open(os.path.join(workdir, "api_key.txt"), "w") as file:
+        file.write("test-key")
+    env = dict(os.environ, OPENAI_BASE_URL=upstream_url, PYTHONPATH=os.pathsep.join(filter(None, [API_DIR, os.environ.get("PYTHONPATH")])))
+    process = subprocess.Popen(SERVERS[kind](port, workers) + list(extra_args), cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                return process
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"{kind} server did not start")
+
+# Function to fire requests at the server with a fixed number in flight
+async def run_load(url, total, concurrency):
+    latencies = []
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(timeout=600, limits=limits) as client:
+        async def one(i):
+            nonlocal errors
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(url, json={"user_input": f"hello {i}", "chat_history": [], "chat_title": "New Chat"})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    errors += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - start
+    return elapsed, sorted(latencies), errors
+
+# Function to pick a percentile from sorted latencies
+def percentile(latencies, fraction):
+    return latencies[min(len(latencies) - 1, int(len(latencies) * fraction))]
+
+if __name__ == "__main__":
+    latency = float(sys.argv[1]) if len(sys.argv) > 1 else 0.5
+    total = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 50
+    workers = int(sys.argv[4]) if len(sys.argv) > 4 else 2
+
+    upstream = start_fake_server(latency=latency)
+    print(f"Upstream latency {latency}s, {total} requests, {concurrency} in flight, {workers} workers")
+    for port, kind in enumerate(SERVERS, start=8201):
+        process = start_server(kind, port, workers, upstream.base_url)
+        try:
+            elapsed, latencies, errors = asyncio.run(run_load(f"http://127.0.0.1:{port}/send_message", total, concurrency))
+        finally:
+            process.terminate()
+            process.wait()
+        print(f"{kind}: {total / elapsed:.1f} req/s, p50 {percentile(latencies, 0.5):.2f}s, p95 {percentile(latencies, 0.95):.2f}s, errors {errors}")
+    upstream.shutdown()
@@ -0,0 +1,52 @@
+import os
+import sys
+import json
+import statistics
+import subprocess
+import tempfile
+
+# Cold-start cost of the API worker: time to import the app and resident memory, before and after the
+# background warm-up (SDK import, shared client, tokenizer) has finished
+API_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+import {module}
+imported = time.perf_counter() - start
+
+def rss_mb():
+    with open("/proc/self/status") as file:
+        for line in file:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+rss_imported = rss_mb()
+heavy = [name for name in ("openai", "httpx", "tiktoken") if name in sys.modules]
+from scripts import api_interaction
+api_interaction.wait_for_background_tasks()
+warm = time.perf_counter() - start
+print(json.dumps({{"import": imported, "warm": warm, "rss_imported": rss_imported, "rss_warm": rss_mb(), "heavy_at_import": heavy}}))
+"""
+
+# Function to import `module` in a fresh interpreter and return its measurements
+def probe(module):
+    workdir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(workdir, "chat_sessions"))
+    with open(os.path.join(workdir, "api_key.txt"), "w") as file:
+        file.write("test-key")
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [API_ROOT, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", PROBE.format(module=module)], cwd=workdir, env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+if __name__ == "__main__":
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    modules = sys.argv[2:] or ["app", "asgi"]
+    print(f"{rounds} cold starts per module (median)")
+    for module in modules:
+        runs = [probe(module) for _ in range(rounds)]
+        median = lambda key: statistics.median(run[key] for run in runs)
+        print(f"{module:>6}: import {median('import') * 1000:.0f}ms ({median('rss_imported'):.0f} MB RSS), "
+              f"warm {median('warm') * 1000:.0f}ms ({median('rss_warm'):.0f} MB RSS), "
+              f"loaded at import: {', '.join(runs[0]['heavy_at_import']) or 'none of openai/httpx/tiktoken'}")
@@ -0,0 +1,176 @@
+import json
+import sys
+import random
+import hashlib
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for the OpenAI chat completions endpoint used by the benchmarks
+
+# Function to estimate the prompt tokens of a request (about four characters per token)
+def approximate_prompt_tokens(messages):
+    return sum(len(str(message.get("content", ""))) // 4 + 4 for message in messages) + 3
+
+# Function to build a chat completion payload in the OpenAI response format
+def completion_payload(model, content, prompt_tokens=0):
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(content.split()), "total_tokens": prompt_tokens + len(content.split())},
+    }
+
+# Function to build one streamed chunk in the OpenAI chunk format
+def chunk_payload(model, content, finish_reason=None):
+    delta = {"content": content} if content is not None else {}
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40ms to every call
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        model = body.get("model", "gpt-4")
+        prompt_tokens = approximate_prompt_tokens(body.get("messages", []))
+        self.server.record_call(model, prompt_tokens)
+        if self.server.should_rate_limit(model, body.get("messages", [])):
+            self.send_rate_limited()
+            return
+        window = self.server.context_windows.get(model)
+        if window is not None and prompt_tokens + (body.get("max_tokens") or 0) > window:
+            self.send_context_length_exceeded(window, prompt_tokens)
+            return
+        self.server.record_completion(self.server.reply)
+        if body.get("stream"):
+            self.send_stream(model)
+            return
+        time.sleep(self.server.latency)
+        payload = completion_payload(model, self.server.reply, prompt_tokens)
+        self.send_json(200, payload)
+
+    # Stream the reply word by word, spreading the latency across the chunks
+    def send_stream(self, model):
+        words = self.server.reply.split(" ")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            time.sleep(self.server.latency / len(words))
+            self.write_chunk(chunk_payload(model, word if i == 0 else " " + word))
+        self.write_chunk(chunk_payload(model, None, finish_reason="stop"))
+        self.write_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def write_chunk(self, payload):
+        data = payload if isinstance(payload, str) else json.dumps(payload)
+        event = f"data: {data}\n\n".encode()
+        self.wfile.write(f"{len(event):x}\r\n".encode() + event + b"\r\n")
+        self.wfile.flush()
+
+    # Answer with a 429 like the real API, including the Retry-After hint
+    def send_rate_limited(self):
+        with self.server.lock:
+            self.server.rate_limited += 1
+        data = json.dumps({"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}).encode()
+        self.send_response(429)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        if self.server.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.retry_after))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # Answer with the 400 the real API sends when the prompt is over the model's context window
+    def send_context_length_exceeded(self, window, prompt_tokens):
+        with self.server.lock:
+            self.server.context_rejected += 1
+        message = f"This model's maximum context length is {window} tokens. However, your messages resulted in {prompt_tokens} tokens."
+        self.send_json(400, {"error": {"message": message, "type": "invalid_request_error", "code": "context_length_exceeded"}})
+
+    def send_json(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+class FakeOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    # context_windows maps model names to the prompt size (in estimated tokens) above which calls get a 400
+    def __init__(self, address=("127.0.0.1", 0), latency=0.5, reply="This is a canned reply from the fake OpenAI server.", rate_limit_rate=0.0, retry_after=None, context_windows=None, seed=0):
+        super().__init__(address, FakeOpenAIHandler)
+        self.latency = latency
+        self.reply = reply
+        self.rate_limit_rate = rate_limit_rate
+        self.seed = seed
+        self.attempts = {}
+        self.retry_after = retry_after
+        self.context_windows = context_windows or {}
+        self.calls = 0
+        self.rate_limited = 0
+        self.context_rejected = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls_by_model = {}
+        self.lock = threading.Lock()
+
+    def record_call(self, model=None, prompt_tokens=0):
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.calls_by_model[model] = self.calls_by_model.get(model, 0) + 1
+
+    # Function to decide whether to answer a call with a 429. The draw depends only on the seed, the call
+    # (model and newest message) and how many times that call was made before, not on which handler thread
+    # got there first or on how much summarized context a cooldown let into the prompt, so the same run
+    # injects the same 429s, and makes the same retries, every time
+    def should_rate_limit(self, model, messages):
+        if not self.rate_limit_rate:
+            return False
+        call = json.dumps([model, messages[-1] if messages else None], sort_keys=True)
+        digest = hashlib.sha256(call.encode()).hexdigest()
+        with self.lock:
+            attempt = self.attempts.get(digest, 0)
+            self.attempts[digest] = attempt + 1
+        return random.Random(f"{self.seed}:{digest}:{attempt}").random() < self.rate_limit_rate
+
+    def record_completion(self, content):
+        with self.lock:
+            self.completion_tokens += len(content.split())
+
+    @property
+    def base_url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}/v1/"
+
+# Function to start the fake server on a background thread
+def start_fake_server(**kwargs):
+    server = FakeOpenAIServer(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+if __name__ == "__main__":
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 8100
+    latency = float(sys.argv[2]) if len(sys.argv) > 2 else 0.5
+    rate_limit_rate = float(sys.argv[3]) if len(sys.argv) > 3 else 0.0
+    server = FakeOpenAIServer(("127.0.0.1", port), latency=latency, rate_limit_rate=rate_limit_rate, retry_after=1)
+    print(f"Fake OpenAI server listening on {server.base_url} (latency {latency}s, {rate_limit_rate:.0%} rate limited)")
+    server.serve_forever()
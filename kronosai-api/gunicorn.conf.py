@@ -0,0 +1,15 @@
+import os
+import multiprocessing
+
+# Production launcher for the async API: gunicorn manages worker processes, uvicorn runs the event loop in each
+bind = f"0.0.0.0:{os.environ.get('PORT', '5000')}"
+workers = int(os.environ.get("WEB_CONCURRENCY", min(multiprocessing.cpu_count() * 2 + 1, 8)))
+worker_class = "uvicorn.workers.UvicornWorker"
+keepalive = 5
+timeout = 120
+graceful_timeout = 30
+accesslog = "-"
+
+# Tell each worker how many share the host, so the OpenAI rate budget is split between them (see rate_limiter.py)
+def on_starting(server):
+    os.environ["WEB_CONCURRENCY"] = str(server.cfg.workers)
@@ -1,130 +1,657 @@
 import os
-import openai
 import json
 import time
-import tiktoken
+import itertools
+import contextvars
+import threading
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, wait
+from scripts.completion_cache import completion_cache, make_cache_key
+from scripts.summarized_context import SummarizedContext
+from scripts.context_persistence import get_context_store, sanitize_key
+from scripts.rate_limiter import scheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from scripts.metrics import span, observe_upstream, observe_prompt, register_collector, PROMPTS_REJECTED
+from scripts import context_persistence
+from scripts.tokenizer import DEFAULT_ENCODING, count_tokens, get_encoding
+from scripts.semantic_cache import get_semantic_cache
+from scripts.prompt_builder import (
+    ANSWER_MODEL,
+    NAMING_MODEL,
+    SUMMARY_MODEL,
+    NAMING_MAX_TOKENS,
+    SUMMARY_MAX_TOKENS,
+    RESPONSE_TOKENS,
+    PROMPT_TOO_LARGE,
+    PromptTooLarge,
+    build_chat_prompt,
+    build_summary_prompt,
+    context_token_limit,
+    model_capabilities,
+)
 
-# Initialize the tokenizer
-tokenizer = tiktoken.get_encoding("cl100k_base")
+# Model for answers (KRONOS_MODEL); naming and summaries use NAMING_MODEL and SUMMARY_MODEL
+MODEL = ANSWER_MODEL
+# Size at which a chat's summarized context is compacted, from the answer model's context window
+MAX_TOKENS = context_token_limit(MODEL)
 
-# Global model variable
-MODEL = "gpt-4"  # Corrected model name
-MAX_TOKENS = 8192 if MODEL == "gpt-4" else 4096
+# A compaction pass shrinks the context to this fraction of MAX_TOKENS, leaving room for the next exchanges
+COMPACTION_TARGET = 0.75
+SUMMARY_FAILED = "Summary could not be generated."
+REQUEST_FAILED = "Sorry, I am unable to process your request at the moment."
+
+# Execution mode for generate_response_and_name_chat: "concurrent" or "sequential"
+EXECUTION_MODE = os.environ.get("KRONOS_EXECUTION_MODE", "concurrent")
+
+# Bounded worker pool for the naming and answering calls of a request
+request_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("KRONOS_REQUEST_WORKERS", "8")), thread_name_prefix="kronos-request")
+
+# Worker pool for summary updates that run after the reply has been sent
+background_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("KRONOS_BACKGROUND_WORKERS", "2")), thread_name_prefix="kronos-summary")
+background_tasks = set()
+
+# Settings for the shared OpenAI clients and their pooled httpx connections
+CLIENT_SETTINGS = {
+    "max_connections": int(os.environ.get("KRONOS_OPENAI_MAX_CONNECTIONS", "100")),
+    "max_keepalive_connections": int(os.environ.get("KRONOS_OPENAI_MAX_KEEPALIVE", "20")),
+    "keepalive_expiry": float(os.environ.get("KRONOS_OPENAI_KEEPALIVE_EXPIRY", "30")),
+    "connect_timeout": float(os.environ.get("KRONOS_OPENAI_CONNECT_TIMEOUT", "5")),
+    "timeout": float(os.environ.get("KRONOS_OPENAI_TIMEOUT", "60")),
+    "http2": os.environ.get("KRONOS_OPENAI_HTTP2") == "1",
+}
+
+# Per-call timeouts (seconds) for each kind of completion
+CHAT_TIMEOUT = float(os.environ.get("KRONOS_CHAT_TIMEOUT", "60"))
+SUMMARY_TIMEOUT = float(os.environ.get("KRONOS_SUMMARY_TIMEOUT", "30"))
+
+# One long-lived client per API key, shared by every request
+clients = {}
+clients_lock = threading.Lock()
+
+# The OpenAI SDK (with the httpx stack under it) is most of the API's import time, so it's loaded on first use
+sdk = None
+sdk_lock = threading.Lock()
+
+# Counters for the connection pool behind the shared clients
+pool_metrics = {
+    "requests": 0,
+    "in_flight": 0,
+    "peak_in_flight": 0,
+    "saturated_requests": 0,
+    "connections_opened": 0,
+    "tls_handshakes": 0,
+}
+pool_metrics_lock = threading.Lock()
 
 # Function to read the API key from an external file
 def read_api_key(file_path):
     with open(file_path, 'r') as file:
         return file.read().strip()
 
-# Function to summarize a given text using GPT
-def summarize_text(text, api_key, model=MODEL, max_retries=5):
-    openai.api_key = api_key
-    retries = 0
-    while retries < max_retries:
+# Function to record the start of an upstream request against the pool limits
+def _pool_request_started():
+    with pool_metrics_lock:
+        pool_metrics["requests"] += 1
+        pool_metrics["in_flight"] += 1
+        pool_metrics["peak_in_flight"] = max(pool_metrics["peak_in_flight"], pool_metrics["in_flight"])
+        if pool_metrics["in_flight"] > CLIENT_SETTINGS["max_connections"]:
+            pool_metrics["saturated_requests"] += 1
+
+def _pool_request_finished():
+    with pool_metrics_lock:
+        pool_metrics["in_flight"] -= 1
+
+# httpcore trace hook: counts new connections and TLS handshakes, i.e. requests that missed the pool
+def _pool_trace(event_name, info):
+    if event_name == "connection.connect_tcp.complete":
+        with pool_metrics_lock:
+            pool_metrics["connections_opened"] += 1
+    elif event_name == "connection.start_tls.complete":
+        with pool_metrics_lock:
+            pool_metrics["tls_handshakes"] += 1
+
+# Function to get the openai module, importing it on first use
+def openai_sdk():
+    global sdk
+    if sdk is None:
+        with sdk_lock:
+            if sdk is None:
+                import openai
+                sdk = openai
+    return sdk
+
+# Function to define the metered transports once httpx is needed. A request counts as in flight until its
+# response body is closed, not just until the headers arrive: a streamed reply holds its connection
+# until the last chunk has been read.
+@lru_cache(maxsize=None)
+def metered_transports():
+    import httpx
+
+    # Response body that releases its in-flight slot once, when it is closed
+    class MeteredStream(httpx.SyncByteStream):
+        def __init__(self, stream):
+            self.stream = stream
+            self.finished = False
+
+        def __iter__(self):
+            yield from self.stream
+
+        def close(self):
+            try:
+                self.stream.close()
+            finally:
+                if not self.finished:
+                    self.finished = True
+                    _pool_request_finished()
+
+    class AsyncMeteredStream(httpx.AsyncByteStream):
+        def __init__(self, stream):
+            self.stream = stream
+            self.finished = False
+
+        async def __aiter__(self):
+            async for chunk in self.stream:
+                yield chunk
+
+        async def aclose(self):
+            try:
+                await self.stream.aclose()
+            finally:
+                if not self.finished:
+                    self.finished = True
+                    _pool_request_finished()
+
+    # Transport that feeds the pool metrics for the sync client
+    class MeteredTransport(httpx.HTTPTransport):
+        def handle_request(self, request):
+            request.extensions["trace"] = _pool_trace
+            _pool_request_started()
+            try:
+                response = super().handle_request(request)
+            except BaseException:
+                _pool_request_finished()
+                raise
+            response.stream = MeteredStream(response.stream)
+            return response
+
+    # Transport that feeds the pool metrics for the async client
+    class AsyncMeteredTransport(httpx.AsyncHTTPTransport):
+        async def handle_async_request(self, request):
+            async def trace(event_name, info):
+                _pool_trace(event_name, info)
+
+            request.extensions["trace"] = trace
+            _pool_request_started()
+            try:
+                response = await super().handle_async_request(request)
+            except BaseException:
+                _pool_request_finished()
+                raise
+            response.stream = AsyncMeteredStream(response.stream)
+            return response
+
+    return MeteredTransport, AsyncMeteredTransport
+
+# Function to build the httpx pool limits and timeouts from the client settings
+def build_http_options(settings=None):
+    import httpx
+    settings = settings or CLIENT_SETTINGS
+    limits = httpx.Limits(
+        max_connections=settings["max_connections"],
+        max_keepalive_connections=settings["max_keepalive_connections"],
+        keepalive_expiry=settings["keepalive_expiry"],
+    )
+    timeout = httpx.Timeout(settings["timeout"], connect=settings["connect_timeout"])
+    http2 = settings["http2"]
+    if http2:
         try:
-            response = openai.chat.completions.create(
-                model=model,
-                messages=[{"role": "system", "content": f"Please summarize the following user's prompt to the minimal amount of characters necessary, ensuring that the key information is retained for maintaining context in future conversations. Focus on the main points and core details:\n\n{text}"}],
-                max_tokens=100,  # Adjust max tokens as needed
-                temperature=0.5
-            )
-            return response.choices[0].message.content
-        except openai._exceptions.RateLimitError as e:
-            retries += 1
-            wait_time = 2 ** retries  # Exponential backoff
-            print(f"Rate limit exceeded. Retrying in {wait_time} seconds...")
-            time.sleep(wait_time)
-        except openai._exceptions.OpenAIError as e:
-            print(f"An error occurred: {e}")
-            break
-    return "Summary could not be generated."
+            import h2  # noqa: F401
+        except ImportError:
+            print("HTTP/2 requested but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+            http2 = False
+    return limits, timeout, http2
 
-# Function to chat with GPT with retry logic and chat history
-def chat_with_gpt(prompt, summarized_context, api_key, model=MODEL, max_retries=5):
-    openai.api_key = api_key
-    retries = 0
-    while retries < max_retries:
+# Function to build a long-lived OpenAI client with pooled httpx connections
+def build_client(api_key, settings=None):
+    import httpx
+    limits, timeout, http2 = build_http_options(settings)
+    MeteredTransport, _ = metered_transports()
+    http_client = httpx.Client(transport=MeteredTransport(limits=limits, http2=http2), limits=limits, timeout=timeout, http2=http2)
+    # Retries go through the scheduler, not the SDK's own backoff
+    return openai_sdk().OpenAI(api_key=api_key, http_client=http_client, timeout=timeout, max_retries=0)
+
+# Function to build a long-lived AsyncOpenAI client with pooled httpx connections
+def build_async_client(api_key, settings=None):
+    import httpx
+    limits, timeout, http2 = build_http_options(settings)
+    _, AsyncMeteredTransport = metered_transports()
+    http_client = httpx.AsyncClient(transport=AsyncMeteredTransport(limits=limits, http2=http2), limits=limits, timeout=timeout, http2=http2)
+    return openai_sdk().AsyncOpenAI(api_key=api_key, http_client=http_client, timeout=timeout, max_retries=0)
+
+# Function to create the shared client at startup
+def init_client(api_key, settings=None):
+    with clients_lock:
+        clients[api_key] = build_client(api_key, settings)
+        return clients[api_key]
+
+# Function to get the shared client for an API key, creating it on first use
+def get_client(api_key):
+    client = clients.get(api_key)
+    if client is None:
+        with clients_lock:
+            client = clients.get(api_key)
+            if client is None:
+                client = clients[api_key] = build_client(api_key)
+    return client
+
+# Function to import the SDK, load the tokenizer encodings of the configured models and build the
+# shared client in the background, so a worker can accept connections before the heavy imports finish
+def warm_up(api_key, build_client_for_key=None):
+    def warm():
+        (build_client_for_key or get_client)(api_key)
+        for encoding in sorted({DEFAULT_ENCODING} | {model_capabilities(model)["encoding"] for model in (ANSWER_MODEL, NAMING_MODEL, SUMMARY_MODEL)}):
+            get_encoding(encoding)
+    return submit_background_task(warm)
+
+# Function to report connection pool usage for the shared clients
+def get_client_metrics():
+    with pool_metrics_lock:
+        metrics = dict(pool_metrics)
+    metrics["max_connections"] = CLIENT_SETTINGS["max_connections"]
+    metrics["pool_utilization"] = metrics["in_flight"] / CLIENT_SETTINGS["max_connections"]
+    return metrics
+
+# Function to build the question used to name a new chat
+def build_name_chat_question(user_input):
+    return f"What would be an appropriate name for the chat with this starting response: {user_input}. Please just respond with the name."
+
+# Function to build the cache key for a call site, or None when the site isn't cached
+def lookup_key(cache_site, model, messages, **params):
+    if cache_site and completion_cache.enabled_for(cache_site):
+        return make_cache_key(model, messages, **params)
+    return None
+
+# Function to look up a cached completion; a hit skips the upstream round-trip
+def cached_completion(cache_site, cache_key):
+    if cache_key is None:
+        return None
+    return completion_cache.get(cache_site, cache_key)
+
+# Function to store a successful completion in the cache and pass it through
+def store_completion(cache_key, content):
+    if cache_key is not None and content:
+        completion_cache.set(cache_key, content)
+    return content
+
+# Function to look up the answer to a near-identical earlier prompt; only prompts sent without context qualify
+def semantic_completion(cache_site, prompt, summarized_context, model):
+    cache = get_semantic_cache() if cache_site == "answer" and not summarized_context else None
+    if cache is None:
+        return None
+    with span("semantic_cache"):
+        return cache.get(prompt, model)
+
+# Function to remember a context-free answer in the semantic cache and pass it through
+def store_semantic_completion(cache_site, prompt, summarized_context, model, content):
+    cache = get_semantic_cache() if cache_site == "answer" and not summarized_context else None
+    if cache is not None and content:
+        cache.set(prompt, model, content)
+    return content
+
+# Function to assemble a request within the model's limits; None when it can't fit even after trimming
+def budget_prompt(cache_site, build, *args):
+    with span("prompt_build"):
         try:
-            # Prepare the messages for the API request
-            messages = [{"role": "system", "content": "You are a helpful assistant."}]
-            if summarized_context:
-                messages.append({"role": "system", "content": f"Previous context: {summarized_context}"})
-            messages.append({"role": "user", "content": prompt})
-            
-            response = openai.chat.completions.create(
-                model=model,
-                messages=messages
-            )
-            return response.choices[0].message.content
-        except openai._exceptions.RateLimitError as e:
-            retries += 1
-            wait_time = 2 ** retries  # Exponential backoff
-            print(f"Rate limit exceeded. Retrying in {wait_time} seconds...")
-            time.sleep(wait_time)
-        except openai._exceptions.OpenAIError as e:
-            print(f"An error occurred: {e}")
-            break
-    return "Sorry, I am unable to process your request at the moment."
+            built_prompt = build(*args)
+        except PromptTooLarge as e:
+            PROMPTS_REJECTED.inc(call_site=cache_site or "uncached")
+            print(f"Request not sent: {e}")
+            return None
+    observe_prompt(cache_site, built_prompt)
+    return built_prompt
+
+# Function to name the outcome of a failed call; a 400 is a request the API refused, e.g. too many tokens
+def error_outcome(error):
+    return "rejected" if isinstance(error, openai_sdk().BadRequestError) else "error"
+
+class CompletionRequest:
+    # One completion call as both the sync and async clients send it: the prompt built within the model's
+    # budget, the parameters sent with it (which are also part of its cache key), and the retry policy
+    def __init__(self, cache_site, model, built_prompt, **params):
+        self.cache_site = cache_site
+        self.model = model
+        self.messages = built_prompt.messages
+        self.estimated_tokens = built_prompt.estimated_tokens
+        self.params = params
+        self.cache_key = lookup_key(cache_site, model, self.messages, **params)
+
+    # Returns the response, or a coroutine of it with an async client
+    def send(self, client, timeout, **options):
+        return client.chat.completions.create(model=self.model, messages=self.messages, timeout=timeout, **self.params, **options)
+
+    # Function to record a successful upstream call; streams report no usage up front
+    def succeeded(self, started, response):
+        usage = getattr(response, "usage", None)
+        scheduler.record_usage(self.estimated_tokens, usage.total_tokens if usage else None)
+        observe_upstream(self.cache_site, started, "ok", usage=usage)
+        return response
+
+    # Function to record a failed upstream call; returns True when the call should be sent again
+    def should_retry(self, started, error, attempt):
+        if isinstance(error, openai_sdk().RateLimitError):
+            observe_upstream(self.cache_site, started, "rate_limited", retries=1)
+            # The scheduler holds every caller until the shared cooldown has passed
+            wait_time = scheduler.report_rate_limit(error, attempt)
+            print(f"Rate limit exceeded. Retrying in {wait_time:.1f} seconds...")
+            return True
+        observe_upstream(self.cache_site, started, error_outcome(error))
+        print(f"An error occurred: {error}")
+        return False
+
+# Function to assemble a summarization request; None when the text can't fit even after trimming
+def summary_request(text, model, cache_site):
+    built_prompt = budget_prompt(cache_site, build_summary_prompt, text, model)
+    if built_prompt is None:
+        return None
+    return CompletionRequest(cache_site, model, built_prompt, max_tokens=SUMMARY_MAX_TOKENS, temperature=0.5)
+
+# Function to assemble a chat request; None when the prompt can't fit even after trimming
+def chat_request(prompt, summarized_context, model, cache_site, max_tokens=None):
+    built_prompt = budget_prompt(cache_site, build_chat_prompt, prompt, summarized_context, model, max_tokens or RESPONSE_TOKENS)
+    if built_prompt is None:
+        return None
+    # Only calls with a fixed reply size (naming) cap the completion; answers may use the whole reserve and beyond
+    params = {"max_tokens": max_tokens} if max_tokens else {}
+    return CompletionRequest(cache_site, model, built_prompt, **params)
+
+# Function to send a request through the scheduler, retrying rate limits; returns None if it failed
+def request_with_retries(request, client, timeout, priority, max_retries, **options):
+    for attempt in range(1, max_retries + 1):
+        scheduler.acquire(request.estimated_tokens, priority)
+        started = time.perf_counter()
+        try:
+            return request.succeeded(started, request.send(client, timeout, **options))
+        except openai_sdk().OpenAIError as e:
+            if not request.should_retry(started, e, attempt):
+                return None
+    return None
+
+# Function to summarize a given text using GPT
+def summarize_text(text, api_key, model=None, max_retries=5, client=None, timeout=SUMMARY_TIMEOUT, cache_site="summary", priority=PRIORITY_BACKGROUND):
+    client = client or get_client(api_key)
+    request = summary_request(text, model or SUMMARY_MODEL, cache_site)
+    if request is None:
+        return SUMMARY_FAILED
+    cached = cached_completion(cache_site, request.cache_key)
+    if cached is not None:
+        return cached
+    response = request_with_retries(request, client, timeout, priority, max_retries)
+    if response is None:
+        return SUMMARY_FAILED
+    return store_completion(request.cache_key, response.choices[0].message.content)
+
+# Function to chat with GPT with retry logic and chat history
+def chat_with_gpt(prompt, summarized_context, api_key, model=None, max_retries=5, client=None, timeout=CHAT_TIMEOUT, cache_site="answer", priority=PRIORITY_INTERACTIVE, max_tokens=None):
+    client = client or get_client(api_key)
+    model = model or MODEL
+    request = chat_request(prompt, summarized_context, model, cache_site, max_tokens)
+    if request is None:
+        return PROMPT_TOO_LARGE
+    cached = cached_completion(cache_site, request.cache_key) or semantic_completion(cache_site, prompt, summarized_context, model)
+    if cached is not None:
+        return cached
+    response = request_with_retries(request, client, timeout, priority, max_retries)
+    if response is None:
+        return REQUEST_FAILED
+    content = store_completion(request.cache_key, response.choices[0].message.content)
+    return store_semantic_completion(cache_site, prompt, summarized_context, model, content)
+
+# Function to stream a chat completion from GPT, yielding content deltas as they arrive
+def stream_chat_with_gpt(prompt, summarized_context, api_key, model=None, max_retries=5, client=None, timeout=CHAT_TIMEOUT, cache_site="answer", priority=PRIORITY_INTERACTIVE):
+    client = client or get_client(api_key)
+    model = model or MODEL
+    request = chat_request(prompt, summarized_context, model, cache_site)
+    if request is None:
+        yield PROMPT_TOO_LARGE
+        return
+    cached = cached_completion(cache_site, request.cache_key) or semantic_completion(cache_site, prompt, summarized_context, model)
+    if cached is not None:
+        yield cached
+        return
+    stream = request_with_retries(request, client, timeout, priority, max_retries, stream=True)
+    if stream is None:
+        yield REQUEST_FAILED
+        return
+
+    # Close the stream even when the client goes away mid-reply, so its connection goes back to the pool
+    parts = []
+    try:
+        for chunk in stream:
+            delta = chunk_text(chunk)
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        stream.close()
+    content = store_completion(request.cache_key, "".join(parts))
+    store_semantic_completion(cache_site, prompt, summarized_context, model, content)
+
+# Function to get the text of a streamed chunk, if it has any
+def chunk_text(chunk):
+    return chunk.choices[0].delta.content if chunk.choices else None
+
+# Function to turn the naming reply into a chat name
+def clean_chat_name(reply):
+    return reply.replace('"', '')
+
+# Function to ask GPT for an appropriate chat name
+def name_chat(user_input, summarized_context, api_key):
+    with span("naming"):
+        chatNameResp = chat_with_gpt(build_name_chat_question(user_input), summarized_context, api_key, model=NAMING_MODEL, cache_site="naming", max_tokens=NAMING_MAX_TOKENS)
+    return clean_chat_name(chatNameResp)
+
+# Function to generate the main response
+def answer_chat(user_input, summarized_context, api_key):
+    with span("answer"):
+        return chat_with_gpt(user_input, summarized_context, api_key)
+
+# Function to run a request stage on the worker pool, keeping the request's timing context
+def submit_request_task(fn, *args):
+    return request_executor.submit(contextvars.copy_context().run, fn, *args)
 
 # Function to generate response from GPT and name the chat
-def generate_response_and_name_chat(user_input, summarized_context, api_key, chat_title):
+def generate_response_and_name_chat(user_input, summarized_context, api_key, chat_title, mode=None, context_key=None):
+    mode = mode or EXECUTION_MODE
+    if mode == "sequential":
+        return generate_response_and_name_chat_sequential(user_input, summarized_context, api_key, chat_title, context_key)
+
+    # Naming and answering don't depend on each other: the name is generated on the pool while the
+    # answer is fetched on the caller's thread, so a request only takes a pool slot for a new chat
+    if chat_title == 'New Chat':
+        name_future = submit_request_task(name_chat, user_input, summarized_context, api_key)
+    else:
+        name_future = None
+    response = answer_chat(user_input, summarized_context, api_key)
+    chat_name = name_future.result() if name_future else chat_title
+
+    # The summary doesn't need to block the reply
+    context_key = context_key or sanitize_key(chat_name)
+    submit_background_task(update_and_save_context, context_key, user_input, response, summarized_context, api_key)
+
+    return chat_name, response
+
+# Function to stream the response from GPT, sending the chat name first
+def stream_response_and_name_chat(user_input, summarized_context, api_key, chat_title, context_key=None):
+    if chat_title == 'New Chat':
+        name_future = submit_request_task(name_chat, user_input, summarized_context, api_key)
+    else:
+        name_future = None
+
+    # Open the answer stream while the name is still being generated
+    deltas = stream_chat_with_gpt(user_input, summarized_context, api_key)
+    with span("first_token"):
+        first_delta = next(deltas, "")
+    chat_name = name_future.result() if name_future else chat_title
+    yield {"chat_name": chat_name}
+
+    response_parts = []
+    for delta in itertools.chain([first_delta], deltas):
+        if delta:
+            response_parts.append(delta)
+            yield {"delta": delta}
+
+    # Summarization and persistence run once the stream has closed
+    response = "".join(response_parts)
+    context_key = context_key or sanitize_key(chat_name)
+    submit_background_task(update_and_save_context, context_key, user_input, response, summarized_context, api_key)
+
+# Function to generate response from GPT and name the chat one call after another
+def generate_response_and_name_chat_sequential(user_input, summarized_context, api_key, chat_title, context_key=None):
     if chat_title == 'New Chat':
-        nameChatQuestion = f"What would be an appropriate name for the chat with this starting response: {user_input}. Please just respond with the name."
-        chatNameResp = chat_with_gpt(nameChatQuestion, summarized_context, api_key)
-        chat_name = chatNameResp.replace('"', '')
+        chat_name = name_chat(user_input, summarized_context, api_key)
     else:
         chat_name = chat_title
 
-    context_file_path = os.path.join("chat_sessions", f"{chat_name}_context.json")
+    context_key = context_key or sanitize_key(chat_name)
     
     # Generate the main response
-    response = chat_with_gpt(user_input, summarized_context, api_key)
-
-    # Update summarized context
-    summarized_context = update_summarized_context(user_input, response, summarized_context, api_key)
-    
-    # Ensure the context fits within the token limit
-    while get_token_count(summarized_context) > MAX_TOKENS:
-        summarized_context = summarize_oldest_context(summarized_context, api_key)
+    response = answer_chat(user_input, summarized_context, api_key)
 
-    # Save summarized context after updating it
-    save_summarized_context(context_file_path, summarized_context)
+    update_and_save_context(context_key, user_input, response, summarized_context, api_key)
 
     return chat_name, response
 
+# Function to summarize an exchange into the chat's stored context, compacting the context once it's too large
+def update_and_save_context(context_key, user_input, response, summarized_context, api_key):
+    with span("summary"):
+        summary = summarize_text(format_exchange(user_input, response), api_key)
+
+    # Added to the context as stored when the write happens: another message of this chat may have
+    # been summarized since `summarized_context` was loaded, and its summary must not be overwritten
+    with span("context_save"):
+        append_summarized_context(context_key, summary, summarized_context)
+
+    context = load_context(context_key)
+    if context.total_tokens > MAX_TOKENS:
+        with span("compaction"):
+            base = [dict(segment) for segment in context.segments]
+            compact_context(context, api_key)
+            save_compacted_context(context_key, context, base)
+    return context
+
+# Function to run a task on the background pool without blocking the caller
+def submit_background_task(fn, *args):
+    future = background_executor.submit(fn, *args)
+    background_tasks.add(future)
+    future.add_done_callback(_background_task_done)
+    return future
+
+def _background_task_done(future):
+    background_tasks.discard(future)
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Background task failed: {future.exception()}")
+
+# Function to wait for pending background tasks (used by benchmarks and shutdown)
+def wait_for_background_tasks(timeout=None):
+    result = wait(list(background_tasks), timeout=timeout)
+    get_context_store().flush(timeout)
+    return result
+
+# Function to wrap a saved context, legacy summary string or chat history in a SummarizedContext
+def new_context(value=""):
+    return SummarizedContext.from_value(value, get_token_count)
+
+# Function to format one exchange for summarization
+def format_exchange(prompt, response):
+    return f"User prompt: {prompt}\nAssistant response: {response}"
+
 # Function to update summarized context
 def update_summarized_context(prompt, response, current_summary, api_key):
-    new_summary = summarize_text(f"User prompt: {prompt}\nAssistant response: {response}", api_key)
-    return f"{current_summary}\n{new_summary}"
+    context = new_context(current_summary)
+    new_summary = summarize_text(format_exchange(prompt, response), api_key)
+    context.append(new_summary)
+    return context
+
+# Function to save summarized context; the write is queued and happens off the request thread
+def save_summarized_context(context_key, summarized_context):
+    context = summarized_context if isinstance(summarized_context, SummarizedContext) else new_context(summarized_context)
+    get_context_store().save(sanitize_key(context_key), context.segments)
 
-# Function to save summarized context to a file
-def save_summarized_context(file_path, summarized_context):
-    with open(file_path, 'w') as file:
-        json.dump({"summarized_context": summarized_context}, file)
+# Function to queue a new summary after the chat's stored context; `current_summary` is stored
+# first when the chat has no stored context yet (a context seeded from an uploaded history)
+def append_summarized_context(context_key, summary, current_summary=""):
+    segment = new_context()
+    segment.append(summary)
+    get_context_store().append(sanitize_key(context_key), segment.segments, initial=new_context(current_summary).segments)
 
-# Function to load summarized context from a file
-def load_summarized_context(file_path):
+# Function to queue a compacted context in place of the `base` segments it was made from
+def save_compacted_context(context_key, context, base):
+    get_context_store().replace(sanitize_key(context_key), context.segments, base)
+
+# Function to load summarized context as text
+def load_summarized_context(context_key):
+    return load_context(context_key).to_text()
+
+# Function to load the structured summarized context, keeping the cached token counts
+def load_context(context_key):
+    key = sanitize_key(context_key)
+    with span("context_load"):
+        segments = get_context_store().load(key)
+    if segments is not None:
+        return new_context({"segments": segments})
+    # Contexts saved before the persistence engine existed were one JSON file per chat, named after
+    # the raw chat name; names that would reach outside chat_sessions were never valid file names
+    name = str(context_key)
+    if name in ("", ".", "..") or os.path.basename(name) != name:
+        return new_context()
     try:
-        with open(file_path, 'r') as file:
-            data = json.load(file)
-            return data.get("summarized_context", "")
-    except FileNotFoundError:
-        return ""
+        with open(os.path.join("chat_sessions", f"{name}_context.json"), 'r') as file:
+            return new_context(json.load(file))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return new_context()
 
 # Function to count tokens in a given text using tiktoken
 def get_token_count(text, model=MODEL):
-    tokens = tokenizer.encode(text)
-    return len(tokens)
-
-# Function to summarize the oldest context
-def summarize_oldest_context(context, api_key):
-    # Split the context into individual exchanges
-    exchanges = context.split('\nUser prompt:')
-    # Summarize the oldest exchange
-    if len(exchanges) > 1:
-        oldest_exchange = exchanges.pop(1)  # Summarize only the first complete exchange (after initial split)
-        summarized_oldest = summarize_text(f"User prompt:{oldest_exchange}", api_key)
-        # Combine the summarized oldest exchange with the remaining context
-        new_context = '\nUser prompt:'.join([exchanges[0]] + [summarized_oldest] + exchanges[1:])
-        return new_context
+    with span("token_count"):
+        return count_tokens(text)
+
+# Function to compact the oldest context: one pass picks every segment to collapse and summarizes them in one call
+def compact_context(context, api_key, max_tokens=None):
+    max_tokens = max_tokens or MAX_TOKENS
+    count = context.plan_compaction(int(max_tokens * COMPACTION_TARGET))
+    if count:
+        summary = summarize_text(context.oldest_text(count), api_key)
+        if summary != SUMMARY_FAILED:
+            context.collapse_oldest(count, summary)
+    # A single oversized segment or a failed summary can leave the context too large
+    context.drop_oldest_until(max_tokens)
     return context
+
+# Function to expose pool, scheduler, cache and persistence state as gauges for /metrics
+def collect_runtime_metrics():
+    pool = get_client_metrics()
+    queue = scheduler.get_metrics()
+    gauges = [
+        ("kronos_openai_pool_in_flight", "Upstream requests currently using the connection pool.", [({}, pool["in_flight"])]),
+        ("kronos_openai_pool_utilization", "In-flight upstream requests as a fraction of the pool size.", [({}, pool["pool_utilization"])]),
+        ("kronos_openai_pool_saturated_requests", "Upstream requests sent while the pool was full.", [({}, pool["saturated_requests"])]),
+        ("kronos_openai_connections_opened", "New upstream TCP connections.", [({}, pool["connections_opened"])]),
+        ("kronos_scheduler_queue_depth", "Requests waiting in the rate-limit scheduler.", [({"priority": name}, depth) for name, depth in queue["queue_depth_by_priority"].items()]),
+        ("kronos_scheduler_mean_wait_seconds", "Mean time requests waited in the scheduler.", [({"priority": name}, wait_seconds) for name, wait_seconds in queue["mean_wait_seconds"].items()]),
+        ("kronos_scheduler_cooldown_seconds", "Remaining shared cooldown after a rate limit.", [({}, queue["cooldown_seconds"])]),
+        ("kronos_scheduler_rate_limited", "Rate-limit responses seen by the scheduler.", [({}, queue["rate_limited"])]),
+    ]
+    cache_stats = completion_cache.get_stats()
+    gauges.append(("kronos_cache_hits", "Completion cache hits by call site.", [({"call_site": site}, stats["hits"]) for site, stats in cache_stats.items()]))
+    gauges.append(("kronos_cache_misses", "Completion cache misses by call site.", [({"call_site": site}, stats["misses"]) for site, stats in cache_stats.items()]))
+    semantic = get_semantic_cache()
+    if semantic is not None:
+        semantic_stats = semantic.get_stats()
+        gauges.append(("kronos_semantic_cache_lookups", "Semantic answer cache lookups by result.", [({"result": "hit"}, semantic_stats["hits"]), ({"result": "miss"}, semantic_stats["misses"])]))
+        gauges.append(("kronos_semantic_cache_entries", "Answers held in the semantic cache.", [({}, semantic_stats["entries"])]))
+        gauges.append(("kronos_semantic_cache_evictions", "Semantic cache entries replaced to stay under the size cap.", [({}, semantic_stats["evictions"])]))
+    if context_persistence.context_store is not None:
+        store_stats = context_persistence.context_store.stats
+        gauges.append(("kronos_context_store_events", "Context persistence events.", [({"event": event}, count) for event, count in store_stats.items()]))
+    return gauges
+
+register_collector(collect_runtime_metrics)
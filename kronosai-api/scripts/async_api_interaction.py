@@ -0,0 +1,243 @@
+import time
+import asyncio
+import threading
+from scripts.completion_cache import completion_cache
+from scripts.api_interaction import (
+    MODEL,
+    NAMING_MODEL,
+    SUMMARY_MODEL,
+    NAMING_MAX_TOKENS,
+    PROMPT_TOO_LARGE,
+    MAX_TOKENS,
+    COMPACTION_TARGET,
+    SUMMARY_FAILED,
+    REQUEST_FAILED,
+    CHAT_TIMEOUT,
+    SUMMARY_TIMEOUT,
+    build_async_client,
+    openai_sdk,
+    build_name_chat_question,
+    clean_chat_name,
+    chunk_text,
+    load_context,
+    format_exchange,
+    summary_request,
+    chat_request,
+    cached_completion,
+    store_completion,
+    semantic_completion,
+    store_semantic_completion,
+    append_summarized_context,
+    save_compacted_context,
+)
+from scripts.context_persistence import sanitize_key
+from scripts import semantic_cache
+from scripts.rate_limiter import scheduler, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from scripts.metrics import span
+
+# One pooled AsyncOpenAI client per API key, shared by every request on the event loop
+async_clients = {}
+async_clients_lock = threading.Lock()
+
+# Summary updates that run after the reply has been sent
+background_tasks = set()
+
+# Function to get the shared async client for an API key
+def get_async_client(api_key):
+    client = async_clients.get(api_key)
+    if client is None:
+        with async_clients_lock:
+            client = async_clients.get(api_key)
+            if client is None:
+                client = async_clients[api_key] = build_async_client(api_key)
+    return client
+
+# Function to look up a cached completion, keeping disk/Redis lookups off the event loop
+async def async_cached_completion(cache_site, cache_key):
+    if cache_key is None or completion_cache.backend.in_memory:
+        return cached_completion(cache_site, cache_key)
+    return await asyncio.to_thread(cached_completion, cache_site, cache_key)
+
+# Function to look up a near-identical earlier answer; embedding and the index scan run off the event loop
+async def async_semantic_completion(cache_site, prompt, summarized_context, model):
+    if not semantic_cache.SEMANTIC_CACHE_ENABLED or cache_site != "answer" or summarized_context:
+        return None
+    return await asyncio.to_thread(semantic_completion, cache_site, prompt, summarized_context, model)
+
+async def async_store_semantic_completion(cache_site, prompt, summarized_context, model, content):
+    if not semantic_cache.SEMANTIC_CACHE_ENABLED or cache_site != "answer" or summarized_context:
+        return content
+    return await asyncio.to_thread(store_semantic_completion, cache_site, prompt, summarized_context, model, content)
+
+# Function to store a successful completion in the cache and pass it through
+async def async_store_completion(cache_key, content):
+    if cache_key is None or completion_cache.backend.in_memory:
+        return store_completion(cache_key, content)
+    return await asyncio.to_thread(store_completion, cache_key, content)
+
+# Function to send a request through the scheduler without blocking the event loop, retrying rate
+# limits like request_with_retries; returns None if it failed
+async def async_request_with_retries(request, client, timeout, priority, max_retries, **options):
+    for attempt in range(1, max_retries + 1):
+        await scheduler.acquire_async(request.estimated_tokens, priority)
+        started = time.perf_counter()
+        try:
+            return request.succeeded(started, await request.send(client, timeout, **options))
+        except openai_sdk().OpenAIError as e:
+            if not request.should_retry(started, e, attempt):
+                return None
+    return None
+
+# Function to summarize a given text using GPT without blocking the event loop
+async def async_summarize_text(text, api_key, model=None, max_retries=5, client=None, timeout=SUMMARY_TIMEOUT, cache_site="summary", priority=PRIORITY_BACKGROUND):
+    client = client or get_async_client(api_key)
+    request = summary_request(text, model or SUMMARY_MODEL, cache_site)
+    if request is None:
+        return SUMMARY_FAILED
+    cached = await async_cached_completion(cache_site, request.cache_key)
+    if cached is not None:
+        return cached
+    response = await async_request_with_retries(request, client, timeout, priority, max_retries)
+    if response is None:
+        return SUMMARY_FAILED
+    return await async_store_completion(request.cache_key, response.choices[0].message.content)
+
+# Function to chat with GPT without blocking the event loop
+async def async_chat_with_gpt(prompt, summarized_context, api_key, model=None, max_retries=5, client=None, timeout=CHAT_TIMEOUT, cache_site="answer", priority=PRIORITY_INTERACTIVE, max_tokens=None):
+    client = client or get_async_client(api_key)
+    model = model or MODEL
+    request = chat_request(prompt, summarized_context, model, cache_site, max_tokens)
+    if request is None:
+        return PROMPT_TOO_LARGE
+    cached = await async_cached_completion(cache_site, request.cache_key) or await async_semantic_completion(cache_site, prompt, summarized_context, model)
+    if cached is not None:
+        return cached
+    response = await async_request_with_retries(request, client, timeout, priority, max_retries)
+    if response is None:
+        return REQUEST_FAILED
+    content = await async_store_completion(request.cache_key, response.choices[0].message.content)
+    return await async_store_semantic_completion(cache_site, prompt, summarized_context, model, content)
+
+# Function to stream a chat completion from GPT, yielding content deltas as they arrive
+async def async_stream_chat_with_gpt(prompt, summarized_context, api_key, model=None, max_retries=5, client=None, timeout=CHAT_TIMEOUT, cache_site="answer", priority=PRIORITY_INTERACTIVE):
+    client = client or get_async_client(api_key)
+    model = model or MODEL
+    request = chat_request(prompt, summarized_context, model, cache_site)
+    if request is None:
+        yield PROMPT_TOO_LARGE
+        return
+    cached = await async_cached_completion(cache_site, request.cache_key) or await async_semantic_completion(cache_site, prompt, summarized_context, model)
+    if cached is not None:
+        yield cached
+        return
+    stream = await async_request_with_retries(request, client, timeout, priority, max_retries, stream=True)
+    if stream is None:
+        yield REQUEST_FAILED
+        return
+
+    # Close the stream even when the client goes away mid-reply, so its connection goes back to the pool
+    parts = []
+    try:
+        async for chunk in stream:
+            delta = chunk_text(chunk)
+            if delta:
+                parts.append(delta)
+                yield delta
+    finally:
+        await stream.close()
+    content = await async_store_completion(request.cache_key, "".join(parts))
+    await async_store_semantic_completion(cache_site, prompt, summarized_context, model, content)
+
+# Function to ask GPT for an appropriate chat name
+async def async_name_chat(user_input, summarized_context, api_key):
+    with span("naming"):
+        chatNameResp = await async_chat_with_gpt(build_name_chat_question(user_input), summarized_context, api_key, model=NAMING_MODEL, cache_site="naming", max_tokens=NAMING_MAX_TOKENS)
+    return clean_chat_name(chatNameResp)
+
+# Function to generate the main response
+async def async_answer_chat(user_input, summarized_context, api_key):
+    with span("answer"):
+        return await async_chat_with_gpt(user_input, summarized_context, api_key)
+
+# Function to generate response from GPT and name the chat concurrently
+async def async_generate_response_and_name_chat(user_input, summarized_context, api_key, chat_title, context_key=None):
+    if chat_title == 'New Chat':
+        chat_name, response = await asyncio.gather(
+            async_name_chat(user_input, summarized_context, api_key),
+            async_answer_chat(user_input, summarized_context, api_key),
+        )
+    else:
+        chat_name = chat_title
+        response = await async_answer_chat(user_input, summarized_context, api_key)
+
+    context_key = context_key or sanitize_key(chat_name)
+    create_background_task(async_update_and_save_context(context_key, user_input, response, summarized_context, api_key))
+
+    return chat_name, response
+
+# Function to stream the response from GPT, sending the chat name first
+async def async_stream_response_and_name_chat(user_input, summarized_context, api_key, chat_title, context_key=None):
+    if chat_title == 'New Chat':
+        name_task = asyncio.ensure_future(async_name_chat(user_input, summarized_context, api_key))
+    else:
+        name_task = None
+
+    deltas = async_stream_chat_with_gpt(user_input, summarized_context, api_key)
+    with span("first_token"):
+        first_delta = await anext(deltas, "")
+    chat_name = await name_task if name_task else chat_title
+    yield {"chat_name": chat_name}
+
+    response_parts = []
+    if first_delta:
+        response_parts.append(first_delta)
+        yield {"delta": first_delta}
+    async for delta in deltas:
+        response_parts.append(delta)
+        yield {"delta": delta}
+
+    # Summarization and persistence run once the stream has closed
+    response = "".join(response_parts)
+    context_key = context_key or sanitize_key(chat_name)
+    create_background_task(async_update_and_save_context(context_key, user_input, response, summarized_context, api_key))
+
+# Function to summarize an exchange into the chat's stored context, compacting the context once it's too large
+async def async_update_and_save_context(context_key, user_input, response, summarized_context, api_key):
+    with span("summary"):
+        summary = await async_summarize_text(format_exchange(user_input, response), api_key)
+
+    # Added to the context as stored when the write happens, like the sync path; the store reads the
+    # chat's current context, so this runs off the event loop
+    with span("context_save"):
+        await asyncio.to_thread(append_summarized_context, context_key, summary, summarized_context)
+
+    context = await asyncio.to_thread(load_context, context_key)
+    if context.total_tokens > MAX_TOKENS:
+        with span("compaction"):
+            base = [dict(segment) for segment in context.segments]
+            await async_compact_context(context, api_key)
+            save_compacted_context(context_key, context, base)
+    return context
+
+# Function to compact the oldest context in a single summarization call
+async def async_compact_context(context, api_key, max_tokens=None):
+    max_tokens = max_tokens or MAX_TOKENS
+    count = context.plan_compaction(int(max_tokens * COMPACTION_TARGET))
+    if count:
+        summary = await async_summarize_text(context.oldest_text(count), api_key)
+        if summary != SUMMARY_FAILED:
+            context.collapse_oldest(count, summary)
+    context.drop_oldest_until(max_tokens)
+    return context
+
+# Function to run a coroutine in the background, keeping a reference until it finishes
+def create_background_task(coro):
+    task = asyncio.ensure_future(coro)
+    background_tasks.add(task)
+    task.add_done_callback(_background_task_done)
+    return task
+
+def _background_task_done(task):
+    background_tasks.discard(task)
+    if not task.cancelled() and task.exception() is not None:
+        print(f"Background task failed: {task.exception()}")
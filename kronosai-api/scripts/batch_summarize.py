@@ -0,0 +1,422 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from scripts.api_interaction import (
+    SUMMARY_MODEL,
+    MAX_TOKENS,
+    SUMMARY_FAILED,
+    read_api_key,
+    new_context,
+    load_context,
+    format_exchange,
+    summarize_text,
+    compact_context,
+    save_compacted_context,
+    get_token_count,
+    wait_for_background_tasks,
+)
+from scripts.context_persistence import get_context_store, sanitize_key
+
+# Batch compaction of stored chat contexts, for backfills after a summary prompt or model change.
+# Contexts are read a page of keys at a time, several segments or exchanges are packed into each
+# summarization request, chats are processed under a bounded concurrency limit, and every finished
+# chat is appended to a checkpoint file so an interrupted run can resume where it stopped.
+# Results are saved only over the context they were made from, so summaries a live chat adds in the
+# meantime are kept. A lock file allows one job at a time across all worker processes and the CLI.
+
+BATCH_CONCURRENCY = int(os.environ.get("KRONOS_BATCH_CONCURRENCY", "4"))
+BATCH_PACK_SIZE = int(os.environ.get("KRONOS_BATCH_PACK_SIZE", "8"))
+CHECKPOINT_PATH = os.path.join("chat_sessions", "batch_summarize.checkpoint")
+JOB_LOCK_PATH = os.path.join("chat_sessions", "batch_summarize.lock")
+JOB_STATUS_PATH = os.path.join("chat_sessions", "batch_summarize.status.json")
+JOB_STOP_PATH = os.path.join("chat_sessions", "batch_summarize.stop")
+STATUS_INTERVAL = 1.0
+MODES = ("compact", "rebuild")
+
+# Function to group items into packs of pack_size
+def pack(items, pack_size):
+    return [items[i:i + pack_size] for i in range(0, len(items), pack_size)]
+
+# Function to pair a chat's logged messages into (prompt, response) exchanges
+def log_exchanges(messages):
+    exchanges = []
+    prompt = None
+    for message in messages:
+        if message["speaker"] == "You":
+            prompt = message["content"]
+        elif prompt is not None:
+            exchanges.append((prompt, message["content"]))
+            prompt = None
+    return exchanges
+
+# Function to list every stored context key: the persistence engine first, then legacy JSON files
+def iter_context_keys(root="chat_sessions"):
+    seen = set()
+    for key in get_context_store().iter_keys():
+        seen.add(key)
+        yield key
+    try:
+        names = sorted(os.listdir(root))
+    except FileNotFoundError:
+        return
+    for name in names:
+        if name.endswith("_context.json"):
+            key = name[:-len("_context.json")]
+            if key not in seen:
+                yield key
+
+# Function to list the chats that have a server-side message log
+def iter_logged_chats():
+    from scripts.conversation_store import conversation_store
+    yield from conversation_store.chat_ids()
+
+class Checkpoint:
+    # The first line records the run settings; every following line is a finished key
+    def __init__(self, path, settings, resume=False):
+        self.path = path
+        self.done = set()
+        if resume and os.path.exists(path):
+            with open(path, 'r') as file:
+                header = json.loads(file.readline() or "null")
+                if header != settings:
+                    raise ValueError(f"Checkpoint {path} was written with different settings: {header}")
+                self.done.update(line.strip() for line in file if line.strip())
+            self.file = open(path, 'a')
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            self.file = open(path, 'w')
+            self.file.write(json.dumps(settings) + "\n")
+            self.file.flush()
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def mark(self, key):
+        self.done.add(key)
+        self.file.write(key + "\n")
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+class BatchSummarizer:
+    def __init__(self, api_key, mode="compact", concurrency=BATCH_CONCURRENCY, pack_size=BATCH_PACK_SIZE,
+                 checkpoint_path=CHECKPOINT_PATH, resume=False, limit=None, model=SUMMARY_MODEL, report_every=50, log=print):
+        if mode not in MODES:
+            raise ValueError(f"Unknown mode {mode!r}, expected one of {MODES}")
+        if concurrency < 1 or pack_size < 1:
+            raise ValueError("concurrency and pack_size must be at least 1")
+        self.api_key = api_key
+        self.mode = mode
+        self.concurrency = concurrency
+        self.pack_size = pack_size
+        self.checkpoint_path = checkpoint_path
+        self.resume = resume
+        self.limit = limit
+        self.model = model
+        self.report_every = report_every
+        self.log = log
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.stats = {"chats_done": 0, "chats_skipped": 0, "chats_unchanged": 0, "chats_failed": 0, "requests": 0, "input_tokens": 0, "output_tokens": 0}
+        self.started_at = None
+        self.finished_at = None
+        self.running = False
+
+    # Function to summarize one pack of text; returns None if the request failed
+    def summarize_pack(self, text):
+        summary = summarize_text(text, self.api_key, model=self.model)
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["input_tokens"] += get_token_count(text)
+            if summary != SUMMARY_FAILED:
+                self.stats["output_tokens"] += get_token_count(summary)
+        return None if summary == SUMMARY_FAILED else summary
+
+    # Function to collapse a stored context's older segments in packs, keeping the newest segment intact.
+    # Returns the compacted context and the segments it was made from, or None if nothing changed.
+    def compact_chat(self, key):
+        context = load_context(key)
+        if len(context) <= 2:
+            return None
+        base = [dict(segment) for segment in context.segments]
+        segments = [segment["text"] for segment in context.segments]
+        packed = []
+        for group in pack(segments[:-1], self.pack_size):
+            if len(group) == 1:
+                packed.append(group[0])
+                continue
+            summary = self.summarize_pack("\n".join(group))
+            if summary is None:
+                raise RuntimeError("summarization failed")
+            packed.append(summary)
+        if len(packed) == len(segments) - 1:
+            return None
+        return new_context({"segments": [{"text": text} for text in packed + segments[-1:]]}), base
+
+    # Function to rebuild a chat's context from its message log, several exchanges per request.
+    # Returns the rebuilt context and the stored segments it replaces, or None for an empty log.
+    def rebuild_chat(self, chat_id):
+        from scripts.conversation_store import conversation_store
+        # Read before the log, so summaries appended while the batch runs come after `base`
+        base = [dict(segment) for segment in load_context(chat_id).segments]
+        exchanges = log_exchanges(conversation_store.messages(chat_id))
+        if not exchanges:
+            return None
+        context = new_context()
+        for group in pack(exchanges, self.pack_size):
+            summary = self.summarize_pack("\n\n".join(format_exchange(prompt, response) for prompt, response in group))
+            if summary is None:
+                raise RuntimeError("summarization failed")
+            context.append(summary)
+        if context.total_tokens > MAX_TOKENS:
+            compact_context(context, self.api_key)
+        return context, base
+
+    def process(self, key):
+        result = self.compact_chat(key) if self.mode == "compact" else self.rebuild_chat(key)
+        if result is None:
+            return False
+        # Dropped by the store if the chat was compacted elsewhere since it was read
+        context, base = result
+        save_compacted_context(key, context, base)
+        return True
+
+    def iter_keys(self):
+        return iter_context_keys() if self.mode == "compact" else iter_logged_chats()
+
+    def settings(self):
+        return {"mode": self.mode, "model": self.model, "pack_size": self.pack_size}
+
+    # Function to run the batch to completion (or until stopped); returns the final report
+    def run(self):
+        self.running = True
+        self.started_at = time.perf_counter()
+        checkpoint = Checkpoint(self.checkpoint_path, self.settings(), resume=self.resume)
+        try:
+            with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="kronos-batch") as executor:
+                pending = {}
+                submitted = 0
+                for name in self.iter_keys():
+                    if self.stop_event.is_set() or (self.limit is not None and submitted >= self.limit):
+                        break
+                    # Legacy context files are loaded by their raw chat name; progress is kept by storage key
+                    key = sanitize_key(name) if self.mode == "compact" else name
+                    if key in checkpoint:
+                        self.stats["chats_skipped"] += 1
+                        continue
+                    # Keep only a couple of chats queued per worker, so keys are read as the work drains
+                    while len(pending) >= self.concurrency * 2:
+                        self._collect(wait(pending, return_when=FIRST_COMPLETED).done, pending, checkpoint)
+                    pending[executor.submit(self.process, name)] = key
+                    submitted += 1
+                while pending:
+                    self._collect(wait(pending, return_when=FIRST_COMPLETED).done, pending, checkpoint)
+            wait_for_background_tasks()
+        finally:
+            checkpoint.close()
+            self.finished_at = time.perf_counter()
+            self.running = False
+        return self.report()
+
+    def _collect(self, done, pending, checkpoint):
+        for future in done:
+            key = pending.pop(future)
+            try:
+                changed = future.result()
+            except Exception as e:
+                self.stats["chats_failed"] += 1
+                self.log(f"Batch summarization failed for {key}: {e}")
+                continue
+            self.stats["chats_done" if changed else "chats_unchanged"] += 1
+            checkpoint.mark(key)
+            finished = self.stats["chats_done"] + self.stats["chats_unchanged"]
+            if self.report_every and finished % self.report_every == 0:
+                self.log(self.format_report())
+
+    def stop(self):
+        self.stop_event.set()
+
+    # Function to report progress and throughput so far
+    def report(self):
+        with self.lock:
+            report = dict(self.stats)
+        end = self.finished_at if self.finished_at is not None else time.perf_counter()
+        elapsed = end - self.started_at if self.started_at is not None else 0.0
+        report["running"] = self.running
+        report["elapsed_seconds"] = elapsed
+        report["chats_per_second"] = (report["chats_done"] + report["chats_unchanged"]) / elapsed if elapsed else 0.0
+        report["requests_per_second"] = report["requests"] / elapsed if elapsed else 0.0
+        report["input_tokens_per_second"] = report["input_tokens"] / elapsed if elapsed else 0.0
+        return report
+
+    def format_report(self):
+        report = self.report()
+        return (f"{report['chats_done']} compacted, {report['chats_unchanged']} unchanged, {report['chats_skipped']} skipped, "
+                f"{report['chats_failed']} failed in {report['elapsed_seconds']:.1f}s: {report['chats_per_second']:.1f} chats/s, "
+                f"{report['requests_per_second']:.1f} requests/s, {report['input_tokens_per_second']:.0f} input tokens/s")
+
+# Function to take the batch job lock without waiting; returns the open lock file, or None if
+# another process holds it. Without fcntl (Windows) jobs are only kept apart within a process.
+def try_lock(path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    file = open(path, 'a')
+    if fcntl is None:
+        return file
+    try:
+        fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        file.close()
+        return None
+    return file
+
+# Function to check whether some process holds the batch job lock
+def is_locked(path):
+    if not os.path.exists(path):
+        return False
+    file = try_lock(path)
+    if file is None:
+        return True
+    file.close()
+    return False
+
+class BatchJob:
+    # One batch run at a time across every worker process. The worker running the job writes its status
+    # to a shared file, so the admin endpoint reports it (and can stop it) from whichever worker answers.
+    def __init__(self, lock_path=JOB_LOCK_PATH, status_path=JOB_STATUS_PATH, stop_path=JOB_STOP_PATH):
+        self.lock_path = lock_path
+        self.status_path = status_path
+        self.stop_path = stop_path
+        self.summarizer = None
+        self.thread = None
+        self.lock_file = None
+        self.error = None
+        self.lock = threading.Lock()
+
+    def is_running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, api_key, **options):
+        with self.lock:
+            if self.is_running():
+                return False
+            summarizer = BatchSummarizer(api_key, **options)
+            lock_file = try_lock(self.lock_path)
+            if lock_file is None:
+                return False
+            if os.path.exists(self.stop_path):
+                os.remove(self.stop_path)
+            self.summarizer = summarizer
+            self.lock_file = lock_file
+            self.error = None
+            self.thread = threading.Thread(target=self._run, name="kronos-batch-job", daemon=True)
+            self.thread.start()
+            return True
+
+    def _run(self):
+        finished = threading.Event()
+        publisher = threading.Thread(target=self._publish, args=(finished,), name="kronos-batch-status", daemon=True)
+        publisher.start()
+        try:
+            self.summarizer.run()
+        except Exception as e:
+            self.error = str(e)
+            print(f"Batch summarization job failed: {e}")
+        finally:
+            finished.set()
+            publisher.join()
+            self._write_status(self._local_status(running=False))
+            self.lock_file.close()
+
+    # Function to share the job's progress with the other workers and pick up their stop requests
+    def _publish(self, finished):
+        while True:
+            if os.path.exists(self.stop_path):
+                self.summarizer.stop()
+            self._write_status(self._local_status(running=True))
+            if finished.wait(STATUS_INTERVAL):
+                return
+
+    def _write_status(self, status):
+        try:
+            temporary_path = f"{self.status_path}.{os.getpid()}.tmp"
+            with open(temporary_path, 'w') as file:
+                json.dump(status, file)
+            os.replace(temporary_path, self.status_path)
+        except OSError as e:
+            print(f"Could not write the batch job status: {e}")
+
+    def _local_status(self, running):
+        status = self.summarizer.report()
+        status.update(self.summarizer.settings())
+        status["running"] = running
+        status["error"] = self.error
+        status["pid"] = os.getpid()
+        return status
+
+    def stop(self):
+        if self.is_running():
+            self.summarizer.stop()
+            return
+        # The job may be running in another worker, which checks for this file
+        if is_locked(self.lock_path):
+            with open(self.stop_path, 'w'):
+                pass
+
+    def status(self):
+        if self.is_running():
+            return self._local_status(running=True)
+        try:
+            with open(self.status_path, 'r') as file:
+                status = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"running": False}
+        # A worker that died mid-run left "running" behind, but not its lock
+        if status.get("running") and not is_locked(self.lock_path):
+            status["running"] = False
+            status["error"] = status.get("error") or "The worker running the job exited"
+        return status
+
+batch_job = BatchJob()
+
+# Function to read the admin endpoint options from a request payload
+def job_options(data):
+    options = {"mode": data.get("mode", "compact"), "resume": bool(data.get("resume", False))}
+    for name in ("concurrency", "pack_size", "limit"):
+        if data.get(name) is not None:
+            options[name] = int(data[name])
+    return options
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compact or rebuild every stored chat context in batches.")
+    parser.add_argument("--mode", choices=MODES, default="compact", help="compact existing summaries, or rebuild them from the message logs")
+    parser.add_argument("--concurrency", type=int, default=BATCH_CONCURRENCY, help="chats summarized at once")
+    parser.add_argument("--pack-size", type=int, default=BATCH_PACK_SIZE, help="segments or exchanges per summarization request")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="progress file used to resume")
+    parser.add_argument("--resume", action="store_true", help="skip chats finished by an earlier run with the same settings")
+    parser.add_argument("--limit", type=int, default=None, help="stop after this many chats")
+    parser.add_argument("--api-key-file", default="api_key.txt")
+    args = parser.parse_args()
+
+    summarizer = BatchSummarizer(read_api_key(args.api_key_file), mode=args.mode, concurrency=args.concurrency, pack_size=args.pack_size,
+                                 checkpoint_path=args.checkpoint, resume=args.resume, limit=args.limit)
+    lock_file = try_lock(JOB_LOCK_PATH)
+    if lock_file is None:
+        print("A batch summarization job is already running")
+        sys.exit(1)
+    try:
+        summarizer.run()
+    except KeyboardInterrupt:
+        print("Interrupted; run again with --resume to continue")
+        sys.exit(1)
+    finally:
+        lock_file.close()
+    print(summarizer.format_report())
@@ -0,0 +1,258 @@
+import os
+import re
+import json
+import time
+import sqlite3
+
+# On-disk index of the desktop client's saved chats (<title>.json in the chat sessions directory).
+# For every chat it keeps the file's size and mtime, and for every message its speaker, a short
+# preview and the byte range it occupies in the file, so a page of a long chat is read by seeking
+# instead of parsing the whole file. An inverted index (term -> chat, message) backs full-text search.
+# New messages are appended in place to the JSON file, so saving doesn't rewrite the chat either.
+
+INDEX_FILE = "chat_index.sqlite3"
+PREVIEW_LENGTH = 100
+TERM_PATTERN = re.compile(r"\w{2,}")
+
+# Function to split text into the lowercase terms used by the inverted index
+def terms(text):
+    return set(TERM_PATTERN.findall(text.lower()))
+
+def skip_whitespace(text, pos):
+    while pos < len(text) and text[pos] in " \t\r\n":
+        pos += 1
+    return pos
+
+# Function to parse a chat file and return its history with the byte range of each message and
+# the byte offset of the "]" closing the history list
+def scan_chat_file(data):
+    text = data.decode("utf-8")
+    decoder = json.JSONDecoder()
+    pos = skip_whitespace(text, 0)
+    if not text.startswith("{", pos):
+        raise ValueError("chat file is not a JSON object")
+    pos = skip_whitespace(text, pos + 1)
+    history = None
+    while pos < len(text) and text[pos] != "}":
+        key, pos = decoder.raw_decode(text, pos)
+        pos = skip_whitespace(text, pos)
+        pos = skip_whitespace(text, pos + 1)  # the ":"
+        if key == "history":
+            history, pos = scan_history(text, pos, decoder)
+        else:
+            _, pos = decoder.raw_decode(text, pos)
+        pos = skip_whitespace(text, pos)
+        if text.startswith(",", pos):
+            pos = skip_whitespace(text, pos + 1)
+    if history is None:
+        raise ValueError("chat file has no history")
+    messages, history_end = history
+    # Offsets so far are character positions; the file is read and written by byte position
+    if len(text) != len(data):
+        byte_offsets = {}
+        previous = byte_offset = 0
+        for position in sorted({offset for _, start, end in messages for offset in (start, end)} | {history_end}):
+            byte_offset += len(text[previous:position].encode("utf-8"))
+            byte_offsets[position] = byte_offset
+            previous = position
+        messages = [(message, byte_offsets[start], byte_offsets[end]) for message, start, end in messages]
+        history_end = byte_offsets[history_end]
+    return messages, history_end
+
+def scan_history(text, pos, decoder):
+    if not text.startswith("[", pos):
+        raise ValueError("chat history is not a list")
+    pos = skip_whitespace(text, pos + 1)
+    messages = []
+    while not text.startswith("]", pos):
+        message, end = decoder.raw_decode(text, pos)
+        messages.append((message, pos, end))
+        pos = skip_whitespace(text, end)
+        if text.startswith(",", pos):
+            pos = skip_whitespace(text, pos + 1)
+    return (messages, pos), pos + 1
+
+class ChatIndex:
+    def __init__(self, chat_sessions_dir):
+        self.chat_sessions_dir = chat_sessions_dir
+        os.makedirs(chat_sessions_dir, exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(chat_sessions_dir, INDEX_FILE))
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS chats (title TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, message_count INTEGER, history_end INTEGER, updated_at REAL)")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS messages (title TEXT, position INTEGER, speaker TEXT, start INTEGER, end INTEGER, preview TEXT, indexed_at REAL, PRIMARY KEY (title, position))")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS postings (term TEXT, title TEXT, position INTEGER)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS postings_term ON postings (term, title, position)")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS postings_chat ON postings (title)")
+        self.connection.commit()
+
+    def path(self, title):
+        return os.path.join(self.chat_sessions_dir, title + ".json")
+
+    # Function to bring the index up to date with the chat files: new or changed files are reindexed,
+    # missing ones dropped. Unchanged files only cost a stat.
+    def refresh(self):
+        indexed = {row[0]: (row[1], row[2]) for row in self.connection.execute("SELECT title, size, mtime_ns FROM chats")}
+        present = set()
+        for entry in os.scandir(self.chat_sessions_dir):
+            if not entry.is_file() or not entry.name.endswith(".json") or entry.name.endswith("_context.json"):
+                continue
+            title = entry.name[:-len(".json")]
+            present.add(title)
+            stat = entry.stat()
+            if indexed.get(title) != (stat.st_size, stat.st_mtime_ns):
+                self.index_file(title)
+        for title in indexed.keys() - present:
+            self.remove(title)
+        return self.titles()
+
+    # Function to (re)index one chat file; returns False if it isn't a readable chat
+    def index_file(self, title):
+        path = self.path(title)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+                stat = os.fstat(file.fileno())
+            messages, history_end = scan_chat_file(data)
+        except (OSError, ValueError, UnicodeDecodeError) as e:
+            print(f"Skipping chat file {path}: {e}")
+            self._delete(title)
+            self.connection.commit()
+            return False
+        self._delete(title)
+        self.connection.execute("INSERT INTO chats VALUES (?, ?, ?, ?, ?, ?)", (title, stat.st_size, stat.st_mtime_ns, len(messages), history_end, stat.st_mtime))
+        self._add_messages(title, 0, messages, stat.st_mtime)
+        self.connection.commit()
+        return True
+
+    def _add_messages(self, title, first_position, messages, indexed_at):
+        rows = []
+        postings = []
+        for position, (message, start, end) in enumerate(messages, first_position):
+            speaker, content = message[0], str(message[1])
+            rows.append((title, position, speaker, start, end, content[:PREVIEW_LENGTH], indexed_at))
+            postings.extend((term, title, position) for term in terms(content))
+        self.connection.executemany("INSERT INTO messages VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        self.connection.executemany("INSERT INTO postings VALUES (?, ?, ?)", postings)
+
+    def _delete(self, title):
+        self.connection.execute("DELETE FROM chats WHERE title = ?", (title,))
+        self.connection.execute("DELETE FROM messages WHERE title = ?", (title,))
+        self.connection.execute("DELETE FROM postings WHERE title = ?", (title,))
+
+    def remove(self, title):
+        self._delete(title)
+        self.connection.commit()
+
+    def clear(self):
+        for table in ("chats", "messages", "postings"):
+            self.connection.execute(f"DELETE FROM {table}")
+        self.connection.commit()
+
+    # Function to list chat titles, most recently updated first
+    def titles(self):
+        return [row[0] for row in self.connection.execute("SELECT title FROM chats ORDER BY updated_at DESC, title")]
+
+    # Function to get a chat's index entry, reindexing it first if its file changed on disk
+    def get(self, title):
+        row = self.connection.execute("SELECT size, mtime_ns, message_count, history_end, updated_at FROM chats WHERE title = ?", (title,)).fetchone()
+        try:
+            stat = os.stat(self.path(title))
+        except FileNotFoundError:
+            if row is not None:
+                self.remove(title)
+            return None
+        if row is None or (row[0], row[1]) != (stat.st_size, stat.st_mtime_ns):
+            if not self.index_file(title):
+                return None
+            row = self.connection.execute("SELECT size, mtime_ns, message_count, history_end, updated_at FROM chats WHERE title = ?", (title,)).fetchone()
+        return {"title": title, "size": row[0], "mtime_ns": row[1], "message_count": row[2], "history_end": row[3], "updated_at": row[4]}
+
+    # Function to read messages [start, stop) of a chat by seeking to their byte range
+    def read_messages(self, title, start, stop):
+        rows = self.connection.execute("SELECT start, end FROM messages WHERE title = ? AND position >= ? AND position < ? ORDER BY position", (title, start, stop)).fetchall()
+        if not rows:
+            return []
+        first, last = rows[0][0], rows[-1][1]
+        with open(self.path(title), 'rb') as file:
+            file.seek(first)
+            data = file.read(last - first)
+        return [json.loads(data[begin - first:end - first]) for begin, end in rows]
+
+    # Function to list a chat's user prompts as (position, preview), for the prompt list
+    def prompts(self, title):
+        return self.connection.execute("SELECT position, preview FROM messages WHERE title = ? AND speaker = 'You' ORDER BY position", (title,)).fetchall()
+
+    # Function to append messages to a chat file in place (creating it if needed) and index them
+    def append(self, title, messages):
+        meta = self.get(title)
+        if meta is None:
+            self.write(title, messages)
+            return
+        if not messages:
+            return
+        path = self.path(title)
+        separator = b", " if meta["message_count"] else b""
+        with open(path, 'r+b') as file:
+            file.seek(meta["history_end"])
+            tail = file.read()
+            offset = meta["history_end"] + len(separator)
+            added = []
+            encoded = []
+            for message in messages:
+                data = json.dumps(list(message)).encode("utf-8")
+                added.append((list(message), offset, offset + len(data)))
+                encoded.append(data)
+                offset += len(data) + 2
+            payload = separator + b", ".join(encoded)
+            file.seek(meta["history_end"])
+            file.write(payload + tail)
+            file.truncate()
+        stat = os.stat(path)
+        now = time.time()
+        self.connection.execute("UPDATE chats SET size = ?, mtime_ns = ?, message_count = ?, history_end = ?, updated_at = ? WHERE title = ?",
+                                (stat.st_size, stat.st_mtime_ns, meta["message_count"] + len(messages), meta["history_end"] + len(payload), now, title))
+        self._add_messages(title, meta["message_count"], added, now)
+        self.connection.commit()
+
+    # Function to write a whole chat file and index it
+    def write(self, title, history):
+        with open(self.path(title), 'w') as file:
+            json.dump({"title": title, "history": [list(message) for message in history]}, file)
+        self.index_file(title)
+
+    # Function to save a chat whose loaded messages start at position `base`: only messages the
+    # file doesn't have yet are appended; a chat loaded from the start is rewritten if it diverged
+    def save(self, title, history, base=0):
+        meta = self.get(title)
+        saved = meta["message_count"] if meta is not None else 0
+        if meta is not None and base <= saved <= base + len(history):
+            self.append(title, history[saved - base:])
+        elif base == 0:
+            self.write(title, history)
+        else:
+            raise ValueError(f"Chat '{title}' on disk no longer matches the loaded messages")
+
+    # Function to find messages containing every word of the query (the last word may be a prefix),
+    # newest chats first; returns (title, position, preview) tuples
+    def search(self, query, limit=50):
+        words = TERM_PATTERN.findall(query.lower())
+        if not words:
+            return []
+        clauses = ["SELECT title, position FROM postings WHERE term = ?"] * (len(words) - 1)
+        clauses.append("SELECT title, position FROM postings WHERE term >= ? AND term < ?")
+        params = words[:-1] + [words[-1], words[-1] + "￿"]
+        matches = " INTERSECT ".join(clauses)
+        sql = (f"SELECT m.title, m.position, m.preview FROM ({matches}) hits "
+               "JOIN messages m ON m.title = hits.title AND m.position = hits.position "
+               "JOIN chats c ON c.title = m.title ORDER BY c.updated_at DESC, m.position DESC LIMIT ?")
+        return self.connection.execute(sql, params + [limit]).fetchall()
+
+chat_indexes = {}
+
+# Function to get the index for a chat sessions directory, opening and refreshing it on first use
+def get_chat_index(chat_sessions_dir):
+    chat_index = chat_indexes.get(chat_sessions_dir)
+    if chat_index is None:
+        chat_index = chat_indexes[chat_sessions_dir] = ChatIndex(chat_sessions_dir)
+        chat_index.refresh()
+    return chat_index
@@ -0,0 +1,122 @@
+import os
+import queue
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Background completions for the Tk desktop client. Jobs run on a worker pool and report what they
+# produce (streamed deltas, the chat name, errors, completion) through a queue that the Tk main loop
+# drains with `after`, so no widget is touched off the main thread and the window never blocks on GPT.
+
+POLL_INTERVAL_MS = 30
+MAX_EVENTS_PER_POLL = 200
+
+class ChatJob:
+    def __init__(self, job_id, view, on_event):
+        self.id = job_id
+        self.view = view
+        self.on_event = on_event
+        self.cancelled = threading.Event()
+        self.future = None
+        self.finished = False
+        self.on_hide = None
+        # Chat the reply belongs to, once it has a name; a discarded job's reply is not saved
+        self.title = None
+        self.discarded = False
+
+    def cancel(self, discard=False):
+        self.discarded = self.discarded or discard
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+class ChatWorker:
+    def __init__(self, max_workers=int(os.environ.get("KRONOS_DESKTOP_WORKERS", "4"))):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kronos-desktop")
+        self.events = queue.Queue()
+        self.jobs = {}
+        self.ids = itertools.count(1)
+        self.view = 0
+        self.polling = False
+
+    # Function to start a job; `run(cancelled)` is a generator of (kind, value) events run on a worker thread,
+    # and `on_event(job, kind, value)` is called for each of them on the Tk thread
+    def submit(self, widget, run, on_event):
+        job = ChatJob(next(self.ids), self.view, on_event)
+        self.jobs[job.id] = job
+        job.future = self.executor.submit(self._run, job, run)
+        if not self.polling:
+            self.polling = True
+            widget.after(POLL_INTERVAL_MS, self.poll, widget)
+        return job
+
+    def _run(self, job, run):
+        try:
+            for event in run(job.cancelled):
+                if job.cancelled.is_set():
+                    break
+                self.events.put((job, event))
+        except Exception as e:
+            self.events.put((job, ("error", str(e))))
+        finally:
+            self.events.put((job, ("done", job.cancelled.is_set())))
+
+    # Function to deliver queued events on the Tk thread, re-arming itself while jobs are in flight
+    def poll(self, widget):
+        for _ in range(MAX_EVENTS_PER_POLL):
+            try:
+                job, (kind, value) = self.events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "done":
+                job.finished = True
+                self.jobs.pop(job.id, None)
+            elif job.cancelled.is_set():
+                continue
+            try:
+                job.on_event(job, kind, value)
+            except Exception as e:
+                print(f"Desktop chat event failed: {e}")
+        if self.jobs or not self.events.empty():
+            widget.after(POLL_INTERVAL_MS, self.poll, widget)
+        else:
+            self.polling = False
+
+    # Function to mark that the chat log now shows a different chat; jobs started before keep running
+    # but stop drawing into the log
+    def next_view(self):
+        for job in self.in_flight(self.view):
+            if job.on_hide is not None:
+                job.on_hide()
+        self.view += 1
+        return self.view
+
+    def is_visible(self, job):
+        return job.view == self.view
+
+    def in_flight(self, view=None):
+        return [job for job in self.jobs.values() if view is None or job.view == view]
+
+    # Function to cancel the jobs of one view (the displayed chat by default), or every job with view=False;
+    # with discard=True their replies are dropped instead of saved
+    def cancel(self, view=None, discard=False):
+        view = self.view if view is None else view
+        return self._cancel(self.in_flight(None if view is False else view), discard)
+
+    # Function to cancel and discard every job answering in a chat, shown or not, e.g. when it is deleted
+    def cancel_chat(self, title):
+        return self._cancel([job for job in self.jobs.values() if job.title == title], True)
+
+    def _cancel(self, jobs, discard):
+        for job in jobs:
+            job.cancel(discard)
+            if job.future.cancelled():
+                # Never started, so no "done" event will come from the worker
+                self.events.put((job, ("done", True)))
+        return len(jobs)
+
+    def shutdown(self):
+        self.cancel(False)
+        self.executor.shutdown(wait=False)
+
+chat_worker = ChatWorker()
@@ -0,0 +1,164 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Call sites that are always cached; answers are only cached when KRONOS_CACHE_ANSWERS=1
+ALWAYS_CACHED_SITES = {"naming", "summary"}
+CACHE_ANSWERS = os.environ.get("KRONOS_CACHE_ANSWERS") == "1"
+
+# Function to normalize messages so trivially different prompts share a cache entry
+def normalize_messages(messages):
+    return [{"role": message["role"], "content": re.sub(r"\s+", " ", str(message["content"])).strip()} for message in messages]
+
+# Function to build the cache key from the model, normalized messages and request parameters
+def make_cache_key(model, messages, **params):
+    payload = json.dumps({"model": model, "messages": normalize_messages(messages), "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+# In-process LRU cache with a per-entry TTL
+class MemoryCacheBackend:
+    in_memory = True
+
+    def __init__(self, max_entries=1024, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.time():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (value, time.time() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+# Disk cache in a SQLite file, shared by every worker process on the host
+class DiskCacheBackend:
+    in_memory = False
+
+    def __init__(self, path="chat_sessions/completion_cache.sqlite3", max_entries=100000, ttl=86400):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.local = threading.local()
+        connection = self.connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, value TEXT, expires_at REAL, used_at REAL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS completions_used_at ON completions (used_at)")
+        connection.commit()
+
+    def connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=10)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self.connect()
+        row = connection.execute("SELECT value, expires_at FROM completions WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            connection.execute("DELETE FROM completions WHERE key = ?", (key,))
+            connection.commit()
+            return None
+        connection.execute("UPDATE completions SET used_at = ? WHERE key = ?", (time.time(), key))
+        connection.commit()
+        return row[0]
+
+    def set(self, key, value):
+        connection = self.connect()
+        now = time.time()
+        connection.execute("INSERT OR REPLACE INTO completions VALUES (?, ?, ?, ?)", (key, value, now + self.ttl, now))
+        connection.execute("DELETE FROM completions WHERE key IN (SELECT key FROM completions ORDER BY used_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        connection.commit()
+
+    def __len__(self):
+        return self.connect().execute("SELECT COUNT(*) FROM completions").fetchone()[0]
+
+# Cache on a Redis-compatible server (Redis, Valkey, KeyDB, ...), TTL handled by the server
+class RedisCacheBackend:
+    in_memory = False
+
+    def __init__(self, url="redis://localhost:6379/0", ttl=86400, prefix="kronosai:completion:"):
+        import redis  # Optional dependency, only needed for this backend
+
+        self.client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return value.decode() if value is not None else None
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, value)
+
+    def __len__(self):
+        return sum(1 for _ in self.client.scan_iter(self.prefix + "*"))
+
+# Completion cache with hit/miss counters per call site
+class CompletionCache:
+    def __init__(self, backend, answers=CACHE_ANSWERS):
+        self.backend = backend
+        self.answers = answers
+        self.stats = {}
+        self.lock = threading.Lock()
+
+    def enabled_for(self, site):
+        return site in ALWAYS_CACHED_SITES or (site == "answer" and self.answers)
+
+    def get(self, site, key):
+        value = self.backend.get(key)
+        with self.lock:
+            site_stats = self.stats.setdefault(site, {"hits": 0, "misses": 0})
+            site_stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def set(self, key, value):
+        self.backend.set(key, value)
+
+    def get_stats(self):
+        with self.lock:
+            stats = {site: dict(site_stats) for site, site_stats in self.stats.items()}
+        for site_stats in stats.values():
+            lookups = site_stats["hits"] + site_stats["misses"]
+            site_stats["hit_rate"] = site_stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+# Function to build the completion cache from the KRONOS_CACHE_* settings
+def build_completion_cache():
+    backend_name = os.environ.get("KRONOS_CACHE_BACKEND", "memory")
+    ttl = float(os.environ.get("KRONOS_CACHE_TTL", "3600"))
+    max_entries = int(os.environ.get("KRONOS_CACHE_MAX_ENTRIES", "1024"))
+    if backend_name == "disk":
+        backend = DiskCacheBackend(os.environ.get("KRONOS_CACHE_PATH", "chat_sessions/completion_cache.sqlite3"), max_entries=max_entries, ttl=ttl)
+    elif backend_name == "redis":
+        backend = RedisCacheBackend(os.environ.get("KRONOS_CACHE_REDIS_URL", "redis://localhost:6379/0"), ttl=int(ttl))
+    else:
+        backend = MemoryCacheBackend(max_entries=max_entries, ttl=ttl)
+    return CompletionCache(backend)
+
+completion_cache = build_completion_cache()
@@ -0,0 +1,286 @@
+import os
+import re
+import json
+import time
+import atexit
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from scripts.metrics import span
+
+# Persistence engine for summarized chat context: an embedded SQLite store (WAL mode) that
+# appends new segments as deltas and periodically folds them into a snapshot. Writes go through
+# a write-behind queue drained by one writer thread, so requests never wait on disk and concurrent
+# writers for the same chat are serialized. Appends and compactions are applied to the context as
+# stored when the write happens, never to a copy taken earlier, so overlapping updates of one chat
+# don't drop each other's segments. Reads are served from an in-memory hot set while the key's
+# version in the database still matches, so a context another worker process changed is read again.
+
+CONTEXT_DB_PATH = os.environ.get("KRONOS_CONTEXT_DB", os.path.join("chat_sessions", "context.sqlite3"))
+COMPACT_AFTER_DELTAS = int(os.environ.get("KRONOS_CONTEXT_COMPACT_AFTER", "20"))
+HOT_SET_SIZE = int(os.environ.get("KRONOS_CONTEXT_HOT_SET", "512"))
+MAX_KEY_LENGTH = 100
+
+# Function to turn a chat name (which comes from model output) into a safe storage key
+def sanitize_key(name):
+    name = str(name)
+    normalized = unicodedata.normalize("NFKC", name)
+    key = re.sub(r"[^A-Za-z0-9._-]+", "_", normalized).strip("._") or "chat"
+    if key != name or len(key) > MAX_KEY_LENGTH:
+        # Keep distinct names distinct after replacing characters or truncating
+        digest = hashlib.sha256(name.encode()).hexdigest()[:8]
+        key = f"{key[:MAX_KEY_LENGTH - 9]}-{digest}"
+    return key
+
+class ContextStore:
+    def __init__(self, path=CONTEXT_DB_PATH, compact_after=COMPACT_AFTER_DELTAS, hot_set_size=HOT_SET_SIZE):
+        self.path = path
+        self.compact_after = compact_after
+        self.hot_set_size = hot_set_size
+        self.hot_set = OrderedDict()  # key -> (segments, version) as last read or written
+        self.hot_lock = threading.Lock()
+        self.pending = OrderedDict()  # key -> queued operations
+        self.pending_lock = threading.Condition()
+        self.writing = {}  # operations of the batch being written, until its transaction commits
+        self.committing = False
+        self.commits = 0
+        self.local = threading.local()
+        self.stats = {"writes_queued": 0, "writes_coalesced": 0, "delta_writes": 0, "snapshot_writes": 0, "compactions": 0, "conflicts": 0, "hot_hits": 0, "hot_misses": 0, "hot_stale": 0}
+
+        connection = self.connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS context_snapshots (key TEXT PRIMARY KEY, segments TEXT NOT NULL, updated_at REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS context_deltas (id INTEGER PRIMARY KEY AUTOINCREMENT, key TEXT NOT NULL, segment TEXT NOT NULL)")
+        connection.execute("CREATE INDEX IF NOT EXISTS context_deltas_key ON context_deltas (key, id)")
+        # Bumped by every write of a key, by any process; keys written before this table existed are version 0
+        connection.execute("CREATE TABLE IF NOT EXISTS context_versions (key TEXT PRIMARY KEY, version INTEGER NOT NULL)")
+        connection.commit()
+
+        self.writer = threading.Thread(target=self._write_loop, name="kronos-context-writer", daemon=True)
+        self.writer.start()
+        atexit.register(self.flush)
+
+    def connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    # Function to queue a whole context for writing, replacing what is stored; returns immediately
+    def save(self, key, segments):
+        self._queue(key, ("replace", copy_segments(segments), None))
+
+    # Function to queue new segments to add after whatever the key holds when the write happens;
+    # `initial` is written first if the key has never been saved (e.g. a context seeded from a history)
+    def append(self, key, segments, initial=None):
+        self._queue(key, ("append", copy_segments(segments), copy_segments(initial or [])))
+
+    # Function to queue a compaction: `segments` replace the `base` segments they were made from, and
+    # anything appended after `base` in the meantime is kept. Dropped if the stored context no longer
+    # starts with `base`, i.e. another compaction got there first; written as is if nothing is stored.
+    def replace(self, key, segments, base):
+        self._queue(key, ("replace", copy_segments(segments), copy_segments(base)))
+
+    def _queue(self, key, operation):
+        with self.pending_lock:
+            if key in self.pending:
+                self.stats["writes_coalesced"] += 1
+            self.pending.setdefault(key, []).append(operation)
+            self.stats["writes_queued"] += 1
+            self.pending_lock.notify()
+
+    # Function to read a context's segments, or None if the key has never been saved. Operations this
+    # process has queued but not written yet are applied on top of the stored context.
+    def load(self, key):
+        while True:
+            with self.pending_lock:
+                while self.committing:
+                    self.pending_lock.wait()
+                commits = self.commits
+                operations = self.writing.get(key, []) + self.pending.get(key, [])
+            segments = self._load_stored(key)
+            # A batch that committed during the read may or may not be in it: read again
+            with self.pending_lock:
+                if self.commits == commits and not self.committing:
+                    break
+        if operations:
+            return apply_operations(segments, operations)[0]
+        return segments
+
+    # Function to block until every queued write has reached disk
+    def flush(self, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        with self.pending_lock:
+            while self.pending or self.writing:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.pending_lock.wait(remaining)
+        return True
+
+    # Function to read the stored context, from the hot set when no process has written the key since
+    def _load_stored(self, key):
+        connection = self.connect()
+        version = self._version(connection, key)
+        with self.hot_lock:
+            entry = self.hot_set.get(key)
+            if entry is not None and entry[1] == version:
+                self.hot_set.move_to_end(key)
+                self.stats["hot_hits"] += 1
+                return copy_segments(entry[0])
+            self.stats["hot_stale" if entry is not None else "hot_misses"] += 1
+        # The segments and their version are read in one transaction, so they match
+        with connection:
+            connection.execute("BEGIN")
+            version = self._version(connection, key)
+            segments = self._read(key)
+        if segments is not None:
+            self._remember(key, segments, version)
+        return segments
+
+    def _remember(self, key, segments, version):
+        with self.hot_lock:
+            self.hot_set[key] = (copy_segments(segments), version)
+            self.hot_set.move_to_end(key)
+            while len(self.hot_set) > self.hot_set_size:
+                self.hot_set.popitem(last=False)
+
+    def _version(self, connection, key):
+        row = connection.execute("SELECT version FROM context_versions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _read(self, key):
+        connection = self.connect()
+        row = connection.execute("SELECT segments FROM context_snapshots WHERE key = ?", (key,)).fetchone()
+        deltas = connection.execute("SELECT segment FROM context_deltas WHERE key = ? ORDER BY id", (key,)).fetchall()
+        if row is None and not deltas:
+            return None
+        segments = json.loads(row[0]) if row else []
+        segments.extend(json.loads(delta[0]) for delta in deltas)
+        return segments
+
+    def _write_loop(self):
+        while True:
+            with self.pending_lock:
+                while not self.pending:
+                    self.pending_lock.wait()
+                self.writing = dict(self.pending)
+                self.pending.clear()
+            written = {}
+            try:
+                with span("context_write"):
+                    written = self._write_batch(list(self.writing.items()))
+            except Exception as e:
+                print(f"Context write failed: {e}")
+            finally:
+                with self.pending_lock:
+                    self.writing = {}
+                    self.committing = False
+                    self.commits += 1
+                    for key, (segments, version) in written.items():
+                        self._remember(key, segments, version)
+                    self.pending_lock.notify_all()
+
+    # Function to write a batch of queued operations in one transaction. BEGIN IMMEDIATE takes the write
+    # lock before anything is read, so the stored contexts the operations apply to are the latest ones,
+    # whichever process wrote them. Returns key -> (segments, version) as written.
+    def _write_batch(self, batch):
+        connection = self.connect()
+        written = {}
+        with connection:
+            connection.execute("BEGIN IMMEDIATE")
+            for key, operations in batch:
+                version = self._version(connection, key)
+                with self.hot_lock:
+                    entry = self.hot_set.get(key)
+                stored = copy_segments(entry[0]) if entry is not None and entry[1] == version else self._read(key)
+                segments, appended, conflicts = apply_operations(stored, operations)
+                self.stats["conflicts"] += conflicts
+                if segments is None:
+                    continue
+                if appended is None:
+                    # New key, or the oldest segments were collapsed: replace the snapshot
+                    self._write_snapshot(connection, key, segments)
+                    self.stats["snapshot_writes"] += 1
+                elif appended:
+                    # Only the new segments are appended
+                    for segment in appended:
+                        connection.execute("INSERT INTO context_deltas (key, segment) VALUES (?, ?)", (key, json.dumps(segment)))
+                    self.stats["delta_writes"] += 1
+                    if self._delta_count(connection, key) >= self.compact_after:
+                        self._write_snapshot(connection, key, segments)
+                        self.stats["compactions"] += 1
+                else:
+                    continue
+                connection.execute("INSERT INTO context_versions (key, version) VALUES (?, ?) ON CONFLICT (key) DO UPDATE SET version = excluded.version", (key, version + 1))
+                written[key] = (segments, version + 1)
+            with self.pending_lock:
+                self.committing = True
+        return written
+
+    def _write_snapshot(self, connection, key, segments):
+        connection.execute("INSERT OR REPLACE INTO context_snapshots (key, segments, updated_at) VALUES (?, ?, ?)", (key, json.dumps(segments), time.time()))
+        connection.execute("DELETE FROM context_deltas WHERE key = ?", (key,))
+
+    def _delta_count(self, connection, key):
+        return connection.execute("SELECT COUNT(*) FROM context_deltas WHERE key = ?", (key,)).fetchone()[0]
+
+    # Function to walk every stored key a page at a time, so large stores aren't read into memory at once
+    def iter_keys(self, page_size=500):
+        connection = self.connect()
+        last_key = ""
+        while True:
+            rows = connection.execute(
+                "SELECT key FROM context_snapshots WHERE key > ? UNION SELECT key FROM context_deltas WHERE key > ? ORDER BY key LIMIT ?",
+                (last_key, last_key, page_size),
+            ).fetchall()
+            for row in rows:
+                yield row[0]
+            if len(rows) < page_size:
+                return
+            last_key = rows[-1][0]
+
+    def keys(self):
+        return list(self.iter_keys())
+
+def copy_segments(segments):
+    return [dict(segment) for segment in segments]
+
+# Function to apply queued operations to a stored context (None if the key was never saved).
+# Returns (segments, appended, conflicts): `appended` lists the segments added after the stored ones,
+# or is None when the whole context has to be rewritten.
+def apply_operations(stored, operations):
+    segments = None if stored is None else copy_segments(stored)
+    appended = []
+    conflicts = 0
+    for kind, operation_segments, extra in operations:
+        if kind == "append":
+            if segments is None:
+                segments, appended = copy_segments(extra), None
+            segments.extend(copy_segments(operation_segments))
+            if appended is not None:
+                appended.extend(copy_segments(operation_segments))
+        elif extra is None or segments is None:
+            segments, appended = copy_segments(operation_segments), None
+        elif segments is not None and segments[:len(extra)] == extra:
+            segments, appended = copy_segments(operation_segments) + segments[len(extra):], None
+        else:
+            conflicts += 1
+    return segments, appended, conflicts
+
+context_store = None
+context_store_lock = threading.Lock()
+
+# Function to get the shared context store, opening it on first use
+def get_context_store():
+    global context_store
+    if context_store is None:
+        with context_store_lock:
+            if context_store is None:
+                context_store = ContextStore()
+    return context_store
@@ -0,0 +1,118 @@
+import os
+import re
+import json
+import time
+import uuid
+import sqlite3
+import threading
+from scripts.api_interaction import load_context, new_context
+from scripts.context_persistence import CONTEXT_DB_PATH
+
+# Server-side conversations keyed by chat ID: an append-only message log per chat, the compacted
+# summary (stored by the context persistence engine) and an index of chat metadata. The index is a
+# table in the context database, so every worker process sees and updates the same entries.
+CHAT_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class ConversationStore:
+    def __init__(self, root=os.path.join("chat_sessions", "conversations"), db_path=CONTEXT_DB_PATH):
+        self.root = root
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        os.makedirs(root, exist_ok=True)
+        connection = self.connect()
+        with connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS conversations (chat_id TEXT PRIMARY KEY, title TEXT NOT NULL, created_at REAL, updated_at REAL, message_count INTEGER NOT NULL)")
+            self._import_json_index(connection)
+
+    def connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            os.makedirs(os.path.dirname(self.db_path) or ".", exist_ok=True)
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = connection
+        return connection
+
+    # Function to import the index.json written by earlier versions; entries already in the table are kept
+    def _import_json_index(self, connection):
+        try:
+            with open(os.path.join(self.root, "index.json"), 'r') as file:
+                index = json.load(file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return
+        connection.executemany(
+            "INSERT OR IGNORE INTO conversations (chat_id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?)",
+            [(chat_id, entry.get("title", "New Chat"), entry.get("created_at"), entry.get("updated_at"), entry.get("message_count", 0)) for chat_id, entry in index.items()],
+        )
+
+    @staticmethod
+    def new_chat_id():
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def is_valid_chat_id(chat_id):
+        return isinstance(chat_id, str) and CHAT_ID_PATTERN.match(chat_id) is not None
+
+    def log_path(self, chat_id):
+        return os.path.join(self.root, f"{chat_id}.jsonl")
+
+    def get(self, chat_id):
+        row = self.connect().execute("SELECT title, created_at, updated_at, message_count FROM conversations WHERE chat_id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return None
+        return {"title": row[0], "created_at": row[1], "updated_at": row[2], "message_count": row[3]}
+
+    # Function to list every chat ID in the index
+    def chat_ids(self):
+        return [row[0] for row in self.connect().execute("SELECT chat_id FROM conversations ORDER BY chat_id")]
+
+    # Function to append messages to the chat's log and count them in the index, naming a new chat "title"
+    def append(self, chat_id, messages, title="New Chat"):
+        lines = "".join(json.dumps({"speaker": speaker, "content": content, "ts": time.time()}) + "\n" for speaker, content in messages)
+        with self.lock:
+            # One write per call, so the lines of an exchange stay together when workers append to the same log
+            with open(self.log_path(chat_id), 'a') as file:
+                file.write(lines)
+        now = time.time()
+        connection = self.connect()
+        with connection:
+            connection.execute(
+                "INSERT INTO conversations (chat_id, title, created_at, updated_at, message_count) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (chat_id) DO UPDATE SET title = excluded.title, updated_at = excluded.updated_at, message_count = message_count + excluded.message_count",
+                (chat_id, title, now, now, len(messages)),
+            )
+
+    # Function to record a user message and the assistant's reply, naming the chat on its first exchange
+    def record_exchange(self, chat_id, chat_name, user_input, response):
+        self.append(chat_id, [("You", user_input), ("Assistant", response)], title=chat_name)
+
+    # Function to read back a chat's messages from its log
+    def messages(self, chat_id):
+        try:
+            with open(self.log_path(chat_id), 'r') as file:
+                return [json.loads(line) for line in file if line.strip()]
+        except FileNotFoundError:
+            return []
+
+    # Function to resolve the conversation for a /send_message payload
+    # Returns (chat_id, summarized_context, context_key); legacy payloads without a chat_id key
+    # keep the old behaviour and get (None, chat_history, None).
+    def resolve(self, data):
+        if 'chat_id' not in data:
+            return None, data.get('chat_history', []), None
+        chat_id = data.get('chat_id')
+        if chat_id is None:
+            chat_id = self.new_chat_id()
+        elif not self.is_valid_chat_id(chat_id):
+            raise ValueError("Invalid chat_id")
+
+        context_key = chat_id
+        context = load_context(context_key)
+        if not context and data.get('chat_history'):
+            # A chat started before the store existed: seed its context from the uploaded history once
+            context = new_context(data['chat_history'])
+        return chat_id, context, context_key
+
+conversation_store = ConversationStore()
@@ -1,73 +1,221 @@
 import tkinter as tk
-import json
 import os
 from tkinter import messagebox
-from scripts.api_interaction import chat_with_gpt
+from scripts.api_interaction import stream_chat_with_gpt, name_chat, request_executor
+from scripts.chat_worker import chat_worker
+from scripts.chat_index import get_chat_index, INDEX_FILE
+
+# Long chats are shown a page at a time: chat_log holds messages [start, stop) of the chat, mirrored in
+# chat_history, and the pages before and after are read from the chat index when they are needed
+PAGE_SIZE = int(os.environ.get("KRONOS_CHAT_PAGE_SIZE", "100"))
+
+class DisplayedChat:
+    def __init__(self):
+        self.reset()
+
+    def reset(self, title="", chat_index=None, count=0, prompt_positions=None):
+        self.title = title
+        self.chat_index = chat_index
+        self.start = self.stop = self.count = count
+        # Message positions of the user prompts, in the order of history_listbox
+        self.prompt_positions = prompt_positions or []
+
+displayed_chat = DisplayedChat()
+# First matching message per chat from the last search, shown when that chat is opened
+search_hits = {}
 
 # Function to handle sending a message
 def send_message(chat_log, user_entry, history_listbox, chat_history, current_chat, generate_response_and_name_chat, generate_response, chat_sessions_dir, chat_listbox, save_chat, send_button, api_key):
     user_input = user_entry.get()
     if user_input.strip():
+        if displayed_chat.stop < displayed_chat.count:
+            # An older page is displayed: new messages go after the latest one
+            show_messages(chat_log, chat_history, max(0, displayed_chat.count - PAGE_SIZE), displayed_chat.count)
         current_line_index = chat_log.index(tk.END)
+        message_index = chat_log.index("end-1c")
         chat_log.insert(tk.END, "You: ", 'user_bold')
         chat_log.insert(tk.END, user_input + "\n\n\n", 'user')  # Add extra newlines for spacing
         chat_log.insert(tk.END, "Assistant is typing...\n", 'assistant_typing')
         chat_log.see(tk.END)  # Auto-scroll to the end
         user_entry.delete(0, tk.END)
         history_listbox.insert(tk.END, user_input)
-        chat_history.append(("You", user_input, current_line_index))
+        add_to_history(chat_log, chat_history, ("You", user_input, current_line_index), message_index)
         if current_chat.get() == "":
             chat_log.after(100, generate_response_and_name_chat, user_input, current_line_index, chat_log, chat_history, current_chat, chat_listbox, save_chat, chat_sessions_dir, user_entry, send_button, api_key)
         else:
             chat_log.after(100, generate_response, user_input, current_line_index, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat, api_key)
 
-# Function to scroll to a selected user prompt in the chat log
+# Function to scroll to a selected user prompt in the chat log, loading its page if it isn't displayed
 def scroll_to_prompt(event, chat_history, chat_log):
     selection = event.widget.curselection()
     if selection:
         index = selection[0]
-        # Find the line number corresponding to the selected user prompt
-        user_prompts = [entry for entry in chat_history if entry[0] == "You"]
-        if index < len(user_prompts):
-            line_number = user_prompts[index][2]
-            chat_log.see(line_number)
-            chat_log.yview_moveto(float(line_number.split('.')[0]) / float(chat_log.index('end-1c').split('.')[0]))
-
-# Function to save chat history to a file
+        if index < len(displayed_chat.prompt_positions):
+            show_message(chat_log, chat_history, displayed_chat.prompt_positions[index])
+
+# Function to save chat history to a file; only messages the file doesn't have yet are written
 def save_chat(chat_sessions_dir, current_chat, chat_history):
     chat_title = current_chat.get()
-    file_path = os.path.join(chat_sessions_dir, chat_title + ".json")
-    with open(file_path, 'w') as file:
-        json.dump({"title": chat_title, "history": chat_history}, file)
+    chat_index = get_chat_index(chat_sessions_dir)
+    if displayed_chat.title != chat_title:
+        # A new chat that just got its name
+        displayed_chat.title = chat_title
+        displayed_chat.chat_index = chat_index
+    try:
+        chat_index.save(chat_title, chat_history, displayed_chat.start)
+    except ValueError as e:
+        print(f"Error saving chat: {e}")
 
-# Function to load chat history from a file
+# Function to load a chat from the chat index, showing its latest page (or the last search hit in it)
 def load_chat(event, chat_sessions_dir, chat_listbox, chat_log, chat_history, history_listbox, current_chat):
     selection = event.widget.curselection()
     if selection:
         index = selection[0]
         chat_title = chat_listbox.get(index)
-        file_path = os.path.join(chat_sessions_dir, chat_title + ".json")
-        with open(file_path, 'r') as file:
-            chat_data = json.load(file)
-            chat_log.delete("1.0", tk.END)
-            chat_history.clear()
-            history_listbox.delete(0, tk.END)
-            for entry in chat_data["history"]:
-                speaker, content, line_index = entry
-                if speaker == "You":
-                    chat_log.insert(tk.END, "You: ", 'user_bold')
-                    chat_log.insert(tk.END, content + "\n\n\n", 'user')  # Add extra newlines for spacing
-                    history_listbox.insert(tk.END, content)
-                else:
-                    chat_log.insert(tk.END, "Assistant: " + content + "\n\n\n", 'assistant')  # Add extra newlines for spacing
-                chat_history.append((speaker, content, line_index))
-            current_chat.set(chat_title)
+        chat_index = get_chat_index(chat_sessions_dir)
+        chat = chat_index.get(chat_title)
+        if chat is None:
+            print(f"Chat '{chat_title}' could not be found")
+            return
+        chat_worker.next_view()
+        prompts = chat_index.prompts(chat_title)
+        history_listbox.delete(0, tk.END)
+        history_listbox.insert(tk.END, *[preview for _, preview in prompts])
+        displayed_chat.reset(chat_title, chat_index, chat["message_count"], [position for position, _ in prompts])
+        clear_log(chat_log, chat_history)
+        position = search_hits.pop(chat_title, None)
+        if position is not None and position < chat["message_count"]:
+            show_message(chat_log, chat_history, position)
+        else:
+            show_messages(chat_log, chat_history, max(0, chat["message_count"] - PAGE_SIZE), chat["message_count"])
+            chat_log.see(tk.END)
+        current_chat.set(chat_title)
+
+# Function to fill the chat list from the chat index instead of listing the chat sessions directory
+def refresh_chat_list(chat_sessions_dir, chat_listbox):
+    titles = get_chat_index(chat_sessions_dir).refresh()
+    chat_listbox.delete(0, tk.END)
+    chat_listbox.insert(tk.END, *titles)
+
+# Function to search all chats: the chat list is narrowed to chats with a matching message, and opening
+# one of them shows its most recent match. An empty query lists every chat again.
+def search_chats(query, chat_sessions_dir, chat_listbox):
+    search_hits.clear()
+    if not query.strip():
+        refresh_chat_list(chat_sessions_dir, chat_listbox)
+        return []
+    hits = get_chat_index(chat_sessions_dir).search(query)
+    for chat_title, position, _ in hits:
+        search_hits.setdefault(chat_title, position)
+    chat_listbox.delete(0, tk.END)
+    chat_listbox.insert(tk.END, *search_hits)
+    return hits
+
+# Function to empty the chat log and the loaded history
+def clear_log(chat_log, chat_history):
+    chat_log.delete("1.0", tk.END)
+    for mark in chat_log.mark_names():
+        if str(mark).startswith("msg"):
+            chat_log.mark_unset(mark)
+    chat_history.clear()
+
+# Function to record a message shown in the chat log; its mark keeps track of where it is as pages are added above
+def add_to_history(chat_log, chat_history, record, message_index):
+    position = displayed_chat.stop
+    chat_history.append(record)
+    displayed_chat.stop += 1
+    displayed_chat.count = max(displayed_chat.count, displayed_chat.stop)
+    if record[0] == "You":
+        displayed_chat.prompt_positions.append(position)
+    mark_message(chat_log, position, message_index)
+
+def mark_message(chat_log, position, message_index):
+    mark = f"msg{position}"
+    chat_log.mark_set(mark, message_index)
+    chat_log.mark_gravity(mark, tk.RIGHT)
+
+# Function to insert one saved message at `where` (a mark or "end-1c") and return its history record
+def render_message(chat_log, position, message, where="end-1c"):
+    speaker, content = message[0], message[1]
+    message_index = chat_log.index(where)
+    if speaker == "You":
+        chat_log.insert(where, "You: ", 'user_bold')
+        chat_log.insert(where, content + "\n\n\n", 'user')  # Add extra newlines for spacing
+    else:
+        chat_log.insert(where, "Assistant: " + content + "\n\n\n", 'assistant')  # Add extra newlines for spacing
+    mark_message(chat_log, position, message_index)
+    return (speaker, content, message[2] if len(message) > 2 else message_index)
+
+def render_page(chat_log, start, stop, where="end-1c"):
+    messages = displayed_chat.chat_index.read_messages(displayed_chat.title, start, stop)
+    return [render_message(chat_log, position, message, where) for position, message in enumerate(messages, start)]
+
+# Function to display messages [start, stop) of the current chat in place of what is shown
+def show_messages(chat_log, chat_history, start, stop):
+    clear_log(chat_log, chat_history)
+    chat_history.extend(render_page(chat_log, start, stop))
+    displayed_chat.start, displayed_chat.stop = start, stop
+    add_page_links(chat_log, chat_history)
+
+# Function to show the page before the first displayed message, keeping the view where it was
+def show_earlier_messages(chat_log, chat_history):
+    first = displayed_chat.start
+    if first == 0:
+        return
+    start = max(0, first - PAGE_SIZE)
+    remove_page_link(chat_log, 'load_earlier')
+    chat_log.mark_set("page_insert", "1.0")
+    chat_log.mark_gravity("page_insert", tk.RIGHT)
+    chat_history[0:0] = render_page(chat_log, start, first, "page_insert")
+    chat_log.mark_unset("page_insert")
+    displayed_chat.start = start
+    add_page_links(chat_log, chat_history)
+    if first < displayed_chat.stop:
+        chat_log.yview(f"msg{first}")
+
+# Function to show the page after the last displayed message
+def show_later_messages(chat_log, chat_history):
+    if displayed_chat.stop >= displayed_chat.count:
+        return
+    stop = min(displayed_chat.count, displayed_chat.stop + PAGE_SIZE)
+    remove_page_link(chat_log, 'load_later')
+    chat_history.extend(render_page(chat_log, displayed_chat.stop, stop))
+    displayed_chat.stop = stop
+    add_page_links(chat_log, chat_history)
+
+# Function to bring a message into view, loading the pages it needs
+def show_message(chat_log, chat_history, position):
+    if position < displayed_chat.start and (displayed_chat.start - position <= PAGE_SIZE or chat_worker.in_flight(chat_worker.view)):
+        # Close by, or a reply is streaming into the latest page: extend the displayed pages upwards
+        while position < displayed_chat.start:
+            show_earlier_messages(chat_log, chat_history)
+    elif not displayed_chat.start <= position < displayed_chat.stop:
+        start = max(0, min(position - PAGE_SIZE // 2, displayed_chat.count - PAGE_SIZE))
+        show_messages(chat_log, chat_history, start, min(displayed_chat.count, start + PAGE_SIZE))
+    chat_log.see(f"msg{position}")
+    chat_log.yview(f"msg{position}")
+
+# Function to add clickable "earlier/later messages" lines around the displayed pages
+def add_page_links(chat_log, chat_history):
+    if displayed_chat.start > 0 and not chat_log.tag_ranges('load_earlier'):
+        chat_log.insert("1.0", f"Show {min(PAGE_SIZE, displayed_chat.start)} earlier messages ({displayed_chat.start} more)\n\n", 'load_earlier')
+        chat_log.tag_bind('load_earlier', '<Button-1>', lambda event: show_earlier_messages(chat_log, chat_history))
+    remaining = displayed_chat.count - displayed_chat.stop
+    if remaining > 0 and not chat_log.tag_ranges('load_later'):
+        chat_log.insert(tk.END, f"Show {min(PAGE_SIZE, remaining)} later messages ({remaining} more)\n", 'load_later')
+        chat_log.tag_bind('load_later', '<Button-1>', lambda event: show_later_messages(chat_log, chat_history))
+
+def remove_page_link(chat_log, tag):
+    ranges = chat_log.tag_ranges(tag)
+    if ranges:
+        chat_log.delete(ranges[0], ranges[-1])
 
 # Function to create a new chat
 def new_chat(current_chat, chat_log, chat_history, history_listbox):
+    chat_worker.next_view()
     current_chat.set("")
-    chat_log.delete("1.0", tk.END)
-    chat_history.clear()
+    clear_log(chat_log, chat_history)
+    displayed_chat.reset()
     history_listbox.delete(0, tk.END)
 
 # Function to clear all chats
@@ -75,8 +223,11 @@ def clear_chats(chat_sessions_dir, chat_listbox, new_chat):
     if messagebox.askokcancel("Clear All Chats", "Are you sure you want to delete all chats?"):
         for file_name in os.listdir(chat_sessions_dir):
             file_path = os.path.join(chat_sessions_dir, file_name)
-            if os.path.isfile(file_path):
+            if os.path.isfile(file_path) and not file_name.startswith(INDEX_FILE):
                 os.remove(file_path)
+        get_chat_index(chat_sessions_dir).clear()
+        search_hits.clear()
+        chat_worker.cancel(False, discard=True)
         chat_listbox.delete(0, tk.END)
         new_chat()
 
@@ -87,52 +238,143 @@ def delete_selected_chat(chat_listbox, chat_sessions_dir, current_chat, chat_log
         index = selection[0]
         chat_title = chat_listbox.get(index)
         if messagebox.askokcancel("Delete Chat", f"Are you sure you want to delete the chat '{chat_title}'?"):
+            # Stop replies still streaming into this chat, even from the background, so none is saved after the delete
+            chat_worker.cancel_chat(chat_title)
+
             # Remove chat file
             file_path = os.path.join(chat_sessions_dir, chat_title + ".json")
             if os.path.exists(file_path):
                 os.remove(file_path)
+            get_chat_index(chat_sessions_dir).remove(chat_title)
 
             # Remove chat from listbox
             chat_listbox.delete(index)
 
             # Clear current chat if it was the one being deleted
             if current_chat.get() == chat_title:
+                chat_worker.next_view()
                 current_chat.set("")
-                chat_log.delete("1.0", tk.END)
-                chat_history.clear()
+                clear_log(chat_log, chat_history)
+                displayed_chat.reset()
                 history_listbox.delete(0, tk.END)
 
-# Function to generate response from GPT and name the chat
+# Function to generate the response and name a new chat; both run on a worker thread
 def generate_response_and_name_chat(user_input, current_line_index, chat_log, chat_history, current_chat, chat_listbox, save_chat, chat_sessions_dir, user_entry, send_button, api_key):
-    nameChatQuestion = f"What would be an appropriate name for the chat with this starting response: {user_input}. Please just respond with the name."
-    chatNameResp = generate_response(nameChatQuestion, current_line_index, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat, api_key, name_chat=False, hidden=True)
-
-    response = generate_response(user_input, current_line_index, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat, api_key, name_chat=True)
-    # Determine chat name based on the prompt
-    chat_name = chatNameResp.replace('"', '')
-    current_chat.set(chat_name)
-    chat_listbox.insert(tk.END, chat_name)
-    save_chat(chat_sessions_dir, current_chat, chat_history)
-
-# Function to generate response from GPT
-def generate_response(user_input, current_line_index, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat, api_key, name_chat=False, hidden=False):
+    return generate_response(user_input, current_line_index, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat, api_key, name_chat=True, chat_listbox=chat_listbox)
+
+# Function to generate a response from GPT without blocking the window: the reply is streamed into
+# chat_log as it arrives, and the chat is saved when it finishes, even if another chat is open by then
+def generate_response(user_input, current_line_index, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat, api_key, name_chat=False, hidden=False, chat_listbox=None):
     user_entry.config(state=tk.DISABLED)
     send_button.config(state=tk.DISABLED)
-    response = chat_with_gpt(user_input, chat_history, api_key)
+    context = list(chat_history)
+    chat_title = current_chat.get()
+    user_record = ("You", user_input, current_line_index)
+    state = {"parts": [], "chat_name": chat_title, "mark": None}
+
+    def run(cancelled):
+        return stream_reply(user_input, context, api_key, cancelled, name_chat)
+
+    def on_event(job, kind, value):
+        visible = chat_worker.is_visible(job)
+        if kind == "name":
+            state["chat_name"] = job.title = value
+            if chat_listbox is not None:
+                chat_listbox.insert(tk.END, value)
+            if visible:
+                current_chat.set(value)
+        elif kind == "delta":
+            state["parts"].append(value)
+            if visible and not hidden:
+                if state["mark"] is None:
+                    state["mark"] = start_reply(chat_log, current_line_index, job)
+                chat_log.insert(state["mark"], value, 'assistant')
+                chat_log.see(tk.END)
+        elif kind == "error":
+            state["parts"].append(f"[Error: {value}]")
+        elif kind == "done":
+            finish_reply(job, state, value, visible, hidden, user_record, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat)
+
+    job = chat_worker.submit(chat_log, run, on_event)
+    job.title = chat_title or None
+    # If another chat is opened while this one is still answering, the input is free for that chat
+    job.on_hide = lambda: (user_entry.config(state=tk.NORMAL), send_button.config(state=tk.NORMAL))
+    return job
+
+# Worker-thread side of a reply: yields ("name", title) for new chats and ("delta", text) as the reply streams in
+def stream_reply(user_input, context, api_key, cancelled, with_name):
+    name_future = request_executor.submit(name_chat, user_input, context, api_key) if with_name else None
+    deltas = stream_chat_with_gpt(user_input, context, api_key)
+    try:
+        for delta in deltas:
+            if cancelled.is_set():
+                return
+            if name_future is not None and name_future.done():
+                yield "name", name_future.result()
+                name_future = None
+            yield "delta", delta
+    finally:
+        # Closing the generator drops the upstream stream when the job is cancelled
+        deltas.close()
+    if name_future is not None and not cancelled.is_set():
+        yield "name", name_future.result()
+
+# Function to replace the typing indicator with the reply header; returns the mark deltas are inserted at
+def start_reply(chat_log, current_line_index, job):
     typing_message_index = chat_log.search("Assistant is typing...", current_line_index)
     if typing_message_index:
         chat_log.delete(typing_message_index, typing_message_index + " + 1 line")
-    
-    if not hidden:
-        response_line_index = chat_log.index(tk.END)
-        chat_log.insert(tk.END, "Assistant: " + response + "\n\n\n", 'assistant')  # Add extra newlines for spacing
-        chat_log.see(tk.END)  # Auto-scroll to the end
-        chat_history.append(("Assistant", response, response_line_index))
-        if not name_chat:
+        chat_log.insert(typing_message_index, "Assistant: ", 'assistant')
+        position = f"{typing_message_index} + {len('Assistant: ')} chars"
+    else:
+        chat_log.insert(tk.END, "Assistant: ", 'assistant')
+        position = "end-1c"
+    mark = f"reply{job.id}"
+    chat_log.mark_set(mark, position)
+    chat_log.mark_gravity(mark, tk.RIGHT)
+    return mark
+
+# Function to finish a reply on the Tk thread: close it off in the log and record it in the chat's history
+def finish_reply(job, state, cancelled, visible, hidden, user_record, chat_log, chat_history, user_entry, send_button, save_chat, chat_sessions_dir, current_chat):
+    if job.discarded:
+        # The chat was deleted while the reply was streaming
+        return
+    suffix = " [stopped]" if cancelled else ""
+    response = "".join(state["parts"]) + suffix
+    if visible:
+        if state["mark"] is None and not hidden:
+            state["mark"] = start_reply(chat_log, user_record[2], job)
+        if state["mark"] is not None:
+            response_line_index = chat_log.index(f"{state['mark']} linestart")
+            chat_log.insert(state["mark"], suffix + "\n\n\n", 'assistant')  # Add extra newlines for spacing
+            chat_log.mark_unset(state["mark"])
+            chat_log.see(tk.END)
+        else:
+            response_line_index = chat_log.index(tk.END)
+        if not hidden:
+            add_to_history(chat_log, chat_history, ("Assistant", response, response_line_index), response_line_index)
+        if current_chat.get():
             save_chat(chat_sessions_dir, current_chat, chat_history)
-    
-    user_entry.config(state=tk.NORMAL)
-    send_button.config(state=tk.NORMAL)
-    user_entry.focus()
-    
-    return response
+        user_entry.config(state=tk.NORMAL)
+        send_button.config(state=tk.NORMAL)
+        user_entry.focus()
+    elif state["chat_name"] and not hidden:
+        # The user moved to another chat meanwhile: add the exchange to this chat's saved file
+        append_to_saved_chat(chat_sessions_dir, state["chat_name"], user_record, ("Assistant", response, None))
+
+# Function to append an exchange to a chat file that isn't open in the window
+def append_to_saved_chat(chat_sessions_dir, chat_title, user_record, assistant_record):
+    chat_index = get_chat_index(chat_sessions_dir)
+    chat = chat_index.get(chat_title)
+    count = chat["message_count"] if chat is not None else 0
+    last = chat_index.read_messages(chat_title, count - 1, count) if count else []
+    records = [list(user_record), list(assistant_record)]
+    if last == records[:1]:
+        records = records[1:]
+    chat_index.append(chat_title, records)
+
+# Function to stop the replies still streaming into the displayed chat
+def stop_generation(user_entry, send_button):
+    if chat_worker.cancel():
+        user_entry.config(state=tk.NORMAL)
+        send_button.config(state=tk.NORMAL)
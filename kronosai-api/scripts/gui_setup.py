@@ -1,7 +1,7 @@
 import tkinter as tk
 from tkinter import scrolledtext, Listbox, Scrollbar
 
-def setup_gui(root, send_message_callback, new_chat_callback, clear_chats_callback, load_chat_callback, scroll_to_prompt_callback, create_chat_from_link_callback, delete_selected_chat_callback):
+def setup_gui(root, send_message_callback, new_chat_callback, clear_chats_callback, load_chat_callback, scroll_to_prompt_callback, create_chat_from_link_callback, delete_selected_chat_callback, stop_generation_callback=None, search_chats_callback=None):
     # Apply dark theme colors
     bg_color = "#2E2E2E"
     fg_color = "#FFFFFF"
@@ -22,6 +22,12 @@ def setup_gui(root, send_message_callback, new_chat_callback, clear_chats_callba
     chat_list_label = tk.Label(chat_list_frame, text="Chats", bg=bg_color, fg=fg_color, font=("Fira Sans", 12))
     chat_list_label.pack()
 
+    # Create an entry box to search all chats, narrowing the chat list as the user types
+    if search_chats_callback is not None:
+        search_entry = tk.Entry(chat_list_frame, bg=bg_color, fg=fg_color, insertbackground=fg_color, font=("Fira Sans", 12))
+        search_entry.pack(fill=tk.X, pady=5)
+        search_entry.bind("<KeyRelease>", lambda event: search_chats_callback(search_entry.get()))
+
     # Create a listbox for chat sessions with a scrollbar
     chat_list_scrollbar = Scrollbar(chat_list_frame, orient='vertical')
     chat_listbox = Listbox(chat_list_frame, selectmode=tk.SINGLE, yscrollcommand=chat_list_scrollbar.set, bg=bg_color, fg=fg_color, selectbackground="#444444", font=("Fira Sans", 12))
@@ -44,6 +50,10 @@ def setup_gui(root, send_message_callback, new_chat_callback, clear_chats_callba
     chat_log.tag_config('assistant', font=('Fira Sans', 12), foreground=assistant_color)
     chat_log.tag_config('assistant_typing', font=('Fira Sans', 12), foreground=assistant_color, background=bg_color)
 
+    # Links that load the earlier or later pages of a long chat
+    chat_log.tag_config('load_earlier', font=('Fira Sans', 12, 'underline'), foreground="#AAAAAA")
+    chat_log.tag_config('load_later', font=('Fira Sans', 12, 'underline'), foreground="#AAAAAA")
+
     # Frame for history listbox and label
     history_frame = tk.Frame(chat_frame, bg=bg_color)
     history_frame.pack(side=tk.RIGHT, fill=tk.Y)
@@ -73,6 +83,12 @@ def setup_gui(root, send_message_callback, new_chat_callback, clear_chats_callba
     send_button = tk.Button(input_frame, text="Send", command=send_message_callback, bg=bg_color, fg=fg_color, font=("Fira Sans", 12))
     send_button.pack(pady=5, padx=5, side=tk.LEFT)
 
+    # Create a button to stop the reply that is still streaming in (Escape does the same)
+    if stop_generation_callback is not None:
+        stop_button = tk.Button(input_frame, text="Stop", command=stop_generation_callback, bg=bg_color, fg=fg_color, font=("Fira Sans", 12))
+        stop_button.pack(pady=5, padx=5, side=tk.LEFT)
+        root.bind("<Escape>", lambda event: stop_generation_callback())
+
     # Create an entry box for shared link input
     shared_link_entry = tk.Entry(input_frame, width=50, bg=bg_color, fg=fg_color, insertbackground=fg_color, font=("Fira Sans", 12))
     shared_link_entry.pack(padx=10, pady=5, side=tk.LEFT, fill=tk.X, expand=True)
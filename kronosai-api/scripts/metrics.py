@@ -0,0 +1,169 @@
+import os
+import time
+import bisect
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Request-level latency instrumentation: span timers around each stage, upstream call counters,
+# and a Prometheus text exporter for /metrics. Metrics are per process; with several gunicorn
+# workers each scrape sees the worker that answered it.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Send a Server-Timing header on every response, or only when the client asks with X-Kronos-Timing: 1
+TIMING_HEADER = os.environ.get("KRONOS_TIMING_HEADER") == "1"
+
+# Spans recorded for the request being handled (None outside a request)
+request_timings = contextvars.ContextVar("request_timings", default=None)
+
+registry = []
+collectors = []
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (f'{key}="{_escape(value)}"' for key, value in labels)
+    return "{" + ",".join(escaped) + "}"
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.values = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, key, value) for key, value in self.values.items()]
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(buckets)
+        self.series = {}
+        self.lock = threading.Lock()
+        registry.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            index = bisect.bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                series["counts"][index] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            for key, series in self.series.items():
+                cumulative = 0
+                for bound, count in zip(self.buckets, series["counts"]):
+                    cumulative += count
+                    samples.append((f"{self.name}_bucket", key + (("le", repr(bound)),), cumulative))
+                samples.append((f"{self.name}_bucket", key + (("le", "+Inf"),), series["count"]))
+                samples.append((f"{self.name}_sum", key, series["sum"]))
+                samples.append((f"{self.name}_count", key, series["count"]))
+        return samples
+
+STAGE_SECONDS = Histogram("kronos_stage_seconds", "Time spent in each stage of handling a message.")
+UPSTREAM_SECONDS = Histogram("kronos_upstream_request_seconds", "Latency of OpenAI calls by call site and outcome.")
+UPSTREAM_REQUESTS = Counter("kronos_upstream_requests_total", "OpenAI calls by call site and outcome.")
+UPSTREAM_RETRIES = Counter("kronos_upstream_retries_total", "OpenAI calls retried after a rate limit, by call site.")
+UPSTREAM_TOKENS = Counter("kronos_upstream_tokens_total", "Tokens reported by OpenAI responses, by call site and kind.")
+PROMPT_TOKENS = Histogram("kronos_prompt_tokens", "Prompt tokens of each OpenAI call, counted before sending, by call site and model.",
+                          buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768, 131072))
+PROMPTS_TRIMMED = Counter("kronos_prompts_trimmed_total", "OpenAI calls whose context was trimmed to fit the model, by call site.")
+PROMPTS_REJECTED = Counter("kronos_prompts_rejected_total", "Calls refused before sending because the prompt can't fit the model, by call site.")
+HTTP_SECONDS = Histogram("kronos_http_request_seconds", "Latency of API requests by route and status.")
+
+# Function to register a callable returning gauge samples [(name, help, [(labels dict, value)])] at scrape time
+def register_collector(collector):
+    collectors.append(collector)
+
+# Span timer: records the stage histogram and adds the span to the current request's timings
+@contextmanager
+def span(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        STAGE_SECONDS.observe(duration, stage=name)
+        timings = request_timings.get()
+        if timings is not None:
+            timings.append((name, duration))
+
+# Function to record one OpenAI call: latency, outcome, retries and token usage
+def observe_upstream(call_site, started, outcome, retries=0, usage=None):
+    duration = time.perf_counter() - started
+    call_site = call_site or "uncached"
+    UPSTREAM_SECONDS.observe(duration, call_site=call_site, outcome=outcome)
+    UPSTREAM_REQUESTS.inc(call_site=call_site, outcome=outcome)
+    if retries:
+        UPSTREAM_RETRIES.inc(retries, call_site=call_site)
+    if usage is not None:
+        UPSTREAM_TOKENS.inc(usage.prompt_tokens or 0, call_site=call_site, kind="prompt")
+        UPSTREAM_TOKENS.inc(usage.completion_tokens or 0, call_site=call_site, kind="completion")
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((f"upstream-{call_site}", duration))
+
+# Function to record the size of a prompt about to be sent, and whether it had to be trimmed
+def observe_prompt(call_site, built_prompt):
+    call_site = call_site or "uncached"
+    PROMPT_TOKENS.observe(built_prompt.prompt_tokens, call_site=call_site, model=built_prompt.model)
+    if built_prompt.trimmed_tokens:
+        PROMPTS_TRIMMED.inc(call_site=call_site)
+
+# Function to start collecting spans for a request
+def start_request_timing():
+    timings = []
+    request_timings.set(timings)
+    return timings
+
+# Function to format collected spans as a Server-Timing header value, summing repeated stages
+def server_timing_header(timings):
+    totals = {}
+    for name, duration in list(timings):
+        totals[name] = totals.get(name, 0.0) + duration
+    return ", ".join(f"{name};dur={duration * 1000:.1f}" for name, duration in totals.items())
+
+# Function to render every metric in the Prometheus text exposition format
+def render_metrics():
+    lines = []
+    for metric in registry:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for name, labels, value in metric.samples():
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    for collector in collectors:
+        try:
+            gauges = collector()
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+            continue
+        for name, help_text, samples in gauges:
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} gauge")
+            for labels, value in samples:
+                lines.append(f"{name}{_format_labels(tuple(sorted(labels.items())))} {value}")
+    return "\n".join(lines) + "\n"
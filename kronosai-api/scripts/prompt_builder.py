@@ -0,0 +1,139 @@
+import os
+from scripts.tokenizer import DEFAULT_ENCODING, count_tokens, count_message_tokens, truncate_tokens
+
+# Token-budgeted prompt assembly. Every request is counted as the messages actually sent, with the
+# tokenizer of the model it goes to, and must leave room for the completion within that model's
+# context window; an oversized summarized context is trimmed (oldest lines first) before sending,
+# and a request that still can't fit is refused locally instead of failing upstream.
+
+# Context window, largest completion and tokenizer of each model; dated snapshots use their family's entry
+MODEL_CAPABILITIES = {
+    "gpt-4": {"context_window": 8192, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-4-32k": {"context_window": 32768, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-4-turbo": {"context_window": 128000, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+    "gpt-4o": {"context_window": 128000, "max_output_tokens": 16384, "encoding": "o200k_base"},
+    "gpt-4o-mini": {"context_window": 128000, "max_output_tokens": 16384, "encoding": "o200k_base"},
+    "gpt-3.5-turbo": {"context_window": 16385, "max_output_tokens": 4096, "encoding": "cl100k_base"},
+}
+DEFAULT_CAPABILITIES = {"context_window": 4096, "max_output_tokens": 1024, "encoding": DEFAULT_ENCODING}
+
+# Model used for each kind of call; naming and summarizing go to a cheaper, faster model by default
+ANSWER_MODEL = os.environ.get("KRONOS_MODEL", "gpt-4")
+NAMING_MODEL = os.environ.get("KRONOS_NAMING_MODEL", "gpt-4o-mini")
+SUMMARY_MODEL = os.environ.get("KRONOS_SUMMARY_MODEL", "gpt-4o-mini")
+
+# Completion room reserved for each kind of call (naming and summaries also send it as max_tokens)
+RESPONSE_TOKENS = int(os.environ.get("KRONOS_RESPONSE_TOKENS", "1024"))
+NAMING_MAX_TOKENS = 30
+SUMMARY_MAX_TOKENS = 100
+
+# Share of the answer model's prompt budget the summarized context may fill before it is compacted
+CONTEXT_SHARE = float(os.environ.get("KRONOS_CONTEXT_SHARE", "0.5"))
+
+# Tokens kept free for differences between the count of a trimmed text and of the same text in a message
+TRIM_MARGIN = 8
+
+PROMPT_TOO_LARGE = "Your message is too long for me to answer. Please shorten it and try again."
+
+class PromptTooLarge(ValueError):
+    def __init__(self, model, prompt_tokens, budget):
+        super().__init__(f"Prompt of {prompt_tokens} tokens doesn't fit the {budget}-token budget of {model}")
+        self.model = model
+        self.prompt_tokens = prompt_tokens
+        self.budget = budget
+
+class BuiltPrompt:
+    def __init__(self, model, messages, prompt_tokens, completion_tokens, trimmed_tokens=0):
+        self.model = model
+        self.messages = messages
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+        self.trimmed_tokens = trimmed_tokens
+
+    # Tokens the request can use in total, for the scheduler's tokens/min budget
+    @property
+    def estimated_tokens(self):
+        return self.prompt_tokens + self.completion_tokens
+
+# Function to look up a model's capabilities: exact name, then the longest family prefix
+def model_capabilities(model):
+    capabilities = MODEL_CAPABILITIES.get(model)
+    if capabilities is None:
+        families = [name for name in MODEL_CAPABILITIES if model.startswith(name + "-")]
+        capabilities = MODEL_CAPABILITIES[max(families, key=len)] if families else DEFAULT_CAPABILITIES
+    return capabilities
+
+# Function to get the prompt budget of a model once `reserve_tokens` are set aside for the completion
+def prompt_budget(model, reserve_tokens):
+    capabilities = model_capabilities(model)
+    completion_tokens = min(reserve_tokens, capabilities["max_output_tokens"])
+    return capabilities["context_window"] - completion_tokens, completion_tokens
+
+# Function to get the size the summarized context is compacted at, from the answer model's window
+def context_token_limit(model=None):
+    budget, _ = prompt_budget(model or ANSWER_MODEL, RESPONSE_TOKENS)
+    return int(budget * CONTEXT_SHARE)
+
+# Function to build the messages for a summarization request
+def build_summary_messages(text):
+    return [{"role": "system", "content": f"Please summarize the following user's prompt to the minimal amount of characters necessary, ensuring that the key information is retained for maintaining context in future conversations. Focus on the main points and core details:\n\n{text}"}]
+
+# Function to build the messages for a chat request
+def build_chat_messages(prompt, summarized_context):
+    messages = [{"role": "system", "content": "You are a helpful assistant."}]
+    if summarized_context:
+        messages.append({"role": "system", "content": f"Previous context: {summarized_context}"})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+# Function to cut a summarized context to max_tokens: whole lines are dropped oldest first, and the
+# newest line is cut from its start if it's too long by itself
+def trim_context(text, max_tokens, encoding):
+    lines = text.split("\n")
+    line_tokens = [count_tokens(line, encoding) + 1 for line in lines]
+    total = sum(line_tokens)
+    first = 0
+    while total > max_tokens and first < len(lines) - 1:
+        total -= line_tokens[first]
+        first += 1
+    trimmed = "\n".join(lines[first:])
+    if count_tokens(trimmed, encoding) > max_tokens:
+        trimmed = truncate_tokens(trimmed, max_tokens, encoding, keep="end")
+    return trimmed
+
+# Function to assemble a chat request that fits `model`, trimming the context if needed
+def build_chat_prompt(prompt, summarized_context, model, reserve_tokens=RESPONSE_TOKENS):
+    encoding = model_capabilities(model)["encoding"]
+    budget, completion_tokens = prompt_budget(model, reserve_tokens)
+    messages = build_chat_messages(prompt, summarized_context)
+    prompt_tokens = count_message_tokens(messages, encoding)
+    trimmed_tokens = 0
+    if prompt_tokens > budget and summarized_context:
+        context = str(summarized_context)
+        context_tokens = count_tokens(context, encoding)
+        room = context_tokens - (prompt_tokens - budget) - TRIM_MARGIN
+        trimmed = trim_context(context, room, encoding) if room > 0 else ""
+        messages = build_chat_messages(prompt, trimmed)
+        trimmed_tokens = prompt_tokens
+        prompt_tokens = count_message_tokens(messages, encoding)
+        trimmed_tokens -= prompt_tokens
+    if prompt_tokens > budget:
+        raise PromptTooLarge(model, prompt_tokens, budget)
+    return BuiltPrompt(model, messages, prompt_tokens, completion_tokens, trimmed_tokens)
+
+# Function to assemble a summarization request that fits `model`, keeping the start of an oversized text
+def build_summary_prompt(text, model, reserve_tokens=SUMMARY_MAX_TOKENS):
+    encoding = model_capabilities(model)["encoding"]
+    budget, completion_tokens = prompt_budget(model, reserve_tokens)
+    messages = build_summary_messages(text)
+    prompt_tokens = count_message_tokens(messages, encoding)
+    trimmed_tokens = 0
+    if prompt_tokens > budget:
+        room = count_tokens(text, encoding) - (prompt_tokens - budget) - TRIM_MARGIN
+        messages = build_summary_messages(truncate_tokens(text, room, encoding, keep="start"))
+        trimmed_tokens = prompt_tokens
+        prompt_tokens = count_message_tokens(messages, encoding)
+        trimmed_tokens -= prompt_tokens
+    if prompt_tokens > budget:
+        raise PromptTooLarge(model, prompt_tokens, budget)
+    return BuiltPrompt(model, messages, prompt_tokens, completion_tokens, trimmed_tokens)
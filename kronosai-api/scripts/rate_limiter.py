@@ -0,0 +1,207 @@
+import os
+import time
+import heapq
+import random
+import asyncio
+import itertools
+import threading
+
+# Central scheduler for every OpenAI call: requests/min and tokens/min token buckets, a cooldown
+# shared by all callers after a 429 (Retry-After when given, jittered backoff otherwise), and a
+# priority queue so user-facing answers go before background summarization.
+#
+# KRONOS_OPENAI_RPM and KRONOS_OPENAI_TPM are the account's limits. The buckets live in each process,
+# so every server worker gets an equal share: the limits are divided by WEB_CONCURRENCY, which Heroku
+# sets and gunicorn.conf.py exports to its workers. Count any other process sending with the same key
+# (e.g. a batch_summarize run) in WEB_CONCURRENCY too, or lower the limits to leave it room.
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_BACKGROUND: "background"}
+
+WORKER_PROCESSES = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+REQUESTS_PER_MINUTE = float(os.environ.get("KRONOS_OPENAI_RPM", "500")) / WORKER_PROCESSES
+TOKENS_PER_MINUTE = float(os.environ.get("KRONOS_OPENAI_TPM", "40000")) / WORKER_PROCESSES
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 60.0
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self.level = per_minute
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    # Seconds until the bucket holds `amount`
+    def wait_time(self, amount):
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+class RequestScheduler:
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.blocked_until = 0.0
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        # Coroutines waiting in acquire_async, by ticket: (event loop, asyncio.Event to wake them)
+        self.async_waiters = {}
+        self.metrics = {
+            "granted": 0,
+            "rate_limited": 0,
+            "peak_queue_depth": 0,
+            "wait_seconds": {name: 0.0 for name in PRIORITY_NAMES.values()},
+            "max_wait_seconds": {name: 0.0 for name in PRIORITY_NAMES.values()},
+            "requests": {name: 0 for name in PRIORITY_NAMES.values()},
+        }
+
+    def _enqueue(self, priority):
+        ticket = (priority, next(self.sequence))
+        heapq.heappush(self.queue, ticket)
+        self.metrics["peak_queue_depth"] = max(self.metrics["peak_queue_depth"], len(self.queue))
+        return ticket
+
+    # Returns 0 when the ticket was granted, otherwise how long to wait before trying again
+    def _try_acquire(self, ticket, tokens):
+        now = time.monotonic()
+        if self.queue[0] != ticket:
+            return None
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        self.requests.refill(now)
+        self.tokens.refill(now)
+        tokens = min(tokens, self.tokens.capacity)
+        delay = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+        if delay > 0:
+            return delay
+        self.requests.level -= 1
+        self.tokens.level -= tokens
+        heapq.heappop(self.queue)
+        return 0.0
+
+    # Function to wake waiters after a grant, a cancellation or a change of limits (call with the condition
+    # held): threads through the condition, and the coroutine at the head of the queue through its loop,
+    # since only the head can be granted
+    def _wake_waiters(self):
+        self.condition.notify_all()
+        if self.queue and self.queue[0] in self.async_waiters:
+            loop, event = self.async_waiters[self.queue[0]]
+            loop.call_soon_threadsafe(event.set)
+
+    def _granted(self, priority, started):
+        waited = time.monotonic() - started
+        name = PRIORITY_NAMES[priority]
+        self.metrics["granted"] += 1
+        self.metrics["requests"][name] += 1
+        self.metrics["wait_seconds"][name] += waited
+        self.metrics["max_wait_seconds"][name] = max(self.metrics["max_wait_seconds"][name], waited)
+        return waited
+
+    # Function to wait (blocking the thread) until a request may be sent
+    def acquire(self, tokens, priority=PRIORITY_INTERACTIVE):
+        started = time.monotonic()
+        with self.condition:
+            ticket = self._enqueue(priority)
+            while True:
+                delay = self._try_acquire(ticket, tokens)
+                if delay == 0:
+                    self._wake_waiters()
+                    return self._granted(priority, started)
+                self.condition.wait(delay)
+
+    # Function to wait (without blocking the event loop) until a request may be sent
+    async def acquire_async(self, tokens, priority=PRIORITY_INTERACTIVE):
+        started = time.monotonic()
+        event = asyncio.Event()
+        with self.condition:
+            ticket = self._enqueue(priority)
+            self.async_waiters[ticket] = (asyncio.get_running_loop(), event)
+        try:
+            while True:
+                with self.condition:
+                    delay = self._try_acquire(ticket, tokens)
+                    if delay == 0:
+                        del self.async_waiters[ticket]
+                        self._wake_waiters()
+                        return self._granted(priority, started)
+                    event.clear()
+                # Behind another ticket (delay None) there is nothing to wait for but a wake-up
+                try:
+                    await asyncio.wait_for(event.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+        except BaseException:
+            with self.condition:
+                self.async_waiters.pop(ticket, None)
+                if ticket in self.queue:
+                    self.queue.remove(ticket)
+                    heapq.heapify(self.queue)
+                self._wake_waiters()
+            raise
+
+    # Function to correct the token bucket once the real usage is known
+    def record_usage(self, estimated_tokens, actual_tokens):
+        if actual_tokens is None:
+            return
+        with self.condition:
+            self.tokens.level -= actual_tokens - min(estimated_tokens, self.tokens.capacity)
+            if actual_tokens < estimated_tokens:
+                self._wake_waiters()
+
+    # Function to hold every caller after a 429; returns the cooldown in seconds
+    def report_rate_limit(self, error=None, attempt=1):
+        delay = retry_after_seconds(error)
+        if delay is None:
+            # Full jitter, so callers that were limited together don't retry in lockstep
+            delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+        with self.condition:
+            self.metrics["rate_limited"] += 1
+            self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+            self._wake_waiters()
+        return delay
+
+    def get_metrics(self):
+        with self.condition:
+            now = time.monotonic()
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            metrics = {
+                "queue_depth": len(self.queue),
+                "queue_depth_by_priority": {name: sum(1 for ticket in self.queue if ticket[0] == priority) for priority, name in PRIORITY_NAMES.items()},
+                "cooldown_seconds": max(0.0, self.blocked_until - now),
+                "requests_available": self.requests.level,
+                "tokens_available": self.tokens.level,
+                "granted": self.metrics["granted"],
+                "rate_limited": self.metrics["rate_limited"],
+                "peak_queue_depth": self.metrics["peak_queue_depth"],
+                "requests": dict(self.metrics["requests"]),
+                "max_wait_seconds": dict(self.metrics["max_wait_seconds"]),
+            }
+            metrics["mean_wait_seconds"] = {
+                name: self.metrics["wait_seconds"][name] / count if count else 0.0
+                for name, count in self.metrics["requests"].items()
+            }
+        return metrics
+
+# Function to read the server's Retry-After hint from an OpenAI error, if there is one
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
+
+scheduler = RequestScheduler()
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+from scripts.api_interaction import openai_sdk
+from scripts.conversation_store import conversation_store
+from scripts.batch_summarize import batch_job, job_options
+from scripts.metrics import HTTP_SECONDS, TIMING_HEADER, server_timing_header
+
+# Request parsing and response shaping shared by the two servers, app.py (Flask, threads) and asgi.py
+# (Quart, event loop). Everything here is plain blocking code: app.py calls it directly, asgi.py runs the
+# parts that touch storage with asyncio.to_thread. The routes themselves only read the request, call the
+# sync or async completion functions and send what these functions return.
+
+# Admin routes are disabled unless a token is configured
+ADMIN_TOKEN = os.environ.get('KRONOS_ADMIN_TOKEN')
+
+# Headers for server-sent event responses; X-Accel-Buffering keeps nginx from holding back the deltas
+SSE_HEADERS = {'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+
+class MessageRequest:
+    def __init__(self, user_input, chat_title, chat_id, summarized_context, context_key):
+        self.user_input = user_input
+        self.chat_title = chat_title
+        self.chat_id = chat_id
+        self.summarized_context = summarized_context
+        self.context_key = context_key
+
+# Function to read a /send_message payload and resolve its stored conversation; raises ValueError for a bad request
+def parse_message_request(data):
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        raise ValueError("Request body must be a JSON object")
+    user_input = data.get('user_input', '')
+    if not isinstance(user_input, str):
+        raise ValueError("User input must be a string")
+    user_input = user_input.strip()
+    if not user_input:
+        raise ValueError("User input is required")
+    chat_title = data.get('chat_title', 'New Chat')
+    if not isinstance(chat_title, str):
+        raise ValueError("Chat title must be a string")
+    chat_id, summarized_context, context_key = conversation_store.resolve(data)
+    return MessageRequest(user_input, chat_title, chat_id, summarized_context, context_key)
+
+# Function to record a finished exchange in the chat's server-side log and build the JSON reply
+def message_reply(message, chat_name, response):
+    if message.chat_id is None:
+        return {"response": response, "chat_name": chat_name}
+    conversation_store.record_exchange(message.chat_id, chat_name, message.user_input, response)
+    return {"response": response, "chat_name": chat_name, "chat_id": message.chat_id}
+
+# Function to log an error raised while answering and turn it into the message sent to the client
+def error_message(error, logger, route):
+    if isinstance(error, openai_sdk().RateLimitError):
+        logger.error(f"Rate limit error: {error}")
+        return "Rate limit error occurred"
+    if isinstance(error, openai_sdk().OpenAIError):
+        logger.error(f"OpenAI error: {error}")
+        return "OpenAI error occurred"
+    logger.error(f"Error in {route}: {error}")
+    return str(error)
+
+def sse_event(payload):
+    return f"data: {json.dumps(payload)}\n\n"
+
+class ReplyStream:
+    # Server-sent events for a streamed reply: the chat name (with the chat id) first, then the deltas.
+    # The text is collected so the exchange can be recorded once the stream is done.
+    def __init__(self, message):
+        self.message = message
+        self.chat_name = message.chat_title
+        self.parts = []
+
+    def event(self, event):
+        if 'chat_name' in event:
+            self.chat_name = event['chat_name']
+            if self.message.chat_id is not None:
+                event['chat_id'] = self.message.chat_id
+        else:
+            self.parts.append(event['delta'])
+        return sse_event(event)
+
+    def record(self):
+        if self.message.chat_id is not None:
+            conversation_store.record_exchange(self.message.chat_id, self.chat_name, self.message.user_input, "".join(self.parts))
+
+    def done(self):
+        return sse_event({'done': True})
+
+    def error(self, error, logger):
+        return sse_event({'error': error_message(error, logger, "send_message_stream")})
+
+# Function to look up a chat for GET /chats/<chat_id>; returns (payload, status)
+def chat_reply(chat_id):
+    entry = conversation_store.get(chat_id) if conversation_store.is_valid_chat_id(chat_id) else None
+    if entry is None:
+        return {"error": "Chat not found"}, 404
+    return {"chat_id": chat_id, "title": entry["title"], "history": conversation_store.messages(chat_id)}, 200
+
+def is_admin_request(headers):
+    return bool(ADMIN_TOKEN) and headers.get('X-Kronos-Admin-Token') == ADMIN_TOKEN
+
+# Function to start, stop or report the batch summarization job; returns (payload, status). The batch
+# runs on its own threads with the sync client, so under asgi.py it never competes with the event loop.
+def batch_summarize_reply(method, data, api_key):
+    if method == 'POST':
+        try:
+            started = batch_job.start(api_key, **job_options(data or {}))
+        except (TypeError, ValueError) as e:
+            return {"error": str(e)}, 400
+        if not started:
+            return {"error": "A batch summarization job is already running", "status": batch_job.status()}, 409
+        return batch_job.status(), 202
+    if method == 'DELETE':
+        batch_job.stop()
+    return batch_job.status(), 200
+
+# Function to record a finished request's latency; returns the Server-Timing header to send, if any
+def finish_request_timing(route, status_code, started, timings, headers):
+    elapsed = time.perf_counter() - started
+    HTTP_SECONDS.observe(elapsed, route=route, status=str(status_code))
+    if TIMING_HEADER or headers.get('X-Kronos-Timing') == '1':
+        return server_timing_header(timings + [("total", elapsed)])
+    return None
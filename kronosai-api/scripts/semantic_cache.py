@@ -0,0 +1,187 @@
+import os
+import re
+import time
+import zlib
+import atexit
+import importlib.util
+import sqlite3
+import threading
+
+# Opt-in semantic answer cache: context-free prompts are embedded with a hashed character/word n-gram
+# vectorizer, compared against earlier prompts by cosine similarity, and a close enough match returns
+# the earlier answer instead of a new completion. Vectors live in a memory-mapped float32 matrix (one
+# row per slot) and answers in SQLite next to it; when every slot is used the least recently used
+# entry is replaced. Worker processes share the files: slots are assigned inside a SQLite write
+# transaction, and a candidate is only served after its prompt, as committed with the answer, has been
+# checked against the new one, so a vector row another process is rewriting can cost a hit but never
+# return someone else's answer.
+#
+# The vectorizer can't tell "with" from "without" or 300 from 500, and in a long prompt one such word
+# moves the similarity very little. So besides the similarity threshold, the two prompts may only differ
+# in filler words (articles, "please", "can you"...); any other changed word makes it a different question.
+
+SEMANTIC_CACHE_ENABLED = os.environ.get("KRONOS_SEMANTIC_CACHE") == "1"
+SEMANTIC_CACHE_PATH = os.environ.get("KRONOS_SEMANTIC_CACHE_PATH", os.path.join("chat_sessions", "semantic_cache"))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("KRONOS_SEMANTIC_CACHE_THRESHOLD", "0.95"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("KRONOS_SEMANTIC_CACHE_MAX_ENTRIES", "4096"))
+VECTOR_DIMENSIONS = int(os.environ.get("KRONOS_SEMANTIC_CACHE_DIMENSIONS", "1024"))
+
+# numpy is an optional dependency (requirements-semantic.txt), imported only when the cache opens; check it
+# is installed here, so a server started with the cache enabled fails at startup rather than on a request
+if SEMANTIC_CACHE_ENABLED and importlib.util.find_spec("numpy") is None:
+    raise RuntimeError("KRONOS_SEMANTIC_CACHE=1 but numpy is not installed. Install the semantic cache requirements "
+                       "(pip install -r requirements-semantic.txt) or unset KRONOS_SEMANTIC_CACHE.")
+CHAR_NGRAMS = (3, 4, 5)
+# Candidates above the threshold checked per lookup, most similar first
+MAX_CANDIDATES = 4
+# Words a rewording may add or drop without changing the question; negations and numbers are never filler
+FILLER_WORDS = frozenset({"a", "an", "the", "please", "me", "can", "could", "would", "will", "you", "i", "do", "does", "is", "are", "s", "just", "kindly"})
+
+# Function to normalize a prompt before vectorizing: case, punctuation and spacing don't change the question
+def normalize_prompt(prompt):
+    return re.sub(r"\s+", " ", re.sub(r"[^\w\s]", " ", prompt.lower())).strip()
+
+# Function to list the n-gram features of a prompt: character 3-5 grams, words and word pairs
+def prompt_features(prompt):
+    text = normalize_prompt(prompt)
+    padded = f" {text} "
+    features = [padded[i:i + n] for n in CHAR_NGRAMS for i in range(len(padded) - n + 1)]
+    words = text.split()
+    features.extend(f"w:{word}" for word in words)
+    features.extend(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    return features
+
+# Function to check that two prompts use the same words apart from filler
+def same_question(prompt, other):
+    return not (set(normalize_prompt(prompt).split()) ^ set(normalize_prompt(other).split())) - FILLER_WORDS
+
+class HashedNgramVectorizer:
+    def __init__(self, dimensions=VECTOR_DIMENSIONS):
+        import numpy as np  # Optional dependency, only needed when the semantic cache is enabled
+
+        self.np = np
+        self.dimensions = dimensions
+
+    # Function to embed a prompt as an L2-normalized vector; crc32 keeps the hashing stable across processes
+    def embed(self, prompt):
+        vector = self.np.zeros(self.dimensions, dtype=self.np.float32)
+        for feature in prompt_features(prompt):
+            hashed = zlib.crc32(feature.encode())
+            vector[hashed % self.dimensions] += 1.0 if hashed & 0x80000000 else -1.0
+        norm = self.np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+class SemanticCache:
+    def __init__(self, path=SEMANTIC_CACHE_PATH, max_entries=SEMANTIC_CACHE_MAX_ENTRIES, threshold=SEMANTIC_CACHE_THRESHOLD, dimensions=VECTOR_DIMENSIONS):
+        self.vectorizer = HashedNgramVectorizer(dimensions)
+        np = self.np = self.vectorizer.np
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.dimensions = dimensions
+        self.vectors_path = path + ".f32"
+        self.db_path = path + ".sqlite3"
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {"lookups": 0, "hits": 0, "misses": 0, "stores": 0, "evictions": 0, "lookup_seconds": 0.0, "max_lookup_seconds": 0.0}
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        connection = self.connect()
+        connection.execute("CREATE TABLE IF NOT EXISTS entries (slot INTEGER PRIMARY KEY, model TEXT NOT NULL, prompt TEXT NOT NULL, answer TEXT NOT NULL, used_at REAL)")
+        connection.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY, value TEXT)")
+        shape = f"{max_entries}x{dimensions}"
+        stored_shape = connection.execute("SELECT value FROM settings WHERE name = 'shape'").fetchone()
+        if stored_shape is None or stored_shape[0] != shape or not os.path.exists(self.vectors_path):
+            # First run, or the capacity/dimensions changed: start over
+            connection.execute("DELETE FROM entries")
+            connection.execute("INSERT OR REPLACE INTO settings VALUES ('shape', ?)", (shape,))
+            np.memmap(self.vectors_path, dtype=np.float32, mode="w+", shape=(max_entries, dimensions)).flush()
+        connection.commit()
+        self.vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r+", shape=(max_entries, dimensions))
+        atexit.register(self.flush)
+
+    def connect(self):
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self.local.connection = connection
+        return connection
+
+    # Function to find the answer to the most similar earlier prompt, or None below the threshold
+    def get(self, prompt, model):
+        started = time.perf_counter()
+        vector = self.vectorizer.embed(prompt)
+        answer = None
+        with self.lock:
+            similarities = self.vectors @ vector
+            count = min(MAX_CANDIDATES, len(similarities))
+            candidates = self.np.argpartition(-similarities, count - 1)[:count]
+            candidates = [int(slot) for slot in candidates[self.np.argsort(-similarities[candidates])] if similarities[slot] >= self.threshold]
+            connection = self.connect()
+            for slot in candidates:
+                row = connection.execute("SELECT prompt, answer FROM entries WHERE slot = ? AND model = ?", (slot, model)).fetchone()
+                # The row may hold another prompt than the vector read above if a process was rewriting the slot
+                if row is None or not same_question(prompt, row[0]) or float(self.vectorizer.embed(row[0]) @ vector) < self.threshold:
+                    continue
+                answer = row[1]
+                connection.execute("UPDATE entries SET used_at = ? WHERE slot = ?", (time.time(), slot))
+                connection.commit()
+                break
+            self._record_lookup(answer is not None, time.perf_counter() - started)
+        return answer
+
+    # Function to remember the answer to a prompt in a free slot, or in place of the least recently used entry
+    def set(self, prompt, model, answer):
+        vector = self.vectorizer.embed(prompt)
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                # The write lock keeps other processes from picking the same slot
+                connection.execute("BEGIN IMMEDIATE")
+                slot = self._free_slot(connection)
+                if slot is None:
+                    slot = connection.execute("SELECT slot FROM entries ORDER BY used_at LIMIT 1").fetchone()[0]
+                    self.stats["evictions"] += 1
+                connection.execute("INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)", (slot, model, prompt, answer, time.time()))
+                self.vectors[slot] = vector
+            self.stats["stores"] += 1
+
+    def _free_slot(self, connection):
+        if connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0] >= self.max_entries:
+            return None
+        if connection.execute("SELECT 1 FROM entries WHERE slot = 0").fetchone() is None:
+            return 0
+        return connection.execute("SELECT MIN(slot) + 1 FROM entries WHERE slot + 1 NOT IN (SELECT slot FROM entries)").fetchone()[0]
+
+    def _record_lookup(self, hit, duration):
+        self.stats["lookups"] += 1
+        self.stats["hits" if hit else "misses"] += 1
+        self.stats["lookup_seconds"] += duration
+        self.stats["max_lookup_seconds"] = max(self.stats["max_lookup_seconds"], duration)
+
+    def flush(self):
+        with self.lock:
+            self.vectors.flush()
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = self.connect().execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        lookups = stats["lookups"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        stats["mean_lookup_seconds"] = stats.pop("lookup_seconds") / lookups if lookups else 0.0
+        return stats
+
+semantic_cache = None
+semantic_cache_lock = threading.Lock()
+
+# Function to get the shared semantic cache, opening it on first use; None unless KRONOS_SEMANTIC_CACHE=1
+def get_semantic_cache():
+    global semantic_cache
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    if semantic_cache is None:
+        with semantic_cache_lock:
+            if semantic_cache is None:
+                semantic_cache = SemanticCache()
+    return semantic_cache
@@ -0,0 +1,96 @@
+# Summarized chat context stored as a list of exchange summaries, each with its token count cached,
+# so appending or compacting a segment only encodes that segment instead of the whole context.
+
+# Tokens allowed for the "\n" that joins two segments when the context is rendered
+SEPARATOR_TOKENS = 1
+
+class SummarizedContext:
+    def __init__(self, count_tokens, segments=None):
+        self.count_tokens = count_tokens
+        self.segments = []
+        self.total_tokens = 0
+        for segment in segments or []:
+            tokens = segment.get("tokens")
+            self.segments.append({"text": segment["text"], "tokens": tokens if tokens is not None else count_tokens(segment["text"])})
+        self.total_tokens = self._sum_tokens(self.segments)
+
+    # Function to build a context from a saved dict, a legacy summary string or a chat history list.
+    # Legacy summaries were one line per exchange, so each line becomes its own segment and can be compacted.
+    @classmethod
+    def from_value(cls, value, count_tokens):
+        if isinstance(value, cls):
+            return value
+        if isinstance(value, dict):
+            if "segments" in value:
+                return cls(count_tokens, value["segments"])
+            value = value.get("summarized_context", "")
+        context = cls(count_tokens)
+        if not value:
+            return context
+        if not isinstance(value, str):
+            context.append(f"{value}")
+            return context
+        for line in value.split("\n"):
+            if line.strip():
+                context.append(line)
+        return context
+
+    @staticmethod
+    def _sum_tokens(segments):
+        if not segments:
+            return 0
+        return sum(segment["tokens"] for segment in segments) + SEPARATOR_TOKENS * (len(segments) - 1)
+
+    # Function to add a segment, encoding only the new text
+    def append(self, text):
+        tokens = self.count_tokens(text)
+        if self.segments:
+            self.total_tokens += SEPARATOR_TOKENS
+        self.segments.append({"text": text, "tokens": tokens})
+        self.total_tokens += tokens
+        return tokens
+
+    # Function to pick, in one pass, how many of the oldest segments to collapse to get under target_tokens
+    def plan_compaction(self, target_tokens, summary_tokens=100):
+        excess = self.total_tokens - target_tokens
+        if excess <= 0:
+            return 0
+        freed = 0
+        count = 0
+        # Keep the newest segment intact so the latest exchange is never lost
+        while count < len(self.segments) - 1 and freed - summary_tokens < excess:
+            freed += self.segments[count]["tokens"] + SEPARATOR_TOKENS
+            count += 1
+        return count
+
+    # Function to replace the oldest segments with their summary
+    def collapse_oldest(self, count, summary):
+        if count <= 0:
+            return
+        removed = self.segments[:count]
+        self.total_tokens -= self._sum_tokens(removed) + (SEPARATOR_TOKENS if count < len(self.segments) else 0)
+        del self.segments[:count]
+        tokens = self.count_tokens(summary)
+        self.segments.insert(0, {"text": summary, "tokens": tokens})
+        self.total_tokens += tokens + (SEPARATOR_TOKENS if len(self.segments) > 1 else 0)
+
+    # Function to drop the oldest segments until the context fits, used when compaction can't shrink it enough
+    def drop_oldest_until(self, max_tokens):
+        while self.total_tokens > max_tokens and len(self.segments) > 1:
+            removed = self.segments.pop(0)
+            self.total_tokens -= removed["tokens"] + SEPARATOR_TOKENS
+
+    def oldest_text(self, count):
+        return "\n".join(segment["text"] for segment in self.segments[:count])
+
+    def to_text(self):
+        return "\n".join(segment["text"] for segment in self.segments)
+
+    def to_dict(self):
+        return {"summarized_context": self.to_text(), "segments": self.segments, "total_tokens": self.total_tokens}
+
+    def __len__(self):
+        return len(self.segments)
+
+    def __str__(self):
+        return self.to_text()
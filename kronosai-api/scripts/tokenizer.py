@@ -0,0 +1,118 @@
+import os
+import sys
+import time
+import threading
+from functools import lru_cache
+
+# tiktoken encodings, built on first use instead of at import. tiktoken downloads each BPE file once
+# and keeps it in TIKTOKEN_CACHE_DIR; by default that points at tiktoken_cache/ next to the app, which
+# `python -m scripts.tokenizer` fills at build time (bin/post_compile on Heroku), so workers start offline.
+
+DEFAULT_ENCODING = "cl100k_base"
+# Encodings fetched at build time: cl100k_base for the GPT-4/3.5 family, o200k_base for the GPT-4o family
+PREFETCH_ENCODINGS = (DEFAULT_ENCODING, "o200k_base")
+
+# The same texts (system prompts, a chat's summarized context) are counted on every turn, so counts
+# are memoized; very long texts are counted directly to keep the cache small
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get("KRONOS_TOKEN_COUNT_CACHE_SIZE", "4096"))
+MAX_CACHED_TEXT_LENGTH = 16384
+
+# Tokens the chat format adds around each message, and before the reply (OpenAI's published accounting)
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+# An encoding that couldn't be loaded is tried again after this long, in the background
+ENCODING_RETRY_SECONDS = float(os.environ.get("KRONOS_TOKENIZER_RETRY_SECONDS", "300"))
+BPE_CACHE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tiktoken_cache")
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", BPE_CACHE_DIR)
+
+encodings = {}
+encodings_lock = threading.Lock()
+
+# Rough count used when an encoding can't be loaded (no network and no cached BPE file)
+def approximate_token_count(text):
+    return (len(text) + 3) // 4
+
+class ApproximateEncoding:
+    def __init__(self, name):
+        self.name = name
+        self.retry_at = time.monotonic() + ENCODING_RETRY_SECONDS
+        self.retrying = False
+
+    def encode(self, text):
+        return range(approximate_token_count(text))
+
+    # Function to claim the next load attempt once it is due, so only one thread makes it
+    def claim_retry(self):
+        with encodings_lock:
+            if self.retrying or time.monotonic() < self.retry_at:
+                return False
+            self.retrying = True
+            return True
+
+# Function to get an encoding by name, loading it on first use. While only the estimate is available
+# the real encoding is loaded again from time to time, off the caller's thread, so a network outage at
+# startup doesn't leave the worker estimating for the rest of its life.
+def get_encoding(name=DEFAULT_ENCODING):
+    encoding = encodings.get(name)
+    if encoding is None:
+        with encodings_lock:
+            encoding = encodings.get(name)
+            if encoding is None:
+                encoding = encodings[name] = load_encoding(name)
+    elif isinstance(encoding, ApproximateEncoding) and encoding.claim_retry():
+        threading.Thread(target=reload_encoding, args=(name,), name="kronos-tokenizer", daemon=True).start()
+    return encoding
+
+def reload_encoding(name):
+    encoding = load_encoding(name)
+    with encodings_lock:
+        encodings[name] = encoding
+    if not isinstance(encoding, ApproximateEncoding):
+        # Counts memoized from the estimate would otherwise outlive it
+        _cached_count_tokens.cache_clear()
+        print(f"Loaded the {name} tokenizer; token counts are exact again.")
+
+def load_encoding(name):
+    import tiktoken
+    try:
+        return tiktoken.get_encoding(name)
+    except Exception as e:
+        # Keep serving with estimated counts rather than failing every request
+        print(f"Could not load the {name} tokenizer ({e}); token counts will be estimated and it will be tried again in {ENCODING_RETRY_SECONDS:.0f}s. Run `python -m scripts.tokenizer` to cache it.")
+        return ApproximateEncoding(name)
+
+def count_tokens(text, name=DEFAULT_ENCODING):
+    if len(text) > MAX_CACHED_TEXT_LENGTH:
+        return len(get_encoding(name).encode(text))
+    return _cached_count_tokens(text, name)
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def _cached_count_tokens(text, name):
+    return len(get_encoding(name).encode(text))
+
+# Function to count the prompt tokens of a list of chat messages as the API bills them
+def count_message_tokens(messages, name=DEFAULT_ENCODING):
+    tokens = TOKENS_PER_REPLY
+    for message in messages:
+        tokens += TOKENS_PER_MESSAGE + count_tokens(message["role"], name) + count_tokens(str(message["content"]), name)
+    return tokens
+
+# Function to cut text down to max_tokens, keeping its "start" or its "end"
+def truncate_tokens(text, max_tokens, name=DEFAULT_ENCODING, keep="end"):
+    if max_tokens <= 0:
+        return ""
+    encoding = get_encoding(name)
+    if isinstance(encoding, ApproximateEncoding):
+        max_chars = max_tokens * 4
+        return text[-max_chars:] if keep == "end" else text[:max_chars]
+    tokens = encoding.encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[-max_tokens:] if keep == "end" else tokens[:max_tokens])
+
+if __name__ == "__main__":
+    for name in sys.argv[1:] or PREFETCH_ENCODINGS:
+        encoding = get_encoding(name)
+        if isinstance(encoding, ApproximateEncoding):
+            sys.exit(1)
+        print(f"Cached {name} in {os.environ['TIKTOKEN_CACHE_DIR']}")
@@ -43,6 +43,7 @@ function App() {
   const [chatHistory, setChatHistory] = useState([]);
   const [response, setResponse] = useState('');
   const [chatTitle, setChatTitle] = useState('New Chat');
+  const [chatId, setChatId] = useState(null);
   const [chats, setChats] = useState(initializeChats());
   const [loading, setLoading] = useState(false);
   const [theme, setTheme] = useState(localStorage.getItem('theme') || 'dark');
@@ -86,11 +87,13 @@ function App() {
 
     const savedChatHistory = safeParseJSON(localStorage.getItem('chatHistory'), []);
     const savedChatTitle = localStorage.getItem('chatTitle') || 'New Chat';
+    const savedChatId = localStorage.getItem('chatId');
     const savedLineHeight = parseFloat(localStorage.getItem('lineHeight')) || 1.2;
     const savedFontSize = parseFloat(localStorage.getItem('fontSize')) || 16;
 
     setChatHistory(savedChatHistory);
     setChatTitle(savedChatTitle);
+    setChatId(savedChatId);
     setLineHeight(savedLineHeight);
     setFontSize(savedFontSize);
   }, []);
@@ -131,29 +134,77 @@ function App() {
     setUserInput('');
 
     try {
-      const res = await fetch('https://kronosai-59ad0fce9738.herokuapp.com/send_message', {
+      const res = await fetch('https://kronosai-59ad0fce9738.herokuapp.com/send_message/stream', {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ user_input: escapedUserInput, chat_history: chatHistory, chat_title: chatTitle })
+        // The server keeps the conversation; only chats saved before it did need their history uploaded once
+        body: JSON.stringify({
+          user_input: escapedUserInput,
+          chat_id: chatId,
+          chat_title: chatTitle,
+          ...(chatId === null && chatHistory.length > 0 ? { chat_history: chatHistory } : {})
+        })
       });
 
       if (!res.ok) {
         throw new Error(`Error: ${res.status}`);
       }
 
-      const data = await res.json();
-      setLoading(false);
-      setIsAssistantTyping(false);
-      if (chatTitle === 'New Chat') {
-        setChatTitle(data.chat_name);
-        localStorage.setItem('chatTitle', data.chat_name);
+      // Read server-sent events: the chat name arrives first, then response deltas
+      const reader = res.body.getReader();
+      const decoder = new TextDecoder();
+      let buffer = '';
+      let chatName = chatTitle;
+      let currentChatId = chatId;
+      let assistantContent = '';
+      let started = false;
+
+      const handleEvent = (event) => {
+        if (event.error) {
+          throw new Error(event.error);
+        }
+        if (event.chat_id) {
+          currentChatId = event.chat_id;
+          setChatId(currentChatId);
+          localStorage.setItem('chatId', currentChatId);
+        }
+        if (event.chat_name) {
+          chatName = event.chat_name;
+          if (chatTitle === 'New Chat') {
+            setChatTitle(chatName);
+            localStorage.setItem('chatTitle', chatName);
+          }
+        }
+        if (event.delta) {
+          assistantContent += event.delta;
+          const content = assistantContent;
+          if (!started) {
+            started = true;
+            setLoading(false);
+            setIsAssistantTyping(false);
+            setChatHistory((prevChatHistory) => [...prevChatHistory, { speaker: 'Assistant', content }]);
+          } else {
+            setChatHistory((prevChatHistory) => [...prevChatHistory.slice(0, -1), { speaker: 'Assistant', content }]);
+          }
+        }
+      };
+
+      while (true) {
+        const { done, value } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        const events = buffer.split('\n\n');
+        buffer = events.pop();
+        events
+          .filter(event => event.startsWith('data: '))
+          .forEach(event => handleEvent(JSON.parse(event.slice(6))));
       }
 
-      // Add assistant message to chat history
-      setChatHistory((prevChatHistory) => [...prevChatHistory, { speaker: 'Assistant', content: data.response }]);
-      localStorage.setItem('chatHistory', JSON.stringify([...chatHistory, userMessage, { speaker: 'Assistant', content: data.response }]));
+      setLoading(false);
+      setIsAssistantTyping(false);
+      localStorage.setItem('chatHistory', JSON.stringify([...chatHistory, userMessage, { speaker: 'Assistant', content: assistantContent }]));
 
-      const updatedChats = [...chats.filter(chat => chat.title !== chatTitle), { title: chatTitle === 'New Chat' ? data.chat_name : chatTitle, history: [...chatHistory, userMessage, { speaker: 'Assistant', content: data.response }] }];
+      const updatedChats = [...chats.filter(chat => chat.title !== chatTitle), { title: chatTitle === 'New Chat' ? chatName : chatTitle, chat_id: currentChatId, history: [...chatHistory, userMessage, { speaker: 'Assistant', content: assistantContent }] }];
       setChats(updatedChats);
       localStorage.setItem('chats', JSON.stringify(updatedChats));
 
@@ -172,9 +223,11 @@ function App() {
 
     if (chatTitle === title) {
       setChatTitle('New Chat');
+      setChatId(null);
       setChatHistory([]);
       localStorage.removeItem('chatHistory');
       localStorage.removeItem('chatTitle');
+      localStorage.removeItem('chatId');
     }
   };
 
@@ -182,9 +235,15 @@ function App() {
     const chat = chats.find(chat => chat.title === title);
     if (chat) {
       setChatTitle(chat.title);
+      setChatId(chat.chat_id || null);
       setChatHistory(chat.history);
       localStorage.setItem('chatHistory', JSON.stringify(chat.history));
       localStorage.setItem('chatTitle', chat.title);
+      if (chat.chat_id) {
+        localStorage.setItem('chatId', chat.chat_id);
+      } else {
+        localStorage.removeItem('chatId');
+      }
       if (window.innerWidth < 768) {
         setShowSavedChats(false);
       }
@@ -193,9 +252,11 @@ function App() {
 
   const newChat = () => {
     setChatTitle('New Chat');
+    setChatId(null);
     setChatHistory([]);
     localStorage.removeItem('chatHistory');
     localStorage.removeItem('chatTitle');
+    localStorage.removeItem('chatId');
     if (window.innerWidth < 768) {
       setShowSavedChats(false);
     }